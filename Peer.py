@@ -5,12 +5,39 @@
 '''
 import asyncio
 import atexit
+import os
 import socket
 import threading
 import select
 import logging
 import bcrypt
 import pickle
+import queue
+import time
+
+import protocol
+from hello_ingest import parse_hello_ack
+import log_pipeline
+import profiling
+import room_overlay
+import roster_codec
+import roster_versions
+
+# a login that is answered with login-busy is sent again after a growing delay
+LOGIN_RETRIES = 5
+LOGIN_RETRY_DELAY = 0.2
+
+# seconds between hello messages until the registry tells another interval
+HELLO_INTERVAL = 20
+
+# room messages that may wait for the room sender, more are dropped
+ROOM_SEND_QUEUE = 256
+
+# the messages are formatted by the writer thread of the log, room messages are rate limited,
+# see log_pipeline
+chatLog = logging.getLogger(log_pipeline.PEER_CHAT)
+registryLog = logging.getLogger(log_pipeline.PEER_REGISTRY)
+roomLog = logging.getLogger(log_pipeline.PEER_ROOM)
 
 
 # Server side of peer
@@ -92,7 +119,7 @@ class PeerServer(threading.Thread):
                         # message is received from connected peer
                         messageReceived = s.recv(1024).decode()
                         # logs the received message
-                        logging.info("Received from " + str(self.connectedPeerIP) + " -> " + str(messageReceived))
+                        chatLog.info("Received from %s -> %s", self.connectedPeerIP, messageReceived)
                         # if message is a request message it means that this is the receiver side peer server
                         # so evaluate the chat request
                         if len(messageReceived) > 11 and messageReceived[:12] == "CHAT-REQUEST":
@@ -152,9 +179,9 @@ class PeerServer(threading.Thread):
                             print("Press enter to quit the chat: ")
             # handles the exceptions, and logs them
             except OSError as oErr:
-                logging.error("OSError: {0}".format(oErr))
+                chatLog.error("OSError: %s", oErr)
             except ValueError as vErr:
-                logging.error("ValueError: {0}".format(vErr))
+                chatLog.error("ValueError: %s", vErr)
 
 
 # Client side of peer
@@ -189,15 +216,14 @@ class PeerClient(threading.Thread):
             # composes a request message and this is sent to server and then this waits a response message from the server this client connects
             requestMessage = "CHAT-REQUEST " + str(self.peerServer.peerServerPort) + " " + self.username
             # logs the chat request sent to other peer
-            logging.info("Send to " + self.ipToConnect + ":" + str(self.portToConnect) + " -> " + requestMessage)
+            chatLog.info("Send to %s:%s -> %s", self.ipToConnect, self.portToConnect, requestMessage)
             # sends the chat request
             self.tcpClientSocket.send(requestMessage.encode())
             print("Request message " + requestMessage + " is sent...")
             # received a response from the peer which the request message is sent to
             self.responseReceived = self.tcpClientSocket.recv(1024).decode()
             # logs the received message
-            logging.info(
-                "Received from " + self.ipToConnect + ":" + str(self.portToConnect) + " -> " + self.responseReceived)
+            chatLog.info("Received from %s:%s -> %s", self.ipToConnect, self.portToConnect, self.responseReceived)
            # print("Response is " + self.responseReceived)
             # parses the response for the chat request
             self.responseReceived = self.responseReceived.split()
@@ -214,7 +240,7 @@ class PeerClient(threading.Thread):
                     if(messageSent != " "):
                         # sends the message to the connected peer, and logs it
                         self.tcpClientSocket.send(messageSent.encode())
-                        logging.info("Send to " + self.ipToConnect + ":" + str(self.portToConnect) + " -> " + messageSent)
+                        chatLog.info("Send to %s:%s -> %s", self.ipToConnect, self.portToConnect, messageSent)
                     # if the quit message is sent, then the server status is changed to not chatting
                     # and this is the side that is ending the chat
                     if messageSent == ":q":
@@ -228,9 +254,9 @@ class PeerClient(threading.Thread):
                         # logs the message and handles the exception
                         try:
                             self.tcpClientSocket.send(":q ending-side".encode())
-                            logging.info("Send to " + self.ipToConnect + ":" + str(self.portToConnect) + " -> :q")
+                            chatLog.info("Send to %s:%s -> :q", self.ipToConnect, self.portToConnect)
                         except BrokenPipeError as bpErr:
-                            logging.error("BrokenPipeError: {0}".format(bpErr))
+                            chatLog.error("BrokenPipeError: %s", bpErr)
                     # closes the socket
                     self.responseReceived = None
                     self.tcpClientSocket.close()
@@ -240,7 +266,7 @@ class PeerClient(threading.Thread):
                 self.peerServer.isChatRequested = 0
                 print("client of requester is closing...")
                 self.tcpClientSocket.send("REJECT".encode())
-                logging.info("Send to " + self.ipToConnect + ":" + str(self.portToConnect) + " -> REJECT")
+                chatLog.info("Send to %s:%s -> REJECT", self.ipToConnect, self.portToConnect)
                 self.tcpClientSocket.close()
             # if a busy response is received, closes the socket
             elif self.responseReceived[0] == "BUSY":
@@ -254,14 +280,14 @@ class PeerClient(threading.Thread):
             # ok response is sent to the requester side
             okMessage = "OK"
             self.tcpClientSocket.send(okMessage.encode())
-            logging.info("Send to " + self.ipToConnect + ":" + str(self.portToConnect) + " -> " + okMessage)
+            chatLog.info("Send to %s:%s -> %s", self.ipToConnect, self.portToConnect, okMessage)
             print("Client with OK message is created... and sending messages")
             # client can send messsages as long as the server status is chatting
             while self.peerServer.isChatRequested == 1:
                 # input prompt for user to enter message
                 messageSent = input()
                 self.tcpClientSocket.send(messageSent.encode())
-                logging.info("Send to " + self.ipToConnect + ":" + str(self.portToConnect) + " -> " + messageSent)
+                chatLog.info("Send to %s:%s -> %s", self.ipToConnect, self.portToConnect, messageSent)
                 # if a quit message is sent, server status is changed
                 if messageSent == ":q":
                     self.peerServer.isChatRequested = 0
@@ -273,11 +299,145 @@ class PeerClient(threading.Thread):
             if self.peerServer.isChatRequested == 0:
                 if not self.isEndingChat:
                     self.tcpClientSocket.send(":q ending-side".encode())
-                    logging.info("Send to " + self.ipToConnect + ":" + str(self.portToConnect) + " -> :q")
+                    chatLog.info("Send to %s:%s -> :q", self.ipToConnect, self.portToConnect)
                 self.responseReceived = None
                 self.tcpClientSocket.close()
 
 
+# member of the chat room this peer is in
+class RoomMember:
+    __slots__ = ("username", "ip", "tcpPort", "udpPort", "address")
+
+    def __init__(self, username, ip, udpPort, tcpPort=None):
+        self.username = username
+        self.ip = ip
+        self.tcpPort = tcpPort
+        self.udpPort = udpPort
+        # udp address the room messages are sent to and received from
+        self.address = (ip, udpPort)
+
+
+# members of the chat room this peer is in
+# members are found by username and by the udp address a datagram comes from in O(1),
+# joins and leaves change the indexes in place and the send list is rebuilt only when it is
+# needed after a change
+class RoomState:
+
+    def __init__(self, username):
+        # username of this peer, it is not a member of its own room state
+        self.username = username
+        self.byName = {}
+        self.byAddress = {}
+        # a datagram of a member on this host may come from another local address than the one
+        # the registry has, such datagrams are told apart by their port
+        self.byPort = {}
+        self.destinationList = None
+
+    def __len__(self):
+        return len(self.byName)
+
+    def __iter__(self):
+        return iter(self.byName.values())
+
+    def __contains__(self, username):
+        return username in self.byName
+
+    # replaces the members with (username, ip address, tcp port, udp port) of each member
+    def reset(self, members=()):
+        self.byName.clear()
+        self.byAddress.clear()
+        self.byPort.clear()
+        self.destinationList = None
+        for username, ip, tcpPort, udpPort in members:
+            self.join(username, ip, int(udpPort), tcpPort)
+
+    def join(self, username, ip, udpPort, tcpPort=None):
+        if username == self.username:
+            return
+        self.leave(username)
+        member = RoomMember(username, ip, udpPort, tcpPort)
+        self.byName[username] = member
+        self.byAddress[member.address] = member
+        self.byPort[udpPort] = member
+        self.destinationList = None
+
+    def leave(self, username):
+        member = self.byName.pop(username, None)
+        if member is None:
+            return
+        if self.byAddress.get(member.address) is member:
+            del self.byAddress[member.address]
+        if self.byPort.get(member.udpPort) is member:
+            del self.byPort[member.udpPort]
+        self.destinationList = None
+
+    # username of the member a datagram is received from, or None
+    def username_by_address(self, address):
+        member = self.byAddress.get(address) or self.byPort.get(address[1])
+        return member.username if member is not None else None
+
+    # (username, address) of every member, the list is shared until the members change
+    def destinations(self):
+        if self.destinationList is None:
+            self.destinationList = [(member.username, member.address) for member in self.byName.values()]
+        return self.destinationList
+
+
+# Sender of the room messages
+# a message is encoded once and queued with the addresses it goes to, this thread sends it
+# so that typing in the console never waits for the network
+class RoomSender(threading.Thread):
+
+    def __init__(self, udpSocket, queueSize=ROOM_SEND_QUEUE):
+        threading.Thread.__init__(self, daemon=True)
+        self.udpSocket = udpSocket
+        self.queue = queue.Queue(maxsize=queueSize)
+        # username -> [sent, send errors, dropped] datagrams
+        self.counts = {}
+        self.countsLock = threading.Lock()
+
+    def count(self, username, index):
+        with self.countsLock:
+            counts = self.counts.get(username)
+            if counts is None:
+                counts = self.counts[username] = [0, 0, 0]
+            counts[index] += 1
+
+    # queues a datagram for (username, address) destinations, returns False if the queue is full
+    def enqueue(self, datagram, destinations):
+        try:
+            self.queue.put_nowait((datagram, destinations))
+            return True
+        except queue.Full:
+            for username, _ in destinations:
+                self.count(username, 2)
+            return False
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            datagram, destinations = job
+            for username, address in destinations:
+                try:
+                    self.udpSocket.sendto(datagram, address)
+                    self.count(username, 0)
+                except OSError as e:
+                    self.count(username, 1)
+                    roomLog.error("Room message to %s is not sent: %s", username, e)
+
+    # sends what is queued and stops
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+    def stats(self):
+        with self.countsLock:
+            return {username: {"sent": counts[0], "errors": counts[1], "dropped": counts[2]}
+                    for username, counts in self.counts.items()}
+
+
 # main process of the peer
 class peerMain:
 
@@ -293,12 +453,18 @@ class peerMain:
         # tcp socket connection to registry
         self.tcpClientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.tcpClientSocket.connect((self.registryName, self.registryPort))
+        # commands and replies exchanged with the registry as length-prefixed frames
+        # P2P_PROTOCOL=legacy keeps the "#...#" protocol for registries that are not upgraded yet
+        self.registryChannel = protocol.RegistryChannel(self.tcpClientSocket,
+                                                        os.environ.get("P2P_PROTOCOL", "framed") == "legacy")
         # initializes udp socket which is used to send hello messages
         self.udpClientSocket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
         # udp port of the registry
         self.registryUDPPort = 15500
         # login info of the peer
         self.loginCredentials = (None, None)
+        # session token given by the registry on login, used to resume the login on a new connection
+        self.sessionToken = None
         # online status of the peer
         self.isOnline = False
         # server port number of this peer
@@ -310,14 +476,36 @@ class peerMain:
         # timer initialization
         self.timer = None
         self.peerUDPportnumber=None
-        #list of room members containing their info (username,ip address and port numbers)
-        self.list_of_members= []
+        # udp port of this peer as the registry sees it, learned from the first hello acknowledgement
+        self.udpPortKnown = threading.Event()
+        # heartbeat interval told by the registry, and whether the registry counts the commands
+        # sent to it as heartbeats, then no hello message is sent while commands are sent
+        self.helloInterval = HELLO_INTERVAL
+        self.commandsAreHeartbeats = False
+        self.lastHello = 0.0
+        self.is_inroom = False
+        # members of the room this peer is in, with their ip addresses and port numbers
+        self.room = None
+        # name and roster version of the last room, joining it again only fetches the changes
+        self.roomName = None
+        self.rosterVersion = roster_versions.NO_VERSION
+        # room messages are sent to every member (flat) or along an overlay tree (tree)
+        self.roomFanout = os.environ.get("P2P_ROOM_FANOUT", room_overlay.FANOUT_FLAT)
+        # fan-out tree of the room, rebuilt as members join and leave
+        self.overlay = None
+        # sequence number of the room messages sent by this peer
+        self.messageSequence = 0
+        # sender thread of the room messages
+        self.roomSender = None
         # Register cleanup function with atexit
         atexit.register(self.cleanup)
 
         choice = "0"
-        # log file initialization
-        logging.basicConfig(filename="peer.log", level=logging.INFO)
+        # log file initialization, the categories are set like the options of the registry:
+        # P2P_LOG_LEVEL=peer.chat=WARNING P2P_LOG_RATE=peer.room=100
+        log_pipeline.setup_logging("peer.log", log_pipeline.parse_categories([os.environ.get("P2P_LOG_LEVEL", "")]),
+                                   log_pipeline.parse_categories([os.environ.get("P2P_LOG_SAMPLE", "")], int),
+                                   log_pipeline.parse_categories([os.environ.get("P2P_LOG_RATE", "")], float))
         # as long as the user is not logged out, asks to select an option in the menu
         while choice != "3":
 
@@ -351,6 +539,12 @@ class peerMain:
                     # creates the server thread for this peer, and runs it
                     self.peerServer = PeerServer(self.loginCredentials[0], self.peerServerPort)
                     self.peerServer.start()
+                    # the udp socket is read by a single thread while the peer is online,
+                    # it receives the hello acknowledgements and the room messages
+                    self.udpPortKnown.clear()
+                    self.lastHello = 0.0
+                    self.commandsAreHeartbeats = False
+                    threading.Thread(target=self.recieve_udp, daemon=True).start()
                     # hello message is sent to registry
                     hello = self.sendHelloMessage()
             # if choice is 3 and user is logged in, then user is logged out
@@ -437,7 +631,7 @@ class peerMain:
             # main process waits for the client thread to finish its chat
             elif choice == "OK" and self.isOnline:
                 okMessage = "OK " + self.loginCredentials[0]
-                logging.info("Send to " + self.peerServer.connectedPeerIP + " -> " + okMessage)
+                chatLog.info("Send to %s -> %s", self.peerServer.connectedPeerIP, okMessage)
                 self.peerServer.connectedPeerSocket.send(okMessage.encode())
                 self.peerClient = PeerClient(self.peerServer.connectedPeerIP, self.peerServer.connectedPeerPort,
                                              self.loginCredentials[0], self.peerServer, "OK")
@@ -447,7 +641,7 @@ class peerMain:
             elif choice == "REJECT" and self.isOnline:
                 self.peerServer.connectedPeerSocket.send("REJECT".encode())
                 self.peerServer.isChatRequested = 0
-                logging.info("Send to " + self.peerServer.connectedPeerIP + " -> REJECT")
+                chatLog.info("Send to %s -> REJECT", self.peerServer.connectedPeerIP)
             # if choice is cancel timer for hello message is cancelled
             elif choice == "CANCEL":
                 self.timer.cancel()
@@ -468,11 +662,11 @@ class peerMain:
         # if response is success then informs the user for account creation
         # if response is exist then informs the user for account existence
         hashed_password = self.hash_password(password)
-        message = "#"+"JOIN" + " " + username + " " + hashed_password.decode('utf-8') + "#"
-        logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024).decode()
-        logging.info("Received from " + self.registryName + " -> " + response)
+        message = "JOIN" + " " + username + " " + hashed_password.decode('utf-8')
+        registryLog.info("Send to %s:%s -> %s", self.registryName, self.registryPort, message)
+        self.registryChannel.send_command(message)
+        response = self.registryChannel.receive_text()
+        registryLog.info("Received from %s -> %s", self.registryName, response)
         if response == "join-success":
             print("\033[31mAccount created... \033[0m")
         elif response == "join-exist":
@@ -482,11 +676,22 @@ class peerMain:
     def login(self, username, password, peerServerPort):
         # a login message is composed and sent to registry
         # an integer is returned according to each response
-        message = "#" + "LOGIN" + " " + username + " " + password + " " + str(peerServerPort) + "#"
-        logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024).decode()
-        logging.info("Received from " + self.registryName + " -> " + response)
+        # the registry is asked for a session token as well
+        message = "LOGIN" + " " + username + " " + password + " " + str(peerServerPort) + " token"
+        for attempt in range(LOGIN_RETRIES):
+            registryLog.info("Send to %s:%s -> %s", self.registryName, self.registryPort, message)
+            self.registryChannel.send_command(message)
+            response = self.registryChannel.receive_text()
+            registryLog.info("Received from %s -> %s", self.registryName, response)
+            # the registry is checking too many passwords, the login is sent again later
+            if response != "login-busy":
+                break
+            time.sleep(LOGIN_RETRY_DELAY * 2 ** attempt)
+        # login-success is followed by the session token if the registry gives one
+        fields = response.split()
+        if fields and fields[0] == "login-success":
+            response = "login-success"
+            self.sessionToken = fields[1] if len(fields) > 1 else None
         if response == "login-success":
             print("\033[93mLogged in successfully...\033[0m")
             return 1
@@ -499,29 +704,74 @@ class peerMain:
         elif response == "login-wrong-password":
             print("\033[93mWrong password...\033[0m")
             return 3
+        elif response == "login-busy":
+            print("\033[93mRegistry is busy, try again later...\033[0m")
+            return 4
 
     # logout function
     def logout(self, option):
         # a logout message is composed and sent to registry
         # timer is stopped
         if option == 1:
-            message = "#" + "LOGOUT" + " " + self.loginCredentials[0] + "#"
+            message = "LOGOUT" + " " + self.loginCredentials[0]
             self.timer.cancel()
+            self.sessionToken = None
         else:
-            message = "#" + "LOGOUT" + "#"
-        logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
+            message = "LOGOUT"
+        registryLog.info("Send to %s:%s -> %s", self.registryName, self.registryPort, message)
+        self.registryChannel.send_command(message)
+
+    # connects to the registry again after it closed the connection,
+    # e.g. when no hello message of this peer reached it in time
+    # the login is resumed with the session token, or done again with the password
+    # returns True if the peer is connected and logged in as before
+    def reconnect(self):
+        try:
+            self.tcpClientSocket.close()
+            self.tcpClientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.tcpClientSocket.connect((self.registryName, self.registryPort))
+        except OSError as e:
+            registryLog.error("Could not connect to the registry: %s", e)
+            return False
+        self.registryChannel = protocol.RegistryChannel(self.tcpClientSocket, self.registryChannel.legacy)
+        if not self.isOnline:
+            return True
+        if self.sessionToken is not None:
+            message = "RESUME " + self.sessionToken + " " + str(self.peerServerPort)
+            registryLog.info("Send to %s:%s -> RESUME", self.registryName, self.registryPort)
+            self.registryChannel.send_command(message)
+            response = self.registryChannel.receive_text()
+            registryLog.info("Received from %s -> %s", self.registryName, response)
+            if response == "resume-success":
+                return True
+        return self.login(self.loginCredentials[0], self.loginCredentials[1], self.peerServerPort) == 1
+
+    # sends a command and returns the text reply of the registry
+    # the command is sent once more after reconnecting if the registry closed the connection
+    def requestText(self, message):
+        with profiling.timed(message.split(" ", 1)[0]):
+            return self.requestTextOnce(message)
+
+    def requestTextOnce(self, message):
+        registryLog.info("Send to %s:%s -> %s", self.registryName, self.registryPort, message)
+        try:
+            self.registryChannel.send_command(message)
+            response = self.registryChannel.receive_text()
+        except OSError:
+            response = ""
+        if response == "" and self.reconnect():
+            self.registryChannel.send_command(message)
+            response = self.registryChannel.receive_text()
+        registryLog.info("Received from %s -> %s", self.registryName, response)
+        return response
 
     # function for searching an online user
     def searchUser(self, username):
         # a search message is composed and sent to registry
         # custom value is returned according to each response
         # to this search message
-        message = "#" + "SEARCH" + " " + username + "#"
-        logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024).decode().split()
-        logging.info("Received from " + self.registryName + " -> " + " ".join(response))
+        message = "SEARCH" + " " + username
+        response = self.requestText(message).split()
         if response[0] == "search-success":
             print(username + " \033[93mis found successfully...\033[0m")
             return response[1]
@@ -533,105 +783,191 @@ class peerMain:
             return None
 
     def Createchatroom(self, room_name):
-        message = "#" + "CREATE" + " " + room_name + "#"
-        logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024).decode()
-        logging.info("Received from " + self.registryName + " -> " + " ".join(response))
+        message = "CREATE" + " " + room_name
+        response = self.requestText(message)
         return response
 
     def joinRoom(self, room_name, username, ip_address, tcp_port_number,udp_port_number):
-        message = "#" +"JOIN-ROOM"+ " "  + room_name + " " + username+ " " + str(ip_address) + " " + str(tcp_port_number) + " " + str(udp_port_number) + "#"
-        logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
+        # the roster of the last room is kept, the registry sends the changes since its version
+        if room_name != self.roomName or self.room is None:
+            self.roomName = room_name
+            self.rosterVersion = roster_versions.NO_VERSION
+            self.room = RoomState(self.loginCredentials[0])
+            self.overlay = room_overlay.OverlayTree(self.loginCredentials[0])
+        # the udp port of this peer is learned from the acknowledgement of the first hello message
+        if udp_port_number is None:
+            self.udpPortKnown.wait(5)
+            if self.peerUDPportnumber is None and self.udpPortKnown.is_set():
+                self.set_udp_peer_portnumber()
+            udp_port_number = self.peerUDPportnumber
+        message = "JOIN-ROOM"+ " "  + room_name + " " + username+ " " + str(ip_address) + " " + str(tcp_port_number) + " " + str(udp_port_number) + " " + self.rosterVersion
+        registryLog.info("Send to %s:%s -> %s", self.registryName, self.registryPort, message)
+        self.registryChannel.send_command(message)
+        self.roomSender = RoomSender(self.udpClientSocket)
+        self.roomSender.start()
         recieve_tcpthread=threading.Thread(target=self.recieve_tcp)
         recieve_tcpthread.start()
-        recieve_udp_thread = threading.Thread(target=self.recieve_udp)
-        recieve_udp_thread.start()
         self.peerServer.isChatRequested=1
         message = " "
         while "leave" not in message:
-            self.broadcast_message(message, self.list_of_members)
+            self.broadcast_message(message)
             message = input()
         self.leaveRoom(self.loginCredentials[0],room_name)
-        recieve_udp_thread.join()  # Wait for the thread to complete before moving on
         recieve_tcpthread.join()
+        self.roomSender.stop()
+        for member_name, counts in self.roomSender.stats().items():
+            if counts["errors"] or counts["dropped"]:
+                roomLog.warning("Room messages to %s: %s", member_name, counts)
         self.peerServer.isChatRequested = 0
 
     def recieve_tcp(self):
-        tcpSocket = self.tcpClientSocket
-        inputs = [tcpSocket]
         self.is_inroom = True
         while self.is_inroom:
             #listens to the server
-            readable, _, _ = select.select(inputs, [], [])
-            for s in readable:
-                message = s.recv(4096)
+            message = self.registryChannel.receive()
+            # registry closed the connection
+            if message is None:
+                self.is_inroom = False
+                break
+            # the member list of the room is received after joining it
+            # only the legacy protocol sends it pickled
+            if message.kind == protocol.MEMBERS:
+                try:
+                    if self.registryChannel.legacy:
+                        received_members_list = [(member["username"], member["IP address"],
+                                                  member.get("TCP_Port_number"), member["UDP_Port_number"])
+                                                 for member in pickle.loads(message.payload)]
+                    else:
+                        received_members_list = roster_codec.decode_members(message.payload)
+                    self.apply_roster({"version": roster_versions.NO_VERSION, "snapshot": True, "page": 0,
+                                       "last": True, "members": received_members_list, "left": []})
+                except (pickle.PickleError, roster_codec.CodecError) as e:
+                    print(f"Error deserializing data: {e}")
+                continue
+            # the roster of the room, or the changes since the roster version this peer has
+            if message.kind == protocol.ROSTER:
                 try:
-                    # Try to decode the message as a string
-                    message_decoded=message.decode()
-                    # Handle different types of messages
-                    if message_decoded.startswith("MEMBER-JOINED"):
-                        # Extract relevant information
-                        data = message_decoded.split()
-                        username = data[1]
-                        ip_address = data[2]
-                        udp_port_number = data[3]
-                        # Create member_data dictionary
-                        new_member = {
-                            "username": username,
-                            "IP address": ip_address,
-                            "UDP_Port_number": udp_port_number
-                        }
-                        self.list_of_members.append(new_member)
-                        print(f"{username} has joined the room")
-                    elif ("You joined the room" in message_decoded) or ("left" in message_decoded) or ("first member to join" in message_decoded):
-                        print(message_decoded)
-                    elif "YOU LEFT THE ROOM" in message_decoded:
-                        print("YOU LEFT THE ROOM")
-                        self.is_inroom = False
-                        udpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                        udpSocket.sendto(message_decoded.encode(),(self.peerServer.peerServerHostname,self.peerUDPportnumber))
-                        udpSocket.close()
-                    elif "Peer-LEFT" in message_decoded:
-                        username_left = message_decoded.split()[1]
-                        print(f"{username_left} has left the chatroom")
-                        # Use a list comprehension to create a new list excluding the member with the specified username
-                        self.list_of_members = [member for member in self.list_of_members if
-                                                member["username"] != username_left]
-                except UnicodeDecodeError:
-                    # Handle non-decodable messages (assumed to be binary pickled data)
-                    try:
-                        received_members_list = pickle.loads(message)
-                        self.list_of_members = received_members_list
-                        print("You joined the room , start chatting !")
-                    except pickle.PickleError as e:
-                        print(f"Error deserializing data: {e}")
+                    self.apply_roster(roster_codec.decode_roster(message.payload))
+                except roster_codec.CodecError as e:
+                    print(f"Error deserializing data: {e}")
+                continue
+            message_decoded = message.text()
+            # Handle different types of messages
+            if message_decoded.startswith("MEMBER-JOINED"):
+                # Extract relevant information
+                data = message_decoded.split()
+                username = data[1]
+                ip_address = data[2]
+                udp_port_number = int(data[3])
+                self.room.join(username, ip_address, udp_port_number)
+                self.overlay.add(username, (ip_address, udp_port_number))
+                print(f"{username} has joined the room")
+            # a member that is logged out by the registry is taken out of the room as well
+            elif message_decoded.endswith("left the room due to disconnection"):
+                print(message_decoded)
+                username_left = message_decoded.split()[0]
+                self.room.leave(username_left)
+                self.overlay.remove(username_left)
+            elif ("You joined the room" in message_decoded) or ("left" in message_decoded) or ("first member to join" in message_decoded):
+                print(message_decoded)
+            elif "YOU LEFT THE ROOM" in message_decoded:
+                print("YOU LEFT THE ROOM")
+                self.is_inroom = False
+            elif "Peer-LEFT" in message_decoded:
+                username_left = message_decoded.split()[1]
+                print(f"{username_left} has left the chatroom")
+                self.room.leave(username_left)
+                self.overlay.remove(username_left)
 
         return
 
+    # applies a roster frame to the room state and the overlay tree
+    def apply_roster(self, roster):
+        with profiling.timed("apply_roster"):
+            self.applyRosterFrame(roster)
+
+    def applyRosterFrame(self, roster):
+        if roster["snapshot"] and roster["page"] == 0:
+            self.room.reset()
+            self.overlay = room_overlay.OverlayTree(self.loginCredentials[0])
+        # members are (username, ip address, tcp port, udp port)
+        for username, ip_address, tcp_port_number, udp_port_number in roster["members"]:
+            udp_port_number = int(udp_port_number)
+            self.room.join(username, ip_address, udp_port_number, tcp_port_number)
+            if username != self.loginCredentials[0]:
+                self.overlay.add(username, (ip_address, udp_port_number))
+        for username_left in roster["left"]:
+            self.room.leave(username_left)
+            self.overlay.remove(username_left)
+        if roster["last"]:
+            self.rosterVersion = roster["version"]
+            if len(self.room):
+                print("You joined the room , start chatting !")
+            else:
+                print("You are the first member to join the room ! ")
+
+    # reads the udp socket while the peer is online
+    # hello acknowledgements of the registry are handled here, room messages only while in a room
     def recieve_udp(self):
         udpSocket = self.udpClientSocket
         inputs = [udpSocket]
-        while self.is_inroom:
+        while self.isOnline:
             try:
-                readable, _, _ = select.select(inputs, [], [])
-                if readable:
-                    message_received, clientAddress = udpSocket.recvfrom(1024)
-                    message_received = message_received.decode()
-                    if("YOU LEFT THE ROOM" in message_received):
-                        break
-                    username = self.get_username_by_port(int(clientAddress[1]))
-                    print(f'{username}: {message_received}')
-
+                # wakes up every second to notice a logout
+                readable, _, _ = select.select(inputs, [], [], 1.0)
+                if not readable:
+                    continue
+                message_received, clientAddress = udpSocket.recvfrom(65535)
+                if clientAddress[1] == self.registryUDPPort and self.handle_hello_ack(message_received):
+                    continue
+                if not self.is_inroom:
+                    continue
+                with profiling.timed("room message"):
+                    self.handle_room_message(message_received, clientAddress)
+            except (OSError, ValueError) as e:
+                # the socket is closed on exit
+                if not self.isOnline:
+                    break
+                print(f"Error in recieve_udp: {e}")
             except Exception as e:
                 print(f"Error in recieve_udp: {e}")
         return
 
+    def handle_room_message(self, message_received, clientAddress):
+        # a message forwarded along the overlay tree is passed on to the children
+        # of this peer in the tree of its origin
+        tree_message = room_overlay.decode_tree_message(message_received)
+        if tree_message is not None:
+            origin, sequence, text = tree_message
+            if self.overlay.first_seen(origin, sequence):
+                self.roomSender.enqueue(message_received, self.overlay.destinations(origin))
+                roomLog.info("Received from %s -> %s", origin, text)
+                print(f'{origin}: {text}')
+            return
+        message_received = message_received.decode()
+        username = self.room.username_by_address(clientAddress)
+        roomLog.info("Received from %s -> %s", username, message_received)
+        print(f'{username}: {message_received}')
+
+    # returns False if the datagram is not a hello acknowledgement
+    def handle_hello_ack(self, datagram):
+        ack = parse_hello_ack(datagram)
+        if ack is None:
+            return False
+        udp_port_number, interval = ack
+        # a registry that only acknowledges is asked for the udp port by the main thread before
+        # JOIN-ROOM, the registry channel is only used by that thread
+        if udp_port_number is not None:
+            self.peerUDPportnumber = udp_port_number
+            self.helloInterval = interval
+            self.commandsAreHeartbeats = True
+        self.udpPortKnown.set()
+        return True
+
     def leaveRoom(self, username,room_name):
-        message = "#" + "LEAVE" + " " + username + " " + room_name + "#"
-        logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
+        message = "LEAVE" + " " + username + " " + room_name
+        registryLog.info("Send to %s:%s -> %s", self.registryName, self.registryPort, message)
+        self.registryChannel.send_command(message)
         return
 
     def print_ChatRooms(self):
@@ -639,41 +975,43 @@ class peerMain:
         print(response)
 
     def get_chatrooms (self):
-        message = "#" + "PRINT_CHATROOMS" + "#"
-        logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024).decode()
-        logging.info("Received from " + self.registryName + " -> " + " ".join(response))
+        message = "PRINT_CHATROOMS"
+        response = self.requestText(message)
         return response
 
     def print_online_users(self):
-        message = "#" + "PRINT" + "#"
-        logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024).decode()
-        logging.info("Received from " + self.registryName + " -> " + " ".join(response))
+        message = "PRINT"
+        response = self.requestText(message)
         print(response)
 
     # function for sending hello message
     # a timer thread is used to send hello messages to udp socket of registry
+    # the acknowledgement is received by recieve_udp, this thread never waits for it
+    # a registry that counts commands as heartbeats gets a hello message only after the peer
+    # sent no command for a heartbeat interval
     def sendHelloMessage(self):
-        message = "HELLO " + " " + self.loginCredentials[0]
-        logging.info("Send to " + self.registryName + ":" + str(self.registryUDPPort) + " -> " + message)
-        self.udpClientSocket.sendto(message.encode(), (self.registryName, self.registryUDPPort))
-        # Wait for acknowledgment from the server
-        ack, server_address = self.udpClientSocket.recvfrom(1024)
-        if ack.decode() == "HELLO_ACK":
-            self.set_udp_peer_portnumber()
-
-        self.timer = threading.Timer(20, self.sendHelloMessage)
+        now = time.monotonic()
+        lastContact = self.lastHello
+        if self.commandsAreHeartbeats:
+            lastContact = max(lastContact, self.registryChannel.lastSent)
+        wait = lastContact + self.helloInterval - now
+        if wait <= 0:
+            message = "HELLO " + self.loginCredentials[0] + " +"
+            registryLog.info("Send to %s:%s -> %s", self.registryName, self.registryUDPPort, message)
+            self.udpClientSocket.sendto(message.encode(), (self.registryName, self.registryUDPPort))
+            self.lastHello = now
+            wait = self.helloInterval
+        self.timer = threading.Timer(wait, self.sendHelloMessage)
+        self.timer.daemon = True
         self.timer.start()
-        # return "done"
 
     def set_udp_peer_portnumber(self):
-        message = "#" + "PORTNUMBER" + "#"
-        self.tcpClientSocket.send(message.encode())
-        peer_udp_port= self.tcpClientSocket.recv(1024).decode()
-        self.peerUDPportnumber = int(peer_udp_port)
+        message = "PORTNUMBER"
+        self.registryChannel.send_command(message)
+        # notifications received before the reply are skipped
+        reply = self.registryChannel.receive_reply()
+        if reply is not None and reply.text().isdigit():
+            self.peerUDPportnumber = int(reply.text())
     def is_port_available(self,ip_no,port,udp=False):
         try:
             if udp :
@@ -693,15 +1031,20 @@ class peerMain:
         print("No ports available!")
         return None  # If no available port is found in the specified range
 
-    def get_username_by_port(self, target_port):
-        for member in self.list_of_members:
-            if member.get('UDP_Port_number') == str(target_port):
-                return member.get('username')
+    # the message is encoded once and handed to the room sender
+    def broadcast_message(self,message):
+     roomLog.info("Send to %s -> %s", self.roomName, message)
+     with profiling.timed("broadcast_message"):
+         self.send_room_message(message)
 
-    def broadcast_message(self,message,members_list):
-     for member in members_list :
-         if member["username"] != self.loginCredentials[0]:
-             self.udpClientSocket.sendto(message.encode(),(member["IP address"],int(member["UDP_Port_number"])))
+    def send_room_message(self, message):
+     # in tree mode the message is sent to the children of this peer only
+     if self.roomFanout == room_overlay.FANOUT_TREE and self.overlay is not None:
+         self.messageSequence += 1
+         datagram = room_overlay.encode_tree_message(self.loginCredentials[0], self.messageSequence, message)
+         self.roomSender.enqueue(datagram, self.overlay.destinations(self.loginCredentials[0]))
+         return
+     self.roomSender.enqueue(message.encode(), self.room.destinations())
 
     def cleanup(self):
         print("Performing cleanup...")
@@ -713,4 +1056,8 @@ class peerMain:
         finally:
             print("Cleanup completed.")
 
-peerMain= peerMain()
\ No newline at end of file
+# the peer is started when this file is run, importing it only defines the classes
+if __name__ == "__main__":
+    # P2P_PROFILE=sample or SIGUSR1 profiles the peer, see profiling
+    profiling.install("peer")
+    peerMain= peerMain()
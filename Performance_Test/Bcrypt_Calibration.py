@@ -0,0 +1,69 @@
+'''
+    ##  Cost of the password checks of LOGIN on this host
+    ##  Measures a bcrypt check for each cost factor, the logins per second a core and the whole
+    ##  auth pool can check, and suggests the --auth-workers and --auth-queue of the registry:
+    ##  python Bcrypt_Calibration.py --rounds 10 11 12 13 --latency-budget 2.0
+'''
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+import bcrypt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from auth_pool import AuthPool, check_password
+
+PASSWORD = "calibration-password"
+
+
+# milliseconds of a single check on one core
+def single_check(hashedPassword, checks):
+    latencies = []
+    for _ in range(checks):
+        start = time.perf_counter()
+        check_password(PASSWORD, hashedPassword)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies)
+
+
+# checks per second of the auth pool with every worker busy
+def pool_throughput(hashedPassword, workers, processes, checks):
+    pool = AuthPool(workers, queueLimit=checks, processes=processes)
+    # the pool is warmed up so that starting the workers is not measured
+    pool.verify(PASSWORD, hashedPassword)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=pool.verify, args=(PASSWORD, hashedPassword)) for _ in range(checks)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    return checks / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13], help="bcrypt cost factors")
+    parser.add_argument("--checks", type=int, default=5, help="checks timed on a single core")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="workers of the auth pool")
+    parser.add_argument("--processes", action="store_true", help="measure a process pool instead of threads")
+    parser.add_argument("--latency-budget", type=float, default=2.0,
+                        help="seconds a login may wait for its password check")
+    options = parser.parse_args()
+
+    # the peers hash with bcrypt.gensalt(), which is 12 rounds
+    print(f"cores: {os.cpu_count()}, pool: {options.workers} {'processes' if options.processes else 'threads'}")
+    print(f"{'rounds':>6} {'check ms':>10} {'logins/s/core':>14} {'pool logins/s':>14} {'scaling':>8} {'queue':>6}")
+    for rounds in options.rounds:
+        hashedPassword = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+        checkMs = single_check(hashedPassword, options.checks)
+        perCore = 1000 / checkMs
+        pool = pool_throughput(hashedPassword, options.workers, options.processes, options.workers * options.checks)
+        # checks that can wait and still be done within the latency budget
+        queue = max(0, int(options.latency_budget * pool) - options.workers)
+        print(f"{rounds:>6} {checkMs:>10.1f} {perCore:>14.1f} {pool:>14.1f} {pool / perCore:>8.2f} {queue:>6}")
+    print("queue is the --auth-queue that keeps a login within the latency budget")
@@ -0,0 +1,373 @@
+'''
+    ##  Results of the benchmarks
+    ##  Keeps the raw samples of a run, summarizes them in percentiles and throughput, writes them as
+    ##  json with the environment they were measured in, compares a run with a baseline and renders
+    ##  markdown and html reports with the scaling curves of a parameter sweep
+    ##  python Bench_Results.py compare run.json baseline.json --threshold 0.1
+    ##  python Bench_Results.py report run.json --markdown report.md --html report.html
+'''
+import argparse
+import datetime
+import html
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+REPOSITORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+PERCENTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999))
+# a latency statistic that grows, or a throughput that drops, by more than this is a regression
+REGRESSION_THRESHOLD = 0.10
+# statistics compared with the baseline, throughput is compared the other way around
+COMPARED = ("p50", "p99", "throughput")
+
+
+# nearest rank percentile of sorted samples
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+# count, min, mean, percentiles and max of samples, and their throughput if the elapsed seconds are known
+# an empty list gives zeros instead of failing
+def summarize(samples, elapsed=None):
+    ordered = sorted(samples)
+    summary = {"count": len(ordered), "min": ordered[0] if ordered else 0.0,
+               "mean": sum(ordered) / len(ordered) if ordered else 0.0}
+    for name, fraction in PERCENTILES:
+        summary[name] = percentile(ordered, fraction)
+    summary["max"] = ordered[-1] if ordered else 0.0
+    if elapsed:
+        summary["throughput"] = len(ordered) / elapsed
+    return summary
+
+
+# where and on what the run was measured
+def environment():
+    metadata = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "python": platform.python_implementation() + " " + platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "argv": sys.argv,
+    }
+    try:
+        metadata["git_commit"] = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPOSITORY_DIR, capture_output=True,
+                                                text=True, timeout=5).stdout.strip() or None
+        metadata["git_dirty"] = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                                    cwd=REPOSITORY_DIR, capture_output=True, text=True,
+                                                    timeout=5).stdout.strip())
+    except (OSError, subprocess.SubprocessError):
+        metadata["git_commit"] = None
+    return metadata
+
+
+# samples of a single run with its parameters, latencies are in seconds
+class BenchRun:
+
+    def __init__(self, name, parameters=None):
+        self.name = name
+        self.parameters = dict(parameters or {})
+        self.samples = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    def record(self, metric, value):
+        self.samples.setdefault(metric, []).append(value)
+
+    def extend(self, metric, values):
+        self.samples.setdefault(metric, []).extend(values)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    # with run.time("SIGNUP"): ... records the seconds the block took
+    @contextmanager
+    def time(self, metric):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(metric, time.perf_counter() - start)
+
+    def finish(self, elapsed=None):
+        self.elapsed = elapsed if elapsed is not None else time.perf_counter() - self.started
+        return self
+
+    # raw: the samples are kept in the json so that a later run can be compared in any way
+    def result(self, raw=False):
+        if self.elapsed is None:
+            self.finish()
+        result = {"name": self.name, "parameters": self.parameters, "elapsed": self.elapsed,
+                  "metrics": {metric: summarize(samples, self.elapsed) for metric, samples in self.samples.items()},
+                  "counters": self.counters}
+        if raw:
+            result["samples"] = self.samples
+        return result
+
+
+# runs the benchmark for every combination of the parameters
+# grid: parameter -> values, e.g. {"peers": [100, 1000], "rooms": [1, 10], "peers_per_room": [5]}
+# run(**parameters) returns a BenchRun
+def sweep(grid, run):
+    names = list(grid)
+    runs = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        runs.append(run(**dict(zip(names, values))))
+    return runs
+
+
+def document(runs, raw=False):
+    return {"environment": environment(), "runs": [run.result(raw) if isinstance(run, BenchRun) else run
+                                                   for run in runs]}
+
+
+def write_json(path, runs, raw=False):
+    data = document(runs, raw)
+    with open(path, "w") as output:
+        json.dump(data, output, indent=1)
+    return data
+
+
+def load(path):
+    with open(path) as source:
+        return json.load(source)
+
+
+def run_key(run):
+    return run["name"], tuple(sorted((name, str(value)) for name, value in run["parameters"].items()))
+
+
+def describe(run):
+    parameters = ", ".join(f"{name}={value}" for name, value in sorted(run["parameters"].items()))
+    return run["name"] + (f" ({parameters})" if parameters else "")
+
+
+# compares the runs with the runs of the baseline that have the same name and parameters
+# returns a row for each compared statistic: run, metric, statistic, baseline, current, change, regression
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    baselineRuns = {run_key(run): run for run in baseline["runs"]}
+    rows = []
+    for run in current["runs"]:
+        previous = baselineRuns.get(run_key(run))
+        if previous is None:
+            continue
+        for metric, summary in run["metrics"].items():
+            before = previous["metrics"].get(metric)
+            if before is None:
+                continue
+            for statistic in COMPARED:
+                if statistic not in summary or not before.get(statistic):
+                    continue
+                change = (summary[statistic] - before[statistic]) / before[statistic]
+                # more is better for throughput, less is better for latencies
+                regression = -change > threshold if statistic == "throughput" else change > threshold
+                rows.append({"run": describe(run), "metric": metric, "statistic": statistic,
+                             "baseline": before[statistic], "current": summary[statistic], "change": change,
+                             "regression": regression})
+    return rows
+
+
+def format_value(statistic, value):
+    if statistic in ("count", "throughput"):
+        return f"{value:.1f}"
+    # latencies are shown in milliseconds
+    return f"{value * 1000:.2f}"
+
+
+# parameters that take more than one value in the runs of a name, the x axis of the scaling curves
+def swept_parameters(runs):
+    values = {}
+    for run in runs:
+        for name, value in run["parameters"].items():
+            values.setdefault(name, set()).add(str(value))
+    return [name for name, seen in values.items() if len(seen) > 1]
+
+
+# points (parameter value, statistic) of a metric, the other parameters fixed to their first values
+def curve(runs, parameter, metric, statistic):
+    others = {name: value for name, value in runs[0]["parameters"].items() if name != parameter}
+    points = []
+    for run in runs:
+        if all(run["parameters"].get(name) == value for name, value in others.items()) and metric in run["metrics"]:
+            points.append((run["parameters"][parameter], run["metrics"][metric].get(statistic, 0.0)))
+    return sorted(points, key=lambda point: number_order(point[0]))
+
+
+# numbers in their order, then the other values by name
+def number_order(value):
+    try:
+        return 0, float(value), ""
+    except (TypeError, ValueError):
+        return 1, 0.0, str(value)
+
+
+def runs_by_name(data):
+    grouped = {}
+    for run in data["runs"]:
+        grouped.setdefault(run["name"], []).append(run)
+    return grouped
+
+
+def markdown_report(data, comparison=None):
+    env = data["environment"]
+    lines = ["# Benchmark results", "",
+             f"{env['timestamp']} on {env['hostname']} ({env['platform']}, {env['python']}, "
+             f"{env['cpu_count']} cpus), commit {env.get('git_commit') or 'unknown'}"
+             + (" with local changes" if env.get("git_dirty") else ""), ""]
+    for name, runs in runs_by_name(data).items():
+        lines += [f"## {name}", "", "Latencies in milliseconds, throughput per second.", ""]
+        lines.append("| parameters | metric | count | p50 | p90 | p99 | p99.9 | max | throughput |")
+        lines.append("|---|---|---|---|---|---|---|---|---|")
+        for run in runs:
+            parameters = ", ".join(f"{key}={value}" for key, value in run["parameters"].items())
+            for metric, summary in run["metrics"].items():
+                lines.append(f"| {parameters} | {metric} | {summary['count']} | "
+                             + " | ".join(format_value(statistic, summary[statistic])
+                                          for statistic in ("p50", "p90", "p99", "p999", "max"))
+                             + f" | {format_value('throughput', summary.get('throughput', 0.0))} |")
+        lines.append("")
+        for parameter in swept_parameters(runs):
+            metrics = sorted({metric for run in runs for metric in run["metrics"]})
+            lines += [f"### Scaling with {parameter}", "",
+                      f"| {parameter} | " + " | ".join(f"{metric} p99" for metric in metrics) + " |",
+                      "|---|" + "---|" * len(metrics)]
+            curves = {metric: dict(curve(runs, parameter, metric, "p99")) for metric in metrics}
+            for value in sorted({value for points in curves.values() for value in points}, key=number_order):
+                lines.append(f"| {value} | " + " | ".join(
+                    format_value("p99", curves[metric][value]) if value in curves[metric] else "-"
+                    for metric in metrics) + " |")
+            lines.append("")
+    if comparison is not None:
+        lines += comparison_markdown(comparison)
+    return "\n".join(lines) + "\n"
+
+
+def comparison_markdown(comparison):
+    lines = ["## Comparison with the baseline", ""]
+    if not comparison:
+        return lines + ["No run of the baseline has the same name and parameters.", ""]
+    lines += ["| run | metric | statistic | baseline | current | change | |", "|---|---|---|---|---|---|---|"]
+    for row in comparison:
+        lines.append(f"| {row['run']} | {row['metric']} | {row['statistic']} | "
+                     f"{format_value(row['statistic'], row['baseline'])} | "
+                     f"{format_value(row['statistic'], row['current'])} | {row['change'] * 100:+.1f}% | "
+                     + ("**regression**" if row["regression"] else "") + " |")
+    return lines + [""]
+
+
+# line chart of the curves as inline svg, one line per metric
+def svg_chart(title, curves, width=560, height=280, margin=48):
+    colors = ("#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f")
+    values = [value for points in curves.values() for _, value in points]
+    xs = sorted({str(x) for points in curves.values() for x, _ in points}, key=number_order)
+    if not values or not xs:
+        return ""
+    top = max(values) or 1.0
+    step = (width - 2 * margin) / max(1, len(xs) - 1)
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">',
+             f'<text x="{width / 2}" y="16" text-anchor="middle" font-size="13">{html.escape(title)}</text>',
+             f'<line x1="{margin}" y1="{height - margin}" x2="{width - margin}" y2="{height - margin}" stroke="#000"/>',
+             f'<line x1="{margin}" y1="{margin / 2}" x2="{margin}" y2="{height - margin}" stroke="#000"/>',
+             f'<text x="{margin - 4}" y="{margin / 2 + 4}" text-anchor="end" font-size="10">{top:.3g}</text>']
+    for index, x in enumerate(xs):
+        parts.append(f'<text x="{margin + index * step}" y="{height - margin + 14}" text-anchor="middle" '
+                     f'font-size="10">{html.escape(x)}</text>')
+    for number, (label, points) in enumerate(curves.items()):
+        color = colors[number % len(colors)]
+        coordinates = " ".join(f"{margin + xs.index(str(x)) * step:.1f},"
+                               f"{height - margin - value / top * (height - 1.5 * margin):.1f}" for x, value in points)
+        parts.append(f'<polyline fill="none" stroke="{color}" stroke-width="2" points="{coordinates}"/>')
+        parts.append(f'<text x="{width - margin + 4}" y="{margin + number * 14}" font-size="10" '
+                     f'fill="{color}">{html.escape(label)}</text>')
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+def html_report(data, comparison=None):
+    body = []
+    for name, runs in runs_by_name(data).items():
+        for parameter in swept_parameters(runs):
+            metrics = sorted({metric for run in runs for metric in run["metrics"]})
+            latency = svg_chart(f"{name}: p99 latency (ms) by {parameter}",
+                                {metric: [(x, y * 1000) for x, y in curve(runs, parameter, metric, "p99")]
+                                 for metric in metrics})
+            throughput = svg_chart(f"{name}: throughput (/s) by {parameter}",
+                                   {metric: curve(runs, parameter, metric, "throughput") for metric in metrics})
+            body.append(f"<h3>{html.escape(name)}: scaling with {html.escape(parameter)}</h3>{latency}{throughput}")
+    # the tables are the markdown report in <pre>, readable without a markdown renderer
+    tables = html.escape(markdown_report(data, comparison))
+    return ("<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Benchmark results</title></head><body>"
+            + "".join(body) + f"<pre>{tables}</pre></body></html>\n")
+
+
+# --json, --raw, --baseline, --threshold, --markdown and --html of a benchmark script
+def add_arguments(parser):
+    group = parser.add_argument_group("results")
+    group.add_argument("--json", default=None, help="write the results as json to this file")
+    group.add_argument("--raw", action="store_true", help="keep the raw samples in the json")
+    group.add_argument("--baseline", default=None, help="json of an earlier run to compare with")
+    group.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                       help="relative change that counts as a regression, 0.1 for 10%%")
+    group.add_argument("--markdown", default=None, help="write a markdown report to this file")
+    group.add_argument("--html", default=None, help="write an html report with the scaling curves to this file")
+
+
+# writes what the options ask for, returns 1 if the baseline comparison found a regression
+def finish(options, runs):
+    data = write_json(options.json, runs, options.raw) if options.json else document(runs, options.raw)
+    comparison = None
+    if options.baseline:
+        comparison = compare(data, load(options.baseline), options.threshold)
+        for row in comparison:
+            if row["regression"]:
+                print(f"REGRESSION {row['run']} {row['metric']} {row['statistic']}: "
+                      f"{format_value(row['statistic'], row['baseline'])} -> "
+                      f"{format_value(row['statistic'], row['current'])} ({row['change'] * 100:+.1f}%)")
+    if options.markdown:
+        with open(options.markdown, "w") as output:
+            output.write(markdown_report(data, comparison))
+    if options.html:
+        with open(options.html, "w") as output:
+            output.write(html_report(data, comparison))
+    return 1 if comparison and any(row["regression"] for row in comparison) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    compareCommand = commands.add_parser("compare", help="compare a run with a baseline")
+    compareCommand.add_argument("run")
+    compareCommand.add_argument("baseline")
+    compareCommand.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    reportCommand = commands.add_parser("report", help="render the reports of a run")
+    reportCommand.add_argument("run")
+    reportCommand.add_argument("--baseline", default=None)
+    reportCommand.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    reportCommand.add_argument("--markdown", default=None)
+    reportCommand.add_argument("--html", default=None)
+    options = parser.parse_args()
+
+    run = load(options.run)
+    comparison = compare(run, load(options.baseline), options.threshold) if options.baseline else None
+    if options.command == "compare":
+        print("\n".join(comparison_markdown(comparison)))
+        sys.exit(1 if any(row["regression"] for row in comparison) else 0)
+    if options.markdown:
+        with open(options.markdown, "w") as output:
+            output.write(markdown_report(run, comparison))
+    if options.html:
+        with open(options.html, "w") as output:
+            output.write(html_report(run, comparison))
+    if not options.markdown and not options.html:
+        print(markdown_report(run, comparison))
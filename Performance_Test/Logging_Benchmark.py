@@ -0,0 +1,151 @@
+'''
+    ##  Registry throughput with logging on and off
+    ##  Threads run HELLO + SEARCH + JOIN-ROOM + LEAVE rounds against an in-process registry service
+    ##  with the memory storage, with logging off, with print and a file handler on the request
+    ##  threads as before, and with the queue of log_pipeline in server mode:
+    ##  python Logging_Benchmark.py --threads 1 4 --seconds 3
+'''
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import db
+import log_pipeline
+import protocol
+from presence import PresenceIndex
+from registry_service import RegistryService
+from roster_codec import decode_roster
+from roster_versions import NO_VERSION
+from timer_wheel import ExpiryScheduler
+
+PEERS_PER_THREAD = 8
+MODES = ("off", "sync", "pipeline")
+# log_pipeline stops the records from looking up their source line, the sync setup looks it up
+# as the registry did before
+SOURCE_FILE = logging._srcfile
+
+
+# connection of a simulated peer, the messages it would receive are only counted
+class BenchmarkSession:
+
+    def __init__(self, username, port):
+        self.ip = "127.0.0.1"
+        self.port = port
+        self.username = username
+        self.legacy = False
+        self.version = NO_VERSION
+        self.received = 0
+
+    def send(self, kind, payload, key=None):
+        self.received += 1
+        if kind == protocol.ROSTER:
+            roster = decode_roster(payload)
+            if roster["last"]:
+                self.version = roster["version"]
+
+    def close(self):
+        pass
+
+
+def build_registry(rooms, sessions):
+    storage = db.MemoryStorage()
+    for room in range(rooms):
+        storage.save_chatroom(f"room{room}")
+    timers = ExpiryScheduler()
+    presence = PresenceIndex()
+    service = RegistryService(storage, timers, presence=presence)
+    for session in sessions:
+        storage.register(session.username, "unused")
+        presence.add(session.username, session.ip, str(session.port), session)
+        timers.start(session.username, 3600, lambda username: None)
+    return service
+
+
+# off: nothing is printed or logged
+# sync: print and a file handler on the thread of the command, as the registry did before
+# pipeline: the records are queued and written by the writer thread of log_pipeline,
+# the console output is logged instead of printed
+def configure(mode, path):
+    log_pipeline.stop_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    logging.disable(logging.NOTSET)
+    if mode == "off":
+        log_pipeline.quiet = True
+        logging.disable(logging.CRITICAL)
+    elif mode == "sync":
+        log_pipeline.quiet = False
+        logging._srcfile = SOURCE_FILE
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter(log_pipeline.LOG_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+    else:
+        log_pipeline.setup_logging(path, quietConsole=True)
+
+
+def worker(service, sessions, rooms, deadline, counts, index):
+    rounds = 0
+    while time.perf_counter() < deadline:
+        for number, session in enumerate(sessions):
+            room = f"room{(index + number) % rooms}"
+            service.handleHello(session.username, (session.ip, session.port))
+            service.dispatch(session, ["SEARCH", session.username])
+            service.dispatch(session, ["JOIN-ROOM", room, session.username, session.ip, str(session.port),
+                                       str(session.port), session.version])
+            service.dispatch(session, ["LEAVE", session.username, room])
+            rounds += 1
+    counts[index] = rounds
+
+
+def measure(threads, rooms, seconds):
+    sessions = [[BenchmarkSession(f"peer{thread}_{i}", 20000 + thread * PEERS_PER_THREAD + i)
+                 for i in range(PEERS_PER_THREAD)] for thread in range(threads)]
+    service = build_registry(rooms, [session for group in sessions for session in group])
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+    workers = [threading.Thread(target=worker, args=(service, sessions[thread], rooms, deadline, counts, thread))
+               for thread in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    service.auth.shutdown()
+    return sum(counts) / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4], help="threads running rounds")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES), help="logging setups compared")
+    parser.add_argument("--rooms", type=int, default=8, help="chat rooms the peers join and leave")
+    parser.add_argument("--seconds", type=float, default=3, help="duration of each run")
+    options = parser.parse_args()
+
+    # the printed output goes to /dev/null, a terminal would make the sync setup slower still
+    stdout = sys.stdout
+    print(f"{'threads':>8}" + "".join(f"{mode:>12}" for mode in options.modes)
+          + "   (HELLO + SEARCH + JOIN-ROOM + LEAVE rounds per second)")
+    with tempfile.TemporaryDirectory() as directory:
+        for threads in options.threads:
+            results = []
+            sys.stdout = open(os.devnull, "w")
+            try:
+                for mode in options.modes:
+                    configure(mode, os.path.join(directory, mode + ".log"))
+                    results.append(measure(threads, options.rooms, options.seconds))
+                    # the records still waiting are written before the next setup
+                    configure("off", None)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            print(f"{threads:>8}" + "".join(f"{rate:>12.0f}" for rate in results))
@@ -0,0 +1,156 @@
+'''
+    ##  Query plans and latency of every mongo storage method
+    ##  Run it on a database filled by Mongo_Seed.py, it fails if a method reads a collection without an index:
+    ##  python Mongo_Query_Plan.py --database p2p-chat-benchmark --calls 200
+'''
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from pymongo import monitoring
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import db
+
+# commands that are explained, inserts have no query plan
+EXPLAINED = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# fields the driver adds to a command that explain does not accept
+DRIVER_FIELDS = {"lsid", "$db", "$clusterTime", "txnNumber", "$readPreference", "writeConcern", "readConcern"}
+# methods that read every room by design
+FULL_SCANS = {"get_all_chatroom_names"}
+
+
+# keeps the commands the driver sends while a method runs
+class CommandRecorder(monitoring.CommandListener):
+
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in EXPLAINED:
+            command = {key: value for key, value in event.command.items() if key not in DRIVER_FIELDS}
+            self.commands.append(command)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# stages of the winning plans in an explain output
+def plan_stages(node, inPlan=False):
+    stages = []
+    if isinstance(node, dict):
+        if inPlan and "stage" in node:
+            stages.append(node["stage"])
+        for key, value in node.items():
+            stages += plan_stages(value, inPlan or key == "winningPlan")
+    elif isinstance(node, list):
+        for value in node:
+            stages += plan_stages(value, inPlan)
+    return stages
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def operations(storage, accounts, rooms):
+    def user(i):
+        return f"user{(i * 7919) % max(1, accounts)}"
+
+    def room(i):
+        return f"room{(i * 7919) % max(1, rooms)}"
+
+    # writes use names that are not in the seeded data and undo themselves
+    return [
+        ("is_account_exist", lambda i: storage.is_account_exist(user(i))),
+        ("get_password", lambda i: storage.get_password(user(i))),
+        ("register", lambda i: storage.register(f"plan-user{i}", "password-hash")),
+        ("user_login", lambda i: storage.user_login(f"plan-user{i}", "127.0.0.1", "20000")),
+        ("is_account_online", lambda i: storage.is_account_online(f"plan-user{i}")),
+        ("get_peer_ip_port", lambda i: storage.get_peer_ip_port(f"plan-user{i}")),
+        ("user_logout", lambda i: storage.user_logout(f"plan-user{i}")),
+        ("save_chatroom", lambda i: storage.save_chatroom(f"plan-room{i}")),
+        ("is_room_exits", lambda i: storage.is_room_exits(room(i))),
+        ("add_member", lambda i: storage.add_member(f"plan-room{i}", f"plan-user{i}", "127.0.0.1", "20000", "30000")),
+        ("is_member_inroom", lambda i: storage.is_member_inroom(user(i))),
+        ("get_chatroom_members", lambda i: storage.get_chatroom_members(room(i))),
+        ("get_chatroom_members_page", lambda i: storage.get_chatroom_members_page(room(i), limit=2)),
+        ("leave_room", lambda i: storage.leave_room(f"plan-user{i}", f"plan-room{i}")),
+        ("remove_member", lambda i: storage.remove_member(f"plan-user{i}", f"plan-room{i}")),
+        ("get_all_chatroom_names", lambda i: storage.get_all_chatroom_names()),
+    ]
+
+
+def cleanup(storage):
+    storage.db.accounts.delete_many({"username": {"$regex": "^plan-user"}})
+    storage.db.online_peers.delete_many({"username": {"$regex": "^plan-user"}})
+    storage.db.chatrooms.delete_many({"room_name": {"$regex": "^plan-room"}})
+    storage.db.members.delete_many({"username": {"$regex": "^plan-user"}})
+
+
+def run(storage, recorder, calls, scanCalls):
+    accounts = storage.db.accounts.estimated_document_count()
+    rooms = storage.db.chatrooms.estimated_document_count()
+    results = []
+    for name, operation in operations(storage, accounts, rooms):
+        count = scanCalls if name in FULL_SCANS else calls
+        recorder.commands = []
+        latencies = []
+        for i in range(count):
+            start = time.perf_counter()
+            operation(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+        # the plans of the first call are explained, the other calls send the same command shapes
+        stages = set()
+        for command in recorder.commands[:4]:
+            explained = storage.db.command("explain", command, verbosity="queryPlanner")
+            stages.update(plan_stages(explained))
+        results.append({
+            "method": name,
+            "calls": count,
+            "mean_ms": statistics.mean(latencies),
+            "p50_ms": percentile(latencies, 0.5),
+            "p99_ms": percentile(latencies, 0.99),
+            "stages": sorted(stages),
+            "collection_scan": "COLLSCAN" in stages and name not in FULL_SCANS,
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="p2p-chat-benchmark")
+    parser.add_argument("--calls", type=int, default=200, help="calls of each method")
+    parser.add_argument("--scan-calls", type=int, default=3, help="calls of the methods that read every room")
+    parser.add_argument("--json", help="file to write the results to")
+    options = parser.parse_args()
+
+    recorder = CommandRecorder()
+    storage = db.open_storage("mongo", uri=options.uri, database=options.database, event_listeners=[recorder])
+    try:
+        results = run(storage, recorder, options.calls, options.scan_calls)
+    finally:
+        cleanup(storage)
+        storage.close()
+
+    print(f"{'method':<24} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}  plan")
+    for result in results:
+        flag = "  <-- COLLECTION SCAN" if result["collection_scan"] else ""
+        print(f"{result['method']:<24} {result['mean_ms']:>9.3f} {result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f}  "
+              f"{','.join(result['stages'])}{flag}")
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    scans = [result["method"] for result in results if result["collection_scan"]]
+    if scans:
+        print("collection scans in: " + ", ".join(scans))
+        sys.exit(1)
@@ -0,0 +1,74 @@
+'''
+    ##  Fills a mongo database with accounts and chat rooms for the query plan benchmark
+    ##  python Mongo_Seed.py --accounts 1000000 --rooms 100000 --database p2p-chat-benchmark
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import db
+
+# a bcrypt hash of "password", hashing a million passwords would take hours
+PASSWORD_HASH = "$2b$12$C6UzMDM.H6dfI/f/IKcEeO6Ixl0Mc0G5V0lwK1fZQ7q2wVZ4y2b8W"
+
+
+def batches(count, size):
+    for start in range(0, count, size):
+        yield range(start, min(count, start + size))
+
+
+def seed(storage, accounts, rooms, membersPerRoom, onlineFraction, batchSize):
+    database = storage.db
+    database.accounts.delete_many({})
+    database.online_peers.delete_many({})
+    database.chatrooms.delete_many({})
+    database.members.delete_many({})
+
+    start = time.time()
+    for batch in batches(accounts, batchSize):
+        database.accounts.insert_many([{"username": f"user{i}", "password": PASSWORD_HASH} for i in batch],
+                                      ordered=False)
+    print(f"{accounts} accounts in {time.time() - start:.1f} s")
+
+    start = time.time()
+    online = int(accounts * onlineFraction)
+    for batch in batches(online, batchSize):
+        database.online_peers.insert_many([{"username": f"user{i}", "ip": "127.0.0.1", "port": str(20000 + i % 40000)}
+                                           for i in batch], ordered=False)
+    print(f"{online} online peers in {time.time() - start:.1f} s")
+
+    # every account is a member of at most one room, like the registry allows
+    start = time.time()
+    for batch in batches(rooms, batchSize):
+        database.chatrooms.insert_many([{"room_name": f"room{room}"} for room in batch], ordered=False)
+    members = min(accounts, rooms * membersPerRoom)
+    for batch in batches(members, batchSize):
+        documents = []
+        for i in batch:
+            member = db.member_record(f"user{i}", "127.0.0.1", str(20000 + i % 40000), str(30000 + i % 30000))
+            member["room_name"] = f"room{i // membersPerRoom}"
+            documents.append(member)
+        database.members.insert_many(documents, ordered=False)
+    print(f"{rooms} rooms with {members} members in {time.time() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="p2p-chat-benchmark")
+    parser.add_argument("--accounts", type=int, default=1000000)
+    parser.add_argument("--rooms", type=int, default=100000)
+    parser.add_argument("--members-per-room", type=int, default=5)
+    parser.add_argument("--online-fraction", type=float, default=0.1)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    options = parser.parse_args()
+
+    if options.database == "p2p-chat":
+        parser.error("refusing to seed the database of the registry")
+    # opening the storage creates the indexes before the documents are inserted
+    storage = db.open_storage("mongo", uri=options.uri, database=options.database)
+    seed(storage, options.accounts, options.rooms, options.members_per_room, options.online_fraction,
+         options.batch_size)
+    storage.close()
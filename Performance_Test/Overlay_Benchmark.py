@@ -0,0 +1,122 @@
+'''
+    ##  Flat unicast against overlay tree fan-out of the room messages
+    ##  Every member of a room is a udp socket on this host, the sender sends each message to every
+    ##  member (flat) or to its children in the tree (tree) and the members forward it, the cpu time of
+    ##  the sender and the time until the last member receives the message are measured:
+    ##  python Overlay_Benchmark.py --sizes 10 50 100 500 --messages 20 --degree 4
+    ##  The members forward on a single thread here, so the time to the last member of the tree is
+    ##  an upper bound of what peers on their own hosts would see
+'''
+import argparse
+import os
+import selectors
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import room_overlay
+
+MESSAGE = "hello everyone in the room, this is a benchmark message"
+
+
+class Member:
+
+    def __init__(self, username, degree):
+        self.username = username
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.socket.bind(("127.0.0.1", 0))
+        self.address = self.socket.getsockname()
+        self.overlay = room_overlay.OverlayTree(username, degree)
+
+
+# members of the room that receive, and in tree mode forward, the messages
+class Room(threading.Thread):
+
+    def __init__(self, size, degree):
+        threading.Thread.__init__(self, daemon=True)
+        self.members = [Member(f"member{i:05d}", degree) for i in range(size)]
+        for member in self.members:
+            for other in self.members:
+                member.overlay.add(other.username, other.address)
+        self.selector = selectors.DefaultSelector()
+        for member in self.members[1:]:
+            self.selector.register(member.socket, selectors.EVENT_READ, member)
+        self.received = set()
+        self.lock = threading.Lock()
+        self.allReceived = threading.Event()
+        self.running = True
+
+    def expect(self):
+        with self.lock:
+            self.received = set()
+            self.allReceived.clear()
+
+    def run(self):
+        while self.running:
+            for key, _ in self.selector.select(0.1):
+                member = key.data
+                datagram = member.socket.recv(65535)
+                tree_message = room_overlay.decode_tree_message(datagram)
+                if tree_message is not None:
+                    origin, sequence, _ = tree_message
+                    if not member.overlay.first_seen(origin, sequence):
+                        continue
+                    for address in member.overlay.targets(origin):
+                        member.socket.sendto(datagram, address)
+                with self.lock:
+                    self.received.add(member.username)
+                    if len(self.received) == len(self.members) - 1:
+                        self.allReceived.set()
+
+    def close(self):
+        self.running = False
+        self.join()
+        for member in self.members:
+            member.socket.close()
+
+
+def send(sender, mode, sequence):
+    if mode == room_overlay.FANOUT_TREE:
+        datagram = room_overlay.encode_tree_message(sender.username, sequence, MESSAGE)
+        for address in sender.overlay.targets(sender.username):
+            sender.socket.sendto(datagram, address)
+    else:
+        for address in sender.overlay.addresses.values():
+            sender.socket.sendto(MESSAGE.encode(), address)
+
+
+def measure(size, mode, messages, degree):
+    room = Room(size, degree)
+    room.start()
+    sender = room.members[0]
+    cpu, lastArrival, lost = [], [], 0
+    for sequence in range(1, messages + 1):
+        room.expect()
+        start = time.perf_counter()
+        startCpu = time.thread_time()
+        send(sender, mode, sequence)
+        cpu.append(time.thread_time() - startCpu)
+        if room.allReceived.wait(2.0):
+            lastArrival.append(time.perf_counter() - start)
+        else:
+            lost += 1
+    room.close()
+    return statistics.mean(cpu) * 1000, statistics.median(lastArrival) * 1000 if lastArrival else float("nan"), lost
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100, 500], help="members of the room")
+    parser.add_argument("--messages", type=int, default=20, help="messages sent in each run")
+    parser.add_argument("--degree", type=int, default=room_overlay.TREE_DEGREE, help="children of a tree member")
+    options = parser.parse_args()
+
+    print(f"{'members':>8} {'fan-out':>8} {'sender cpu ms':>14} {'last peer ms':>13} {'incomplete':>11}")
+    for size in options.sizes:
+        for mode in (room_overlay.FANOUT_FLAT, room_overlay.FANOUT_TREE):
+            senderCpu, last, lost = measure(size, mode, options.messages, options.degree)
+            print(f"{size:>8} {mode:>8} {senderCpu:>14.3f} {last:>13.3f} {lost:>11}")
@@ -5,12 +5,28 @@
 '''
 import asyncio
 import atexit
+import os
 import socket
 import threading
 import select
+import sys
 import logging
-import bcrypt
 import pickle
+import time
+
+# pytest collects this file because of its name, it is skipped where bcrypt is not installed
+if "pytest" in sys.modules:
+    import pytest
+    pytest.importorskip("bcrypt")
+import bcrypt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import protocol
+import roster_codec
+
+# a login that is answered with login-busy is sent again after a growing delay
+LOGIN_RETRIES = 5
+LOGIN_RETRY_DELAY = 0.2
 
 
 
@@ -294,6 +310,10 @@ class peerMain():
         # tcp socket connection to registry
         self.tcpClientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.tcpClientSocket.connect((self.registryName, self.registryPort))
+        # commands and replies exchanged with the registry as length-prefixed frames
+        # P2P_PROTOCOL=legacy keeps the "#...#" protocol for registries that are not upgraded yet
+        self.registryChannel = protocol.RegistryChannel(self.tcpClientSocket,
+                                                        os.environ.get("P2P_PROTOCOL", "framed") == "legacy")
         # initializes udp socket which is used to send hello messages
         self.udpClientSocket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
         # udp port of the registry
@@ -327,10 +347,10 @@ class peerMain():
         # if response is success then informs the user for account creation
         # if response is exist then informs the user for account existence
         hashed_password = self.hash_password(password)
-        message = "#" + "JOIN " + username + " " + hashed_password.decode('utf-8')+ "#"
+        message = "JOIN " + username + " " + hashed_password.decode('utf-8')
         logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024).decode()
+        self.registryChannel.send_command(message)
+        response = self.registryChannel.receive_text()
         logging.info("Received from " + self.registryName + " -> " + response)
         if response == "join-success":
             print("\033[31mAccount created... \033[0m")
@@ -341,11 +361,15 @@ class peerMain():
     def login(self, username, password, peerServerPort):
         # a login message is composed and sent to registry
         # an integer is returned according to each response
-        message = "#" + "LOGIN " + username + " " + password + " " + str(peerServerPort)+"#"
-        logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024).decode()
-        logging.info("Received from " + self.registryName + " -> " + response)
+        message = "LOGIN " + username + " " + password + " " + str(peerServerPort)
+        for attempt in range(LOGIN_RETRIES):
+            logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
+            self.registryChannel.send_command(message)
+            response = self.registryChannel.receive_text()
+            logging.info("Received from " + self.registryName + " -> " + response)
+            if response != "login-busy":
+                break
+            time.sleep(LOGIN_RETRY_DELAY * 2 ** attempt)
         print("\033[93mLogged in successfully...\033[0m")
         self.isOnline = True
         self.loginCredentials = (username, password)
@@ -364,7 +388,7 @@ class peerMain():
         else:
             message = "LOGOUT"
         logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
+        self.registryChannel.send_command(message)
 
     # function for searching an online user
     def searchUser(self, username):
@@ -373,8 +397,8 @@ class peerMain():
         # to this search message
         message = "SEARCH " + username
         logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024).decode().split()
+        self.registryChannel.send_command(message)
+        response = self.registryChannel.receive_text().split()
         logging.info("Received from " + self.registryName + " -> " + " ".join(response))
         if response[0] == "search-success":
             print(username + " \033[93mis found successfully...\033[0m")
@@ -387,24 +411,21 @@ class peerMain():
             return None
 
     def Createchatroom(self, room_name):
-        message = "#" + "CREATE" + " " + room_name + "#"
+        message = "CREATE" + " " + room_name
         logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
         print("CREATION MESSAGE : " , message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024)
-        try:
-            response = response.decode('utf-8')
-        except UnicodeDecodeError:
-            # Handle non-UTF-8 data, e.g., by ignoring invalid bytes
-            response = response.decode('utf-8', errors='ignore')
+        self.registryChannel.send_command(message)
+        # notifications of the rooms this peer joined may arrive before the reply
+        response = self.registryChannel.receive_reply()
+        response = response.text() if response is not None else ""
         logging.info("Received from " + self.registryName + " -> " + " ".join(response))
         return response
 
     def joinRoom_test(self, room_name, username, ip_address, tcp_port_number,udp_port_number):
         message = "JOIN-ROOM "+ room_name + " " + username+" "+ str(ip_address) + " " + str(tcp_port_number) + " " + str(udp_port_number)
         logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024)
+        self.registryChannel.send_command(message)
+        response = self.registryChannel.receive_reply()
         return response
         # recieve_tcpthread=threading.Thread(target=self.recieve_tcp)
         # recieve_tcpthread.start()
@@ -420,7 +441,7 @@ class peerMain():
         message = "JOIN-ROOM " + room_name + " " + username + " " + str(ip_address) + " " + str(
             tcp_port_number) + " " + str(udp_port_number)
         logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
+        self.registryChannel.send_command(message)
 
         recieve_tcpthread = threading.Thread(target=self.recieve_tcp)
         recieve_tcpthread.start()
@@ -439,54 +460,60 @@ class peerMain():
         #self.peerServer.isChatRequested = 0
 
     def recieve_tcp(self):
-        tcpSocket = self.tcpClientSocket
-        inputs = [tcpSocket]
         self.is_inroom = True
         while self.is_inroom:
             #listens to the server
-            readable, _, _ = select.select(inputs, [], [])
-            for s in readable:
-                message = s.recv(4096)
+            message = self.registryChannel.receive()
+            # registry closed the connection
+            if message is None:
+                self.is_inroom = False
+                break
+            # the member list of the room is received after joining it
+            if message.kind == protocol.MEMBERS:
                 try:
-                    # Try to decode the message as a string
-                    message_decoded=message.decode()
-                    # Handle different types of messages
-                    if message_decoded.startswith("MEMBER-JOINED"):
-                        # Extract relevant information
-                        data = message_decoded.split()
-                        username = data[1]
-                        ip_address = data[2]
-                        udp_port_number = data[3]
-                        # Create member_data dictionary
-                        new_member = {
-                            "username": username,
-                            "IP address": ip_address,
-                            "UDP_Port_number": udp_port_number
-                        }
-                        self.list_of_members.append(new_member)
-                        print(f"{username} has joined the room")
-                    elif ("You joined the room" in message_decoded) or ("left" in message_decoded) or ("first member to join" in message_decoded):
-                        print(message_decoded)
-                    elif "YOU LEFT THE ROOM" in message_decoded:
-                        print("YOU LEFT THE ROOM")
-                        self.is_inroom = False
-                        udpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                        udpSocket.sendto(message_decoded.encode(),(socket.gethostbyname(socket.gethostname()),self.peerUDPportnumber))
-                        udpSocket.close()
-                    elif "Peer-LEFT" in message_decoded:
-                        username_left = message_decoded.split()[1]
-                        print(f"{username_left} has left the chatroom")
-                        # Use a list comprehension to create a new list excluding the member with the specified username
-                        self.list_of_members = [member for member in self.list_of_members if
-                                                member["username"] != username_left]
-                except UnicodeDecodeError:
-                    # Handle non-decodable messages (assumed to be binary pickled data)
-                    try:
-                        received_members_list = pickle.loads(message)
-                        self.list_of_members = received_members_list
-                        print("You joined the room , start chatting !")
-                    except pickle.PickleError as e:
-                        print(f"Error deserializing data: {e}")
+                    # only the legacy protocol sends it pickled
+                    if self.registryChannel.legacy:
+                        received_members_list = pickle.loads(message.payload)
+                    else:
+                        received_members_list = [{"username": username, "IP address": ip_address,
+                                                  "TCP_Port_number": tcp_port_number, "UDP_Port_number": udp_port_number}
+                                                 for username, ip_address, tcp_port_number, udp_port_number
+                                                 in roster_codec.decode_members(message.payload)]
+                    self.list_of_members = received_members_list
+                    print("You joined the room , start chatting !")
+                except (pickle.PickleError, roster_codec.CodecError) as e:
+                    print(f"Error deserializing data: {e}")
+                continue
+            message_decoded = message.text()
+            # Handle different types of messages
+            if message_decoded.startswith("MEMBER-JOINED"):
+                # Extract relevant information
+                data = message_decoded.split()
+                username = data[1]
+                ip_address = data[2]
+                udp_port_number = data[3]
+                # Create member_data dictionary
+                new_member = {
+                    "username": username,
+                    "IP address": ip_address,
+                    "UDP_Port_number": udp_port_number
+                }
+                self.list_of_members.append(new_member)
+                print(f"{username} has joined the room")
+            elif ("You joined the room" in message_decoded) or ("left" in message_decoded) or ("first member to join" in message_decoded):
+                print(message_decoded)
+            elif "YOU LEFT THE ROOM" in message_decoded:
+                print("YOU LEFT THE ROOM")
+                self.is_inroom = False
+                udpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                udpSocket.sendto(message_decoded.encode(),(socket.gethostbyname(socket.gethostname()),self.peerUDPportnumber))
+                udpSocket.close()
+            elif "Peer-LEFT" in message_decoded:
+                username_left = message_decoded.split()[1]
+                print(f"{username_left} has left the chatroom")
+                # Use a list comprehension to create a new list excluding the member with the specified username
+                self.list_of_members = [member for member in self.list_of_members if
+                                        member["username"] != username_left]
 
         return
 
@@ -511,7 +538,7 @@ class peerMain():
     def leaveRoom(self, username,room_name):
         message = "LEAVE "+ username + " " + room_name
         logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
+        self.registryChannel.send_command(message)
         return
 
     def print_ChatRooms(self):
@@ -521,16 +548,16 @@ class peerMain():
     def get_chatrooms (self):
         message = "PRINT_CHATROOMS"
         logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024).decode()
+        self.registryChannel.send_command(message)
+        response = self.registryChannel.receive_text()
         logging.info("Received from " + self.registryName + " -> " + " ".join(response))
         return response
 
     def print_online_users(self):
         message = "PRINT"
         logging.info("Send to " + self.registryName + ":" + str(self.registryPort) + " -> " + message)
-        self.tcpClientSocket.send(message.encode())
-        response = self.tcpClientSocket.recv(1024).decode()
+        self.registryChannel.send_command(message)
+        response = self.registryChannel.receive_text()
         logging.info("Received from " + self.registryName + " -> " + " ".join(response))
         print(response)
 
@@ -546,8 +573,8 @@ class peerMain():
 
     def set_udp_peer_portnumber(self):
         message = "PORTNUMBER"
-        self.tcpClientSocket.send(message.encode())
-        peer_udp_port= self.tcpClientSocket.recv(1024).decode()
+        self.registryChannel.send_command(message)
+        peer_udp_port= self.registryChannel.receive_text()
         self.peerUDPportnumber = int(peer_udp_port)
     def is_port_available(self,ip_no,port,udp=False):
         try:
@@ -587,5 +614,3 @@ class peerMain():
             print(f"Error during cleanup: {e}")
         finally:
             print("Cleanup completed.")
-
-peerMain= peerMain()
\ No newline at end of file
@@ -1,29 +1,35 @@
+import argparse
 import random
+import sys
 import threading
 import time
+import Bench_Results
 import Peer_test
 
 class Performance_Test():
-    def __init__(self, rooms_count, peers_per_room):
+    def __init__(self, rooms_count, peers_per_room, prefix="peer"):
         self.peers = []
+        self.prefix = prefix
         self.rooms = []
         self.rooms_count = rooms_count
         self.peers_per_room = peers_per_room
         self.signup_times = []
         self.room_creation_times = []
+        self.run = Bench_Results.BenchRun("signup_and_rooms", {"rooms": rooms_count, "peers_per_room": peers_per_room})
 
     def signup_login(self, number_of_peers):
         for i in range(number_of_peers):
             start_time = time.time()
-            username = f"peer_{i}"
+            username = f"{self.prefix}_{i}"
             password = "password"
-            peer = Peer_test.peerMain
+            peer = Peer_test.peerMain()
             peer.createAccount(username, password)
             port_number = peer.find_available_port(peer.registryName)
             peer.login(username,password, port_number)
             self.peers.append(peer)
             end_time = time.time()
             self.signup_times.append(end_time - start_time)
+            self.run.record("signup", end_time - start_time)
             print(f'Peer{i} has signed up and joined successfully')
 
     def create_chatroom(self):
@@ -32,18 +38,21 @@ class Performance_Test():
             join_index = self.peers_per_room * room_id
             print(f'Join-index of {join_index}')
             creator_peer = self.peers[join_index]
-            room_name = f'room_{room_id}'
+            room_name = f'{self.prefix}_room_{room_id}'
             response=creator_peer.Createchatroom(room_name)
             if("created" in response):
                 self.rooms.append(room_name)
                 for peer_id in range(join_index, join_index + self.peers_per_room):
                     joiner_peer = self.peers[peer_id]
-                    joiner_peer.joinRoom_test(room_name, "peer_" + str(peer_id), joiner_peer.registryName,
+                    joiner_peer.joinRoom_test(room_name, f"{self.prefix}_{peer_id}", joiner_peer.registryName,
                                        joiner_peer.peerServerPort, joiner_peer.peerUDPportnumber)
 
                     print(f'Peer{peer_id} has joined the room{room_name} successfully')
+            else:
+                self.run.count("room_errors")
             end_time = time.time()
             self.room_creation_times.append(end_time - start_time)
+            self.run.record("create_room", end_time - start_time)
     #100 peer
     # 10 rooms: 0-9 -- remaining = 90
     # 10 creators: peers 0-9
@@ -84,41 +93,60 @@ class Performance_Test():
         for thread in threads:
             thread.join()
 
+    # an empty list, e.g. when no room was created, gives zeros
     def calculate_metrics(self, times):
-        min_time = min(times)
-        max_time = max(times)
-        avg_time = sum(times) / len(times)
-        return min_time, max_time, avg_time
+        summary = Bench_Results.summarize(times)
+        return summary["min"], summary["max"], summary["mean"]
 
-    def print_results(self, total_time):
-        min_signup_time, max_signup_time, avg_signup_time = self.calculate_metrics(self.signup_times)
-        min_room_time, max_room_time, avg_room_time = self.calculate_metrics(self.room_creation_times)
-
-        print(f'Performance Results for {numbers_of_peers} PEERS at the same time:')
+    def print_results(self, number_of_peers, total_time):
+        print(f'Performance Results for {number_of_peers} PEERS at the same time:')
         print("-" * 60)
         print("{:<30} {:<15}".format("Metric", "Time (seconds)"))
         print("-" * 60)
-        print("{:<30} {:<15}".format("Min Signup Time", min_signup_time))
-        print("{:<30} {:<15}".format("Max Signup Time", max_signup_time))
-        print("{:<30} {:<15}".format("Avg. Signup Time", avg_signup_time))
-        print("{:<30} {:<15}".format("Min Create Chatroom Time", min_room_time))
-        print("{:<30} {:<15}".format("Max Create Chatroom Time", max_room_time))
-        print("{:<30} {:<15}".format("Avg. Create Chatroom Time", avg_room_time))
+        for label, times in (("Signup", self.signup_times), ("Create Chatroom", self.room_creation_times)):
+            summary = Bench_Results.summarize(times, total_time)
+            print("{:<30} {:<15}".format(f"Min {label} Time", summary["min"]))
+            print("{:<30} {:<15}".format(f"Avg. {label} Time", summary["mean"]))
+            for name in ("p50", "p90", "p99", "p999"):
+                print("{:<30} {:<15}".format(f"{name} {label} Time", summary[name]))
+            print("{:<30} {:<15}".format(f"Max {label} Time", summary["max"]))
+            print("{:<30} {:<15}".format(f"{label} Throughput (per second)", summary.get("throughput", 0.0)))
         print("{:<30} {:<15}".format("Total Execution Time From Signup to Joining Rooms (FOR ALL PEERS)", total_time))
         print("-" * 60)
 
     def run_test(self, number_of_peers):
+        self.run.parameters["peers"] = number_of_peers
         start_time = time.time()
         self.signup_login(number_of_peers)
         self.create_chatroom()
         #self.send_messages()
         end_time = time.time()
         total_time = end_time - start_time
-        self.print_results(total_time)
-
-
-rooms_count = 10
-peers_per_room = 5
-numbers_of_peers = 10000
-tester = Performance_Test(rooms_count, peers_per_room)
-tester.run_test(numbers_of_peers)
\ No newline at end of file
+        self.run.finish(total_time)
+        self.print_results(number_of_peers, total_time)
+        return self.run
+
+
+# runs the test for every combination of --peers, --rooms and --peers-per-room, e.g.
+# python Performance_Test.py --peers 100 1000 --rooms 10 --peers-per-room 5 --json run.json --baseline base.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peers", type=int, nargs="+", default=[10000], help="peers that sign up and log in")
+    parser.add_argument("--rooms", type=int, nargs="+", default=[10], help="chat rooms created")
+    parser.add_argument("--peers-per-room", type=int, nargs="+", default=[5], help="peers joining each room")
+    Bench_Results.add_arguments(parser)
+    options = parser.parse_args()
+
+    # the accounts and rooms of a run stay in the database, each run has names of its own
+    runStarted = int(time.time())
+
+    def run_point(peers, rooms, peers_per_room):
+        if rooms * peers_per_room > peers:
+            print(f"Skipping {rooms} rooms of {peers_per_room} peers with only {peers} peers")
+            return None
+        tester = Performance_Test(rooms, peers_per_room, f"peer{runStarted}_{peers}_{rooms}_{peers_per_room}")
+        return tester.run_test(peers)
+
+    runs = Bench_Results.sweep({"peers": options.peers, "rooms": options.rooms,
+                                "peers_per_room": options.peers_per_room}, run_point)
+    sys.exit(Bench_Results.finish(options, [run for run in runs if run is not None]))
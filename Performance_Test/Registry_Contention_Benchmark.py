@@ -0,0 +1,113 @@
+'''
+    ##  Contention of the registry state
+    ##  Threads run HELLO + JOIN-ROOM + LEAVE rounds against an in-process registry service with the
+    ##  memory storage, with a single lock for each part of the state (1 stripe) and with striped locks:
+    ##  python Registry_Contention_Benchmark.py --threads 1 2 4 8 16 --stripes 1 16 --seconds 3
+'''
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import db
+from presence import PresenceIndex
+from registry_service import RegistryService
+from roster_versions import NO_VERSION, RosterVersions
+from roster_codec import decode_roster
+import protocol
+from timer_wheel import ExpiryScheduler
+
+PEERS_PER_THREAD = 8
+
+
+# connection of a simulated peer, the messages it would receive are only counted
+class BenchmarkSession:
+
+    def __init__(self, username, port):
+        self.ip = "127.0.0.1"
+        self.port = port
+        self.username = username
+        self.legacy = False
+        self.version = NO_VERSION
+        self.received = 0
+
+    def send(self, kind, payload, key=None):
+        self.received += 1
+        if kind == protocol.ROSTER:
+            roster = decode_roster(payload)
+            if roster["last"]:
+                self.version = roster["version"]
+
+    def close(self):
+        pass
+
+
+def build_registry(stripes, rooms, sessions):
+    storage = db.MemoryStorage()
+    for room in range(rooms):
+        storage.save_chatroom(f"room{room}")
+    timers = ExpiryScheduler(shards=stripes)
+    presence = PresenceIndex(shards=stripes)
+    service = RegistryService(storage, timers, presence=presence, rosters=RosterVersions(shards=stripes),
+                              lockStripes=stripes)
+    for session in sessions:
+        storage.register(session.username, "unused")
+        presence.add(session.username, session.ip, str(session.port), session)
+        timers.start(session.username, 3600, lambda username: None)
+    return service
+
+
+def worker(service, sessions, rooms, deadline, counts, index):
+    rounds = 0
+    while time.perf_counter() < deadline:
+        for number, session in enumerate(sessions):
+            room = f"room{(index + number) % rooms}"
+            service.handleHello(session.username, (session.ip, session.port))
+            service.dispatch(session, ["JOIN-ROOM", room, session.username, session.ip, str(session.port),
+                                       str(session.port), session.version])
+            service.dispatch(session, ["LEAVE", session.username, room])
+            rounds += 1
+    counts[index] = rounds
+
+
+def measure(threads, stripes, rooms, seconds):
+    sessions = [[BenchmarkSession(f"peer{thread}_{i}", 20000 + thread * PEERS_PER_THREAD + i)
+                 for i in range(PEERS_PER_THREAD)] for thread in range(threads)]
+    service = build_registry(stripes, rooms, [session for group in sessions for session in group])
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+    workers = [threading.Thread(target=worker, args=(service, sessions[thread], rooms, deadline, counts, thread))
+               for thread in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    service.auth.shutdown()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="threads running rounds")
+    parser.add_argument("--stripes", type=int, nargs="+", default=[1, 16], help="lock stripes of the registry state")
+    parser.add_argument("--rooms", type=int, default=8, help="chat rooms the peers join and leave")
+    parser.add_argument("--seconds", type=float, default=3, help="duration of each run")
+    options = parser.parse_args()
+
+    # the registry prints every join and expiry, only the results are shown
+    stdout = sys.stdout
+    print(f"{'threads':>8}" + "".join(f"{str(stripes) + ' stripes':>16}" for stripes in options.stripes)
+          + "   (HELLO + JOIN-ROOM + LEAVE rounds per second)")
+    for threads in options.threads:
+        results = []
+        sys.stdout = open(os.devnull, "w")
+        try:
+            for stripes in options.stripes:
+                results.append(measure(threads, stripes, options.rooms, options.seconds))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        print(f"{threads:>8}" + "".join(f"{rate:>16.0f}" for rate in results))
@@ -0,0 +1,158 @@
+'''
+    ##  Side by side benchmark of the threaded and the asyncio registry
+    ##  Starts Server.py in each mode, connects many peers at the same time and
+    ##  measures the command latencies, the throughput and the threads of the registry
+    ##  Needs a running mongod, like the registry itself
+    ##  --profile sample profiles each registry, the collapsed stacks and handler times are
+    ##  collected under --artifacts/<mode>
+'''
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import bcrypt
+
+REGISTRY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+REGISTRY_PORT = 15600
+
+sys.path.append(REGISTRY_DIR)
+import profiling
+
+
+def thread_count(pid):
+    # number of threads of a process, read from /proc on linux
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def wait_for_registry(host, port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+class VirtualPeer:
+    def __init__(self, host, username, password, hashed_password, peer_server_port):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.hashed_password = hashed_password
+        self.peer_server_port = peer_server_port
+        self.reader = None
+        self.writer = None
+
+    async def command(self, latencies, name, *fields):
+        start = time.perf_counter()
+        self.writer.write(("#" + " ".join(fields) + "#").encode())
+        await self.writer.drain()
+        response = await self.reader.read(65536)
+        latencies.setdefault(name, []).append(time.perf_counter() - start)
+        return response
+
+    async def run(self, latencies, search_target, logged_in):
+        self.reader, self.writer = await asyncio.open_connection(self.host, REGISTRY_PORT)
+        await self.command(latencies, "JOIN", "JOIN", self.username, self.hashed_password)
+        await self.command(latencies, "LOGIN", "LOGIN", self.username, self.password, str(self.peer_server_port))
+        await self.command(latencies, "SEARCH", "SEARCH", search_target)
+        await self.command(latencies, "PRINT", "PRINT")
+        logged_in.release()
+
+    async def logout(self):
+        self.writer.write(("#LOGOUT " + self.username + "#").encode())
+        await self.writer.drain()
+        self.writer.close()
+
+
+async def drive(host, number_of_peers, prefix, hashed_password, server_pid):
+    latencies = {}
+    logged_in = asyncio.Semaphore(0)
+    peers = [VirtualPeer(host, f"{prefix}_{i}", "password", hashed_password, 60000 + i % 5000)
+             for i in range(number_of_peers)]
+    start = time.perf_counter()
+    await asyncio.gather(*(peer.run(latencies, f"{prefix}_{(i + 1) % number_of_peers}", logged_in)
+                           for i, peer in enumerate(peers)))
+    elapsed = time.perf_counter() - start
+    # every peer is online and connected at this point
+    threads = thread_count(server_pid)
+    await asyncio.gather(*(peer.logout() for peer in peers))
+    return latencies, elapsed, threads
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def run_mode(mode, host, number_of_peers, hashed_password, profile=None, artifacts="profiles"):
+    env = profiling.environment(profile, os.path.join(artifacts, mode)) if profile else None
+    registry = subprocess.Popen([sys.executable, "Server.py", "--mode", mode], cwd=REGISTRY_DIR,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    try:
+        if not wait_for_registry(host, REGISTRY_PORT):
+            raise RuntimeError(f"{mode} registry did not start")
+        prefix = f"{mode}_{int(time.time())}"
+        return asyncio.run(drive(host, number_of_peers, prefix, hashed_password, registry.pid))
+    finally:
+        # a profiled registry writes its files when it is terminated
+        registry.terminate()
+        registry.wait()
+        # lets the registry ports be released before the next run
+        time.sleep(1)
+        if profile:
+            for path in profiling.collect(os.path.join(artifacts, mode)):
+                print(f"{mode} profile: {path}")
+
+
+def print_results(number_of_peers, results):
+    print(f'Registry mode comparison for {number_of_peers} PEERS at the same time:')
+    print("-" * 80)
+    print("{:<30} {:<24} {:<24}".format("Metric", *results.keys()))
+    print("-" * 80)
+    rows = []
+    for mode, (latencies, elapsed, threads) in results.items():
+        operations = sum(len(samples) for samples in latencies.values())
+        row = {
+            "Total time (s)": f"{elapsed:.3f}",
+            "Commands / s": f"{operations / elapsed:.1f}",
+            "Registry threads (peak)": str(threads),
+        }
+        for name, samples in latencies.items():
+            row[f"{name} p50 (ms)"] = f"{percentile(samples, 0.5) * 1000:.2f}"
+            row[f"{name} p99 (ms)"] = f"{percentile(samples, 0.99) * 1000:.2f}"
+        rows.append(row)
+    for metric in rows[0]:
+        print("{:<30} {:<24} {:<24}".format(metric, *(row.get(metric, "-") for row in rows)))
+    print("-" * 80)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peers", type=int, default=500)
+    parser.add_argument("--modes", nargs="+", default=["threaded", "async"])
+    parser.add_argument("--profile", choices=profiling.MODES, default=None, help="profile the registries")
+    parser.add_argument("--artifacts", default="profiles", help="directory of the profiles of the registries")
+    options = parser.parse_args()
+
+    host = socket.gethostbyname(socket.gethostname())
+    # a cheap hash keeps the benchmark on the registry overhead instead of the bcrypt cost
+    hashed_password = bcrypt.hashpw(b"password", bcrypt.gensalt(rounds=4)).decode()
+    results = {mode: run_mode(mode, host, options.peers, hashed_password, options.profile, options.artifacts)
+               for mode in options.modes}
+    print_results(options.peers, results)
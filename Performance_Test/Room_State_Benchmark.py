@@ -0,0 +1,99 @@
+'''
+    ##  Attribution of the room messages on the receive path
+    ##  Compares the list of member dicts the peer used to scan for the port of every datagram
+    ##  with the indexed room state, and the memory a member takes in each of them:
+    ##  python Room_State_Benchmark.py --sizes 10 100 1000 10000 --lookups 20000
+'''
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Peer import RoomState
+
+
+def member_dicts(size):
+    return [{"username": f"member{i:05d}", "IP address": f"10.0.{i // 250}.{i % 250 + 1}",
+             "TCP_Port_number": str(20000 + i), "UDP_Port_number": str(40000 + i)} for i in range(size)]
+
+
+# the linear scan the peer did for every datagram
+def username_by_port(members, port):
+    for member in members:
+        if int(member["UDP_Port_number"]) == port:
+            return member["username"]
+    return None
+
+
+def list_lookups(members, addresses):
+    start = time.perf_counter()
+    for address in addresses:
+        username_by_port(members, address[1])
+    return (time.perf_counter() - start) / len(addresses)
+
+
+def state_lookups(room, addresses):
+    start = time.perf_counter()
+    for address in addresses:
+        room.username_by_address(address)
+    return (time.perf_counter() - start) / len(addresses)
+
+
+# a member leaves and joins again, once for every member
+def list_churn(members, churned):
+    start = time.perf_counter()
+    for member in churned:
+        members = [other for other in members if other["username"] != member["username"]]
+        members.append(member)
+    return (time.perf_counter() - start) / len(churned)
+
+
+def state_churn(room, churned):
+    start = time.perf_counter()
+    for member in churned:
+        room.leave(member["username"])
+        room.join(member["username"], member["IP address"], int(member["UDP_Port_number"]))
+    return (time.perf_counter() - start) / len(churned)
+
+
+def bytes_per_member(build, size):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used / size
+
+
+def build_state(members):
+    room = RoomState("benchmark")
+    room.reset((member["username"], member["IP address"], member["TCP_Port_number"], member["UDP_Port_number"])
+               for member in members)
+    return room
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="members of the room")
+    parser.add_argument("--lookups", type=int, default=20000, help="datagrams attributed for each size")
+    options = parser.parse_args()
+
+    print(f"{'members':>8} {'scan ns':>12} {'index ns':>10} {'list leave us':>14} {'state leave us':>15} "
+          f"{'list B/member':>14} {'state B/member':>15}")
+    for size in options.sizes:
+        members = member_dicts(size)
+        room = build_state(members)
+        addresses = [(member["IP address"], int(member["UDP_Port_number"]))
+                     for member in random.choices(members, k=options.lookups)]
+        # the list is measured on fewer datagrams and leaves in big rooms, each of them costs O(members)
+        scanned = addresses[:max(100, options.lookups * 10 // size)]
+        churned = random.sample(members, min(size, 100))
+        listBytes = bytes_per_member(lambda: member_dicts(size), size)
+        stateBytes = bytes_per_member(lambda: build_state(members), size)
+        print(f"{size:>8} {list_lookups(members, scanned) * 1e9:>12.0f} {state_lookups(room, addresses) * 1e9:>10.0f} "
+              f"{list_churn(members, churned) * 1e6:>14.2f} "
+              f"{state_churn(room, churned) * 1e6:>15.2f} {listBytes:>14.0f} {stateBytes:>15.0f}")
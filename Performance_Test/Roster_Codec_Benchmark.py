@@ -0,0 +1,51 @@
+'''
+    ##  Binary roster encoding against pickle
+    ##  Payload size and encode/decode time of the member list of a room, as the registry sends it:
+    ##  python Roster_Codec_Benchmark.py --sizes 1000 10000 --repeat 20
+'''
+import argparse
+import os
+import pickle
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import roster_codec
+from db import member_record
+
+
+def members(size):
+    return [member_record(f"member{i:05d}", f"10.0.{i // 250}.{i % 250 + 1}", str(20000 + i), str(40000 + i))
+            for i in range(size)]
+
+
+# returns the best time of the repeats, in seconds
+def best_time(function, argument, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="members of the room")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of each measurement, the best one is shown")
+    options = parser.parse_args()
+
+    print(f"{'members':>8} {'encoding':>8} {'bytes':>10} {'B/member':>9} {'encode ms':>10} {'decode ms':>10} "
+          f"{'encode k/s':>11} {'decode k/s':>11}")
+    for size in options.sizes:
+        roster = members(size)
+        encodings = {
+            "pickle": (pickle.dumps, pickle.loads),
+            "binary": (roster_codec.encode_members, roster_codec.decode_members),
+        }
+        for name, (encode, decode) in encodings.items():
+            payload = encode(roster)
+            encodeTime = best_time(encode, roster, options.repeat)
+            decodeTime = best_time(decode, payload, options.repeat)
+            print(f"{size:>8} {name:>8} {len(payload):>10} {len(payload) / size:>9.1f} {encodeTime * 1000:>10.2f} "
+                  f"{decodeTime * 1000:>10.2f} {size / encodeTime / 1000:>11.0f} {size / decodeTime / 1000:>11.0f}")
@@ -0,0 +1,142 @@
+'''
+    ##  Full logins against session resumes
+    ##  Starts Server.py with the memory storage, then every peer logs in and out with its password
+    ##  for a while, and after that resumes its login with its session token for the same time:
+    ##  python Session_Resume_Benchmark.py --peers 32 --seconds 10 --rounds 12
+'''
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import bcrypt
+
+REGISTRY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+REGISTRY_PORT = 15600
+
+sys.path.append(REGISTRY_DIR)
+import protocol
+
+
+def wait_for_registry(host, port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+# sends a command on a new connection and returns the reply, the connection is left open
+def request(host, command):
+    sock = socket.create_connection((host, REGISTRY_PORT))
+    channel = protocol.RegistryChannel(sock)
+    channel.send_command(command)
+    return sock, channel, channel.receive_text()
+
+
+class BenchmarkPeer(threading.Thread):
+
+    def __init__(self, host, username, peerServerPort, mode, deadline):
+        threading.Thread.__init__(self)
+        self.host = host
+        self.username = username
+        self.peerServerPort = peerServerPort
+        self.mode = mode
+        self.deadline = deadline
+        self.token = None
+        self.latencies = []
+        self.failures = 0
+
+    def login(self, logout):
+        sock, channel, response = request(self.host, f"LOGIN {self.username} password {self.peerServerPort} token")
+        fields = response.split()
+        if fields and fields[0] == "login-success":
+            self.token = fields[1]
+        else:
+            self.failures += 1
+        if logout:
+            channel.send_command("LOGOUT " + self.username)
+            # the registry closes the connection once the peer is logged out
+            channel.receive()
+        sock.close()
+
+    def resume(self):
+        sock, channel, response = request(self.host, f"RESUME {self.token} {self.peerServerPort}")
+        if response != "resume-success":
+            self.failures += 1
+        sock.close()
+
+    def run(self):
+        while time.time() < self.deadline:
+            start = time.perf_counter()
+            if self.mode == "login":
+                self.login(logout=True)
+            else:
+                self.resume()
+            self.latencies.append(time.perf_counter() - start)
+
+
+def run_phase(peers, mode, seconds):
+    deadline = time.time() + seconds
+    threads = [BenchmarkPeer(peer.host, peer.username, peer.peerServerPort, mode, deadline) for peer in peers]
+    for thread, peer in zip(threads, peers):
+        thread.token = peer.token
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = [latency for thread in threads for latency in thread.latencies]
+    failures = sum(thread.failures for thread in threads)
+    return len(latencies) / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99), failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peers", type=int, default=32, help="peers logging in at the same time")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of each phase")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost of the passwords, peers use 12")
+    parser.add_argument("--mode", choices=["threaded", "async"], default="async", help="mode of the registry")
+    options = parser.parse_args()
+
+    host = socket.gethostbyname(socket.gethostname())
+    registry = subprocess.Popen([sys.executable, "Server.py", "--mode", options.mode, "--storage", "memory",
+                                 "--auth-queue", str(options.peers)],
+                                cwd=REGISTRY_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_registry(host, REGISTRY_PORT):
+            raise RuntimeError("registry did not start")
+        hashedPassword = bcrypt.hashpw(b"password", bcrypt.gensalt(options.rounds)).decode()
+        peers = [BenchmarkPeer(host, f"resume_{i}", 60000 + i, "login", 0) for i in range(options.peers)]
+        for peer in peers:
+            sock, _, _ = request(host, f"JOIN {peer.username} {hashedPassword}")
+            sock.close()
+
+        results = {"full login": run_phase(peers, "login", options.seconds)}
+        # every peer logs in once more and keeps its token for the resumes
+        for peer in peers:
+            peer.login(logout=False)
+        results["resume"] = run_phase(peers, "resume", options.seconds)
+    finally:
+        registry.terminate()
+        registry.wait()
+
+    print(f"{options.peers} peers, bcrypt cost {options.rounds}, {options.mode} registry")
+    print(f"{'':<12} {'per second':>12} {'p50 ms':>10} {'p99 ms':>10} {'failures':>10}")
+    for name, (rate, p50, p99, failures) in results.items():
+        print(f"{name:<12} {rate:>12.1f} {p50 * 1000:>10.2f} {p99 * 1000:>10.2f} {failures:>10}")
+    print(f"resumes per full login: {results['resume'][0] / results['full login'][0]:.1f}")
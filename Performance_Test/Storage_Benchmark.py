@@ -0,0 +1,82 @@
+'''
+    ##  Latency of the registry operations on each storage backend
+    ##  python Storage_Benchmark.py --operations 2000 memory sqlite mongo
+'''
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import db
+
+
+def open_backend(backend, directory):
+    if backend == "sqlite":
+        return db.open_storage("sqlite", path=os.path.join(directory, "benchmark.sqlite3"))
+    if backend == "mongo":
+        storage = db.open_storage("mongo", database="p2p-chat-benchmark")
+        storage.client.drop_database("p2p-chat-benchmark")
+        return storage
+    return db.open_storage(backend)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# times every call of operation(i) and returns the latencies in milliseconds
+def measure(operation, count):
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        operation(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def run(backend, count, roomSize):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        storage = open_backend(backend, directory)
+        rooms = max(1, count // roomSize)
+        # the operations run in the order the registry calls them
+        operations = [
+            ("register", lambda i: storage.register(f"user{i}", "password-hash")),
+            ("is_account_exist", lambda i: storage.is_account_exist(f"user{i}")),
+            ("get_password", lambda i: storage.get_password(f"user{i}")),
+            ("user_login", lambda i: storage.user_login(f"user{i}", "127.0.0.1", str(20000 + i))),
+            ("is_account_online", lambda i: storage.is_account_online(f"user{i}")),
+            ("save_chatroom", lambda i: storage.save_chatroom(f"room{i % rooms}")),
+            ("add_member", lambda i: storage.add_member(f"room{i % rooms}", f"user{i}", "127.0.0.1",
+                                                       str(20000 + i), str(30000 + i))),
+            ("get_chatroom_members", lambda i: storage.get_chatroom_members(f"room{i % rooms}")),
+            ("is_member_inroom", lambda i: storage.is_member_inroom(f"user{i}")),
+            ("leave_room", lambda i: storage.leave_room(f"user{i}", f"room{i % rooms}")),
+            ("user_logout", lambda i: storage.user_logout(f"user{i}")),
+        ]
+        for name, operation in operations:
+            latencies = measure(operation, count)
+            results.append((name, statistics.mean(latencies), percentile(latencies, 0.5), percentile(latencies, 0.99)))
+        storage.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("backends", nargs="*", default=["memory", "sqlite"],
+                        help="backends to run: " + ", ".join(sorted(db.BACKENDS)))
+    parser.add_argument("--operations", type=int, default=2000, help="calls of each operation")
+    parser.add_argument("--room-size", type=int, default=50, help="members of each chat room")
+    options = parser.parse_args()
+    for backend in options.backends:
+        if backend not in db.BACKENDS:
+            parser.error("unknown backend " + backend)
+
+    print(f"{'backend':<8} {'operation':<22} {'mean ms':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for backend in options.backends:
+        for name, mean, p50, p99 in run(backend, options.operations, options.room_size):
+            print(f"{backend:<8} {name:<22} {mean:>10.4f} {p50:>10.4f} {p99:>10.4f}")
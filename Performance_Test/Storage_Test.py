@@ -0,0 +1,198 @@
+'''
+    ##  Conformance suite of the storage backends
+    ##  Every backend must give the same answers to the registry, run with the backends to check:
+    ##  python Storage_Test.py memory sqlite mongo
+    ##  with --write-behind the checks run through the write-behind queue of the registry
+'''
+import argparse
+import os
+import sys
+import traceback
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import db
+from write_behind import WriteBehindQueue, WriteBehindStorage
+
+CHECKS = []
+
+
+def check(function):
+    CHECKS.append(function)
+    return function
+
+
+# returns an empty storage of the backend
+def fresh_storage(backend):
+    if backend == "memory":
+        return db.open_storage("memory")
+    if backend == "sqlite":
+        return db.open_storage("sqlite", path=":memory:")
+    storage = db.open_storage("mongo", database="p2p-chat-conformance")
+    storage.client.drop_database("p2p-chat-conformance")
+    return storage
+
+
+def expect(actual, expected, what):
+    if actual != expected:
+        raise AssertionError(f"{what}: expected {expected!r}, got {actual!r}")
+
+
+@check
+def accounts(storage):
+    expect(storage.is_account_exist("alice"), False, "is_account_exist before register")
+    storage.register("alice", "hash-a")
+    storage.register("bob", "hash-b")
+    expect(storage.is_account_exist("alice"), True, "is_account_exist after register")
+    expect(storage.get_password("alice"), "hash-a", "get_password")
+    expect(storage.get_password("bob"), "hash-b", "get_password")
+
+
+@check
+def online_peers(storage):
+    expect(storage.is_account_online("alice"), False, "is_account_online before login")
+    storage.user_login("alice", "10.0.0.1", "60001")
+    storage.user_login("bob", "10.0.0.2", "60002")
+    expect(storage.is_account_online("alice"), True, "is_account_online after login")
+    expect(tuple(storage.get_peer_ip_port("alice")), ("10.0.0.1", "60001"), "get_peer_ip_port")
+    storage.user_logout("alice")
+    expect(storage.is_account_online("alice"), False, "is_account_online after logout")
+    expect(storage.is_account_online("bob"), True, "is_account_online of another peer")
+    storage.delete_all_online_peers()
+    expect(storage.is_account_online("bob"), False, "is_account_online after delete_all_online_peers")
+
+
+@check
+def chatrooms(storage):
+    expect(storage.get_all_chatroom_names(), "NO CHATROOMS HAVE BEEN CREATED YET", "get_all_chatroom_names")
+    expect(storage.is_room_exits("lobby"), (False, "ROOM lobby DOES NOT EXIST"), "is_room_exits before save")
+    expect(storage.save_chatroom("lobby"), "Chatroom 'lobby' created successfully.", "save_chatroom")
+    expect(storage.save_chatroom("lobby"), "Chatroom with name 'lobby' already exists.", "save_chatroom twice")
+    expect(storage.save_chatroom("games"), "Chatroom 'games' created successfully.", "save_chatroom")
+    expect(storage.is_room_exits("lobby"), (True, "ROOM lobby EXISTS "), "is_room_exits after save")
+    expect(storage.get_all_chatroom_names(), ["lobby", "games"], "get_all_chatroom_names")
+
+
+@check
+def members(storage):
+    storage.save_chatroom("lobby")
+    storage.save_chatroom("games")
+    expect(storage.get_chatroom_members("lobby"), "Member not found.", "get_chatroom_members of an empty room")
+    expect(storage.add_member("lobby", "alice", "10.0.0.1", "60001", "50001"),
+           "Member 'alice' joined the chatroom 'lobby' successfully.", "add_member")
+    expect(storage.add_member("lobby", "bob", "10.0.0.2", "60002", "50002"),
+           "Member 'bob' joined the chatroom 'lobby' successfully.", "add_member")
+    expect(storage.add_member("games", "alice", "10.0.0.1", "60001", "50001"),
+           "Member 'alice' is already in the chatroom 'games'.", "add_member of a member of another room")
+    expect(storage.get_chatroom_members("lobby"), [
+        {"username": "alice", "IP address": "10.0.0.1", "TCP_Port_number": "60001", "UDP_Port_number": "50001"},
+        {"username": "bob", "IP address": "10.0.0.2", "TCP_Port_number": "60002", "UDP_Port_number": "50002"},
+    ], "get_chatroom_members")
+    expect(storage.is_member_inroom("alice"), (True, "lobby"), "is_member_inroom")
+    expect(storage.is_member_inroom("carol"), (False, None), "is_member_inroom of a peer in no room")
+    expect(storage.leave_room("alice", "lobby"),
+           "Member 'alice' removed from the chatroom 'lobby' successfully.", "leave_room")
+    expect(storage.is_member_inroom("alice"), (False, None), "is_member_inroom after leave_room")
+    expect([member["username"] for member in storage.get_chatroom_members("lobby")], ["bob"],
+           "get_chatroom_members after leave_room")
+    expect(storage.remove_member("bob", "lobby"),
+           "Member 'bob' removed from the chatroom 'lobby' successfully.", "remove_member")
+    expect(storage.get_chatroom_members("lobby"), "Member not found.", "get_chatroom_members after remove_member")
+
+
+@check
+def rejoin_after_leave(storage):
+    storage.save_chatroom("lobby")
+    storage.save_chatroom("games")
+    storage.add_member("lobby", "alice", "10.0.0.1", "60001", "50001")
+    storage.leave_room("alice", "lobby")
+    expect(storage.add_member("games", "alice", "10.0.0.9", "60009", "50009"),
+           "Member 'alice' joined the chatroom 'games' successfully.", "add_member after leave_room")
+    expect(storage.is_member_inroom("alice"), (True, "games"), "is_member_inroom after joining another room")
+    expect(storage.get_chatroom_members("games")[0]["IP address"], "10.0.0.9", "member record of the new room")
+
+
+@check
+def member_of_missing_room(storage):
+    storage.add_member("nowhere", "alice", "10.0.0.1", "60001", "50001")
+    expect(storage.is_member_inroom("alice"), (False, None), "is_member_inroom after joining a missing room")
+
+
+@check
+def paged_members(storage):
+    storage.save_chatroom("lobby")
+    for i in range(7):
+        storage.add_member("lobby", f"user{i}", "10.0.0.1", str(60000 + i), str(50000 + i))
+    storage.leave_room("user3", "lobby")
+    pages = []
+    members, cursor = storage.get_chatroom_members_page("lobby", limit=2)
+    pages.append([member["username"] for member in members])
+    while cursor is not None:
+        members, cursor = storage.get_chatroom_members_page("lobby", cursor, 2)
+        pages.append([member["username"] for member in members])
+    expect(pages, [["user0", "user1"], ["user2", "user4"], ["user5", "user6"]], "get_chatroom_members_page")
+    expect(storage.get_chatroom_members_page("nowhere"), ([], None), "get_chatroom_members_page of a missing room")
+    expect(list(storage.iter_chatroom_members("lobby", 4)), storage.get_chatroom_members("lobby"),
+           "iter_chatroom_members")
+
+
+@check
+def batched_writes(storage):
+    storage.save_chatroom("lobby")
+    storage.add_member("lobby", "alice", "10.0.0.1", "60001", "50001")
+    storage.add_member("lobby", "bob", "10.0.0.2", "60002", "50002")
+    storage.user_login("carol", "10.0.0.3", "60003")
+    storage.apply_batch([
+        ("user_login", ("alice", "10.0.0.1", "60001")),
+        ("user_logout", ("carol",)),
+        ("remove_member", ("bob", "lobby")),
+    ])
+    expect(storage.is_account_online("alice"), True, "user_login in a batch")
+    expect(storage.is_account_online("carol"), False, "user_logout in a batch")
+    expect([member["username"] for member in storage.get_chatroom_members("lobby")], ["alice"],
+           "remove_member in a batch")
+
+
+@check
+def delete_all_members(storage):
+    storage.save_chatroom("lobby")
+    storage.save_chatroom("games")
+    storage.add_member("lobby", "alice", "10.0.0.1", "60001", "50001")
+    storage.add_member("games", "bob", "10.0.0.2", "60002", "50002")
+    expect(storage.delete_all_members(), "All members in all rooms have been deleted successfully.",
+           "delete_all_members")
+    expect(storage.get_chatroom_members("lobby"), "Member not found.", "get_chatroom_members after delete_all_members")
+    expect(storage.is_member_inroom("bob"), (False, None), "is_member_inroom after delete_all_members")
+    expect(storage.get_all_chatroom_names(), ["lobby", "games"], "rooms are kept by delete_all_members")
+
+
+def run(backend, writeBehind=False):
+    failures = 0
+    for function in CHECKS:
+        storage = fresh_storage(backend)
+        if writeBehind:
+            storage = WriteBehindStorage(storage, WriteBehindQueue(storage))
+        try:
+            function(storage)
+            print(f"PASS {backend:<8} {function.__name__}")
+        except Exception:
+            failures += 1
+            print(f"FAIL {backend:<8} {function.__name__}")
+            traceback.print_exc()
+        finally:
+            storage.close()
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("backends", nargs="*", default=["memory", "sqlite"],
+                        help="backends to run: " + ", ".join(sorted(db.BACKENDS)))
+    parser.add_argument("--write-behind", action="store_true", help="defer the writes like the registry does")
+    options = parser.parse_args()
+    for backend in options.backends:
+        if backend not in db.BACKENDS:
+            parser.error("unknown backend " + backend)
+    failures = sum(run(backend, options.write_behind) for backend in options.backends)
+    print("-" * 60)
+    print(f"{failures} failed checks" if failures else "all checks passed")
+    sys.exit(1 if failures else 0)
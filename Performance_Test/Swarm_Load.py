@@ -0,0 +1,456 @@
+'''
+    ##  Swarm load generator of the registry
+    ##  Thousands of virtual peers run on the asyncio event loops of one or more worker processes,
+    ##  each peer signs up, logs in, sends hello messages over udp, searches, lists, joins rooms
+    ##  and sends room messages to every member of its room
+    ##  The load is open loop: peers arrive at a poisson rate whatever the registry does, and every
+    ##  command is measured from the time it was due, so a slow registry is not hidden by peers
+    ##  that wait for it (coordinated omission)
+    ##  python Swarm_Load.py --rate 200 --duration 60 --session 30 --processes 4 --mix search=3,print=1,room=2
+'''
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import Bench_Results
+import protocol
+from hello_ingest import parse_hello_ack
+from roster_codec import decode_members, decode_roster
+from roster_versions import NO_VERSION
+
+REGISTRY_PORT = 15600
+REGISTRY_UDP_PORT = 15500
+# seconds between hello messages until the registry tells another interval
+HELLO_INTERVAL = 20
+
+# what a peer does after each think time, see --mix
+SCENARIOS = ("search", "print", "rooms", "room")
+DEFAULT_MIX = "search=3,print=1,rooms=1,room=2"
+
+# room message: "SWARM <monotonic ns when sent> <origin>", the receiver measures the delivery time,
+# the worker processes run on the same host so their monotonic clocks agree
+ROOM_MESSAGE = b"SWARM"
+
+
+class ReplyError(Exception):
+    pass
+
+
+# latencies in seconds of a worker
+# latency: from the time the command was due, service: from the time it was sent
+class Samples:
+
+    def __init__(self):
+        self.latency = {}
+        self.service = {}
+        self.errors = {}
+        self.delivery = []
+        self.counters = {"arrivals": 0, "sessions": 0, "online_peak": 0, "hellos": 0, "hello_acks": 0,
+                         "room_datagrams": 0, "room_delivered": 0}
+
+    def add(self, name, due, sent, done):
+        self.latency.setdefault(name, []).append(done - due)
+        self.service.setdefault(name, []).append(done - sent)
+
+    def error(self, name):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def result(self):
+        return {"latency": self.latency, "service": self.service, "errors": self.errors,
+                "delivery": self.delivery, "counters": self.counters}
+
+
+# hello acknowledgements and room messages of a virtual peer
+class PeerDatagrams(asyncio.DatagramProtocol):
+
+    def __init__(self, peer):
+        self.peer = peer
+
+    def datagram_received(self, data, address):
+        samples = self.peer.swarm.samples
+        if data.startswith(ROOM_MESSAGE):
+            fields = data.split(b" ", 2)
+            samples.delivery.append((time.monotonic_ns() - int(fields[1])) / 1e9)
+            samples.count("room_delivered")
+            return
+        ack = parse_hello_ack(data)
+        if ack is not None:
+            samples.count("hello_acks")
+            if ack[1]:
+                self.peer.helloInterval = ack[1]
+
+
+# a peer that speaks the framed registry protocol
+# replies come in the order of the commands, so each command waits for the next reply in line;
+# notifications about the members of the room are applied as they arrive
+class VirtualPeer:
+
+    def __init__(self, swarm, username, tcpPort):
+        self.swarm = swarm
+        self.username = username
+        self.tcpPort = tcpPort
+        self.reader = None
+        self.writer = None
+        self.udp = None
+        self.udpPort = None
+        self.decoder = protocol.StreamDecoder(legacy=False)
+        # futures of the replies that are waited for, in the order of the commands
+        self.waiting = deque()
+        # members of the room the peer is in: username -> (ip, udp port)
+        self.members = {}
+        self.helloInterval = HELLO_INTERVAL
+
+    async def request(self, name, command, due):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append(future)
+        sent = time.monotonic()
+        self.writer.write(protocol.encode_command(command))
+        await self.writer.drain()
+        message = await asyncio.wait_for(future, self.swarm.timeout)
+        self.swarm.samples.add(name, due, sent, time.monotonic())
+        return message
+
+    async def read(self):
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                self.decoder.feed(data)
+                for message in self.decoder:
+                    self.handle(message)
+        except (OSError, protocol.ProtocolError):
+            pass
+        finally:
+            while self.waiting:
+                future = self.waiting.popleft()
+                if not future.done():
+                    future.set_exception(ConnectionError("registry closed the connection"))
+
+    def handle(self, message):
+        if message.kind == protocol.EVENT:
+            self.handle_event(message.text().split())
+            return
+        if message.kind == protocol.ROSTER:
+            roster = decode_roster(message.payload)
+            if roster["snapshot"] and roster["page"] == 0:
+                self.members.clear()
+            self.add_members(roster["members"])
+            for username in roster["left"]:
+                self.members.pop(username, None)
+            # only the last frame of a roster answers JOIN-ROOM
+            if not roster["last"]:
+                return
+        elif message.kind == protocol.MEMBERS:
+            self.members.clear()
+            self.add_members(decode_members(message.payload))
+        if self.waiting:
+            future = self.waiting.popleft()
+            # the command may have timed out meanwhile
+            if not future.done():
+                future.set_result(message)
+
+    def add_members(self, members):
+        for username, ip, tcpPort, udpPort in members:
+            if username != self.username and udpPort:
+                self.members[username] = (ip, int(udpPort))
+
+    def handle_event(self, fields):
+        if fields[0] == "MEMBER-JOINED" and len(fields) > 3:
+            self.members[fields[1]] = (fields[2], int(fields[3]))
+        elif fields[0] == "Peer-LEFT" and len(fields) > 1:
+            self.members.pop(fields[1], None)
+        elif fields[-1:] == ["disconnection"]:
+            self.members.pop(fields[0], None)
+
+    async def hellos(self):
+        registry = (self.swarm.host, self.swarm.udpPort)
+        message = ("HELLO " + self.username + " +").encode()
+        await asyncio.sleep(random.uniform(0, 1))
+        while True:
+            self.udp.sendto(message, registry)
+            self.swarm.samples.count("hellos")
+            await asyncio.sleep(self.helloInterval)
+
+    # the session of the peer, due is the time of its arrival
+    async def run(self, due):
+        swarm = self.swarm
+        loop = asyncio.get_running_loop()
+        tasks = []
+        stage = "CONNECT"
+        try:
+            self.reader, self.writer = await asyncio.open_connection(swarm.host, swarm.port)
+            self.udp, _ = await loop.create_datagram_endpoint(lambda: PeerDatagrams(self),
+                                                              local_addr=(swarm.host, 0))
+            self.udpPort = self.udp.get_extra_info("sockname")[1]
+            swarm.samples.add("CONNECT", due, due, time.monotonic())
+            tasks.append(loop.create_task(self.read()))
+            stage = "JOIN"
+            await self.expect("JOIN", "JOIN " + self.username + " " + swarm.hashedPassword, due,
+                              ("join-success",))
+            stage = "LOGIN"
+            await self.expect("LOGIN", "LOGIN " + self.username + " " + swarm.password + " " + str(self.tcpPort),
+                              time.monotonic(), ("login-success",))
+            swarm.online += 1
+            swarm.samples.counters["online_peak"] = max(swarm.samples.counters["online_peak"], swarm.online)
+            tasks.append(loop.create_task(self.hellos()))
+            # the next action is due a think time after the previous one was due, not after it ended
+            end = due + swarm.session
+            due = time.monotonic()
+            while True:
+                due += random.expovariate(1 / swarm.think) if swarm.think > 0 else 0
+                if due >= end:
+                    break
+                await asyncio.sleep(max(0.0, due - time.monotonic()))
+                stage = swarm.pick()
+                due = await getattr(self, "scenario_" + stage)(due)
+            stage = "LOGOUT"
+            self.writer.write(protocol.encode_command("LOGOUT " + self.username))
+            await self.writer.drain()
+            swarm.samples.count("sessions")
+        except (OSError, ConnectionError, asyncio.TimeoutError, ReplyError):
+            swarm.samples.error(stage)
+        finally:
+            if stage not in ("CONNECT", "JOIN", "LOGIN"):
+                swarm.online -= 1
+            for task in tasks:
+                task.cancel()
+            if self.writer is not None:
+                self.writer.close()
+            if self.udp is not None:
+                self.udp.close()
+
+    async def expect(self, name, command, due, replies):
+        message = await self.request(name, command, due)
+        if message.kind != protocol.TEXT or message.text().split(" ", 1)[0] not in replies:
+            raise ReplyError(name + " -> " + message.text()[:80])
+        return message
+
+    async def scenario_search(self, due):
+        await self.request("SEARCH", "SEARCH " + self.swarm.random_username(), due)
+        return due
+
+    async def scenario_print(self, due):
+        await self.request("PRINT", "PRINT", due)
+        return due
+
+    async def scenario_rooms(self, due):
+        await self.request("PRINT_CHATROOMS", "PRINT_CHATROOMS", due)
+        return due
+
+    # joins a room, sends room messages a think time apart to every member and leaves
+    async def scenario_room(self, due):
+        swarm = self.swarm
+        room = random.choice(swarm.rooms)
+        message = await self.request("JOIN-ROOM", " ".join(["JOIN-ROOM", room, self.username, swarm.host,
+                                                            str(self.tcpPort), str(self.udpPort), NO_VERSION]), due)
+        # a roster answers the join, a text reply tells that the room does not exist
+        if message.kind == protocol.TEXT:
+            raise ReplyError("JOIN-ROOM -> " + message.text()[:80])
+        for _ in range(swarm.roomMessages):
+            due += random.expovariate(1 / swarm.think) if swarm.think > 0 else 0
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            datagram = b"%s %d %s" % (ROOM_MESSAGE, time.monotonic_ns(), self.username.encode())
+            for address in list(self.members.values()):
+                self.udp.sendto(datagram, address)
+            swarm.samples.count("room_datagrams", len(self.members))
+        await self.expect("LEAVE", "LEAVE " + self.username + " " + room, due, ("YOU",))
+        self.members.clear()
+        return due
+
+
+# the peers of a worker process
+class Swarm:
+
+    def __init__(self, options, worker):
+        self.host = options["host"]
+        self.port = options["port"]
+        self.udpPort = options["udp_port"]
+        self.rate = options["rate"] / options["processes"]
+        self.duration = options["duration"]
+        self.session = options["session"]
+        self.think = options["think"]
+        self.timeout = options["timeout"]
+        self.roomMessages = options["room_messages"]
+        self.rooms = options["rooms"]
+        self.password = options["password"]
+        self.hashedPassword = options["hashed_password"]
+        self.prefix = options["prefix"] + "_" + str(worker)
+        self.scenarios = list(options["mix"])
+        self.weights = [options["mix"][scenario] for scenario in self.scenarios]
+        self.samples = Samples()
+        self.online = 0
+        self.arrived = 0
+        self.tcpPortBase = 20000 + 1000 * worker
+
+    def pick(self):
+        return random.choices(self.scenarios, self.weights)[0]
+
+    def random_username(self):
+        return self.prefix + "_" + str(random.randrange(max(1, self.arrived)))
+
+    # peers arrive at a poisson rate for the duration of the run, the arrivals do not wait for
+    # the earlier peers; the lag of the event loop behind the arrivals is measured as well
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        due = start
+        peers = []
+        while True:
+            due += random.expovariate(self.rate)
+            if due - start >= self.duration:
+                break
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            self.samples.add("ARRIVAL_LAG", due, due, time.monotonic())
+            peer = VirtualPeer(self, self.prefix + "_" + str(self.arrived), self.tcpPortBase + self.arrived % 1000)
+            self.arrived += 1
+            self.samples.count("arrivals")
+            peers.append(loop.create_task(peer.run(due)))
+        await asyncio.gather(*peers)
+        result = self.samples.result()
+        result["elapsed"] = time.monotonic() - start
+        return result
+
+
+def raise_file_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def run_worker(options, worker):
+    raise_file_limit()
+    random.seed(options["seed"] * 1000 + worker)
+    return asyncio.run(Swarm(options, worker).run())
+
+
+# the rooms are created once before the peers arrive
+def create_rooms(host, port, rooms):
+    with socket.create_connection((host, port)) as sock:
+        channel = protocol.RegistryChannel(sock)
+        for room in rooms:
+            channel.send_command("CREATE " + room)
+            channel.receive_text()
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        scenario, _, weight = part.partition("=")
+        if scenario not in SCENARIOS:
+            raise argparse.ArgumentTypeError("unknown scenario " + scenario + ", expected one of " + ", ".join(SCENARIOS))
+        mix[scenario] = float(weight or 1)
+    return mix
+
+
+def merge(results):
+    merged = Samples().result()
+    merged["elapsed"] = max(result["elapsed"] for result in results)
+    for result in results:
+        for key in ("latency", "service"):
+            for name, samples in result[key].items():
+                merged[key].setdefault(name, []).extend(samples)
+        for name, count in result["errors"].items():
+            merged["errors"][name] = merged["errors"].get(name, 0) + count
+        merged["delivery"].extend(result["delivery"])
+        for name, value in result["counters"].items():
+            merged["counters"][name] += value
+    return merged
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def print_results(options, merged):
+    print(f'Swarm of {merged["counters"]["arrivals"]} peers arriving at {options.rate}/s for {options.duration}s '
+          f'({options.processes} processes), {merged["elapsed"]:.1f}s in total')
+    print("-" * 100)
+    print("{:<16} {:>8} {:>7} {:>10} {:>10} {:>10} {:>10} {:>12} {:>10}".format(
+        "Command", "Count", "Errors", "p50 (ms)", "p90 (ms)", "p99 (ms)", "max (ms)", "service p99", "per s"))
+    print("-" * 100)
+    for name in sorted(set(merged["latency"]) | set(merged["errors"])):
+        samples = merged["latency"].get(name, [])
+        print("{:<16} {:>8} {:>7} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>12.2f} {:>10.1f}".format(
+            name, len(samples), merged["errors"].get(name, 0), percentile(samples, 0.5) * 1000,
+            percentile(samples, 0.9) * 1000, percentile(samples, 0.99) * 1000, max(samples, default=0) * 1000,
+            percentile(merged["service"].get(name, []), 0.99) * 1000, len(samples) / merged["elapsed"]))
+    delivery = merged["delivery"]
+    print("{:<16} {:>8} {:>7} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+        "room delivery", len(delivery), "", percentile(delivery, 0.5) * 1000, percentile(delivery, 0.9) * 1000,
+        percentile(delivery, 0.99) * 1000, max(delivery, default=0) * 1000))
+    print("-" * 100)
+    print(", ".join(f"{name}={value}" for name, value in merged["counters"].items()))
+
+
+# latencies of the commands and room delivery times for the json and reports of Bench_Results
+def bench_run(options, merged):
+    run = Bench_Results.BenchRun("swarm", {"rate": options.rate, "session": options.session, "think": options.think,
+                                           "rooms": options.rooms, "processes": options.processes})
+    for name, samples in merged["latency"].items():
+        run.extend(name, samples)
+    run.extend("room delivery", merged["delivery"])
+    for name, count in merged["errors"].items():
+        run.count(name + " errors", count)
+    for name, value in merged["counters"].items():
+        run.count(name, value)
+    return run.finish(merged["elapsed"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=None, help="registry host, the address of this host by default")
+    parser.add_argument("--port", type=int, default=REGISTRY_PORT, help="tcp port of the registry")
+    parser.add_argument("--udp-port", type=int, default=REGISTRY_UDP_PORT, help="udp port of the registry")
+    parser.add_argument("--rate", type=float, default=100, help="peers arriving per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds peers keep arriving")
+    parser.add_argument("--session", type=float, default=30, help="seconds a peer stays logged in")
+    parser.add_argument("--think", type=float, default=2, help="mean seconds between the actions of a peer")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help="weights of the actions, " + ", ".join(SCENARIOS) + " (default " + DEFAULT_MIX + ")")
+    parser.add_argument("--rooms", type=int, default=10, help="chat rooms the peers join")
+    parser.add_argument("--room-messages", type=int, default=5, help="messages a peer sends in a room before it leaves")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes, each with its own event loop")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds a reply is waited for")
+    parser.add_argument("--seed", type=int, default=1)
+    Bench_Results.add_arguments(parser)
+    options = parser.parse_args()
+
+    host = options.host or socket.gethostbyname(socket.gethostname())
+    rooms = [f"swarm_room_{room}" for room in range(options.rooms)]
+    create_rooms(host, options.port, rooms)
+    workerOptions = {
+        "host": host, "port": options.port, "udp_port": options.udp_port, "rate": options.rate,
+        "duration": options.duration, "session": options.session, "think": options.think, "mix": options.mix,
+        "rooms": rooms, "room_messages": options.room_messages, "processes": options.processes,
+        "timeout": options.timeout, "seed": options.seed, "password": "password",
+        # a cheap hash keeps the load on the registry instead of the bcrypt cost
+        "hashed_password": bcrypt.hashpw(b"password", bcrypt.gensalt(rounds=4)).decode(),
+        "prefix": f"swarm{int(time.time())}",
+    }
+    if options.processes == 1:
+        results = [run_worker(workerOptions, 0)]
+    else:
+        with ProcessPoolExecutor(max_workers=options.processes) as pool:
+            results = list(pool.map(run_worker, [workerOptions] * options.processes, range(options.processes)))
+    merged = merge(results)
+    print_results(options, merged)
+    sys.exit(Bench_Results.finish(options, [bench_run(options, merged)]))
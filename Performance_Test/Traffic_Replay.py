@@ -0,0 +1,428 @@
+'''
+    ##  Replay of a traffic capture against a test registry
+    ##  Every captured tcp connection is opened again and sends its commands at the times they
+    ##  were received, every captured udp address sends its hello messages, at the original speed
+    ##  or compressed by --speed; the latency of each command is compared with the time the
+    ##  captured registry took for it
+    ##  python Traffic_Replay.py capture.bin --speed 10 --prepare --processes 2
+'''
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import Bench_Results
+import protocol
+import traffic_capture
+from hello_ingest import HELLO_ACK
+from roster_codec import decode_roster
+
+REGISTRY_PORT = 15600
+REGISTRY_UDP_PORT = 15500
+
+# commands the registry always answers, the replies come in the order of the commands;
+# PORTNUMBER is only answered when the udp port of the peer is known, LOGOUT closes the connection
+REPLIED = {"JOIN", "LOGIN", "RESUME", "PRINT", "PRINT_CHATROOMS", "CREATE", "JOIN-ROOM", "LEAVE", "SEARCH",
+           "STATS"}
+
+
+# captured traffic of a tcp connection or of a udp address
+class CapturedSource:
+
+    def __init__(self, source, transport, opened):
+        self.source = source
+        self.transport = transport
+        self.opened = opened
+        self.closed = None
+        # (seconds since the capture started, command or datagram text, seconds the registry took)
+        self.records = []
+
+    # pseudonym of the user that logged in on the connection or sent the hello messages
+    def username(self):
+        for _, text, _ in self.records:
+            fields = text.split()
+            if fields[0] in ("JOIN", "LOGIN", "HELLO") and len(fields) > 1:
+                return fields[1]
+        return None
+
+
+def load_sources(path):
+    started, records = traffic_capture.read_capture(path)
+    sources = {}
+    for record in records:
+        if record.kind == traffic_capture.OPEN:
+            transport, _ = traffic_capture.parse_open(record.payload)
+            sources[record.source] = CapturedSource(record.source, transport, record.time)
+            continue
+        captured = sources.get(record.source)
+        if captured is None:
+            continue
+        if record.kind == traffic_capture.CLOSE:
+            captured.closed = record.time
+        else:
+            captured.records.append((record.time, record.payload.decode(errors="replace"), record.elapsed))
+    return started, sources
+
+
+# latencies in seconds of a worker, replayed from the time a command was due, and the latencies
+# the captured registry took for the same commands
+class Samples:
+
+    def __init__(self):
+        self.recorded = {}
+        self.replayed = {}
+        self.errors = {}
+        self.counters = {"connections": 0, "commands": 0, "hellos": 0, "hello_acks": 0, "unexpected_replies": 0,
+                         "late": 0}
+
+    def add(self, name, recorded, replayed):
+        self.recorded.setdefault(name, []).append(recorded)
+        self.replayed.setdefault(name, []).append(replayed)
+
+    def error(self, name):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def result(self):
+        return {"recorded": self.recorded, "replayed": self.replayed, "errors": self.errors,
+                "counters": self.counters}
+
+
+# hello acknowledgements of a udp source, matched to the oldest hello message waiting for one
+class HelloDatagrams(asyncio.DatagramProtocol):
+
+    def __init__(self, replay):
+        self.replay = replay
+        # (due, seconds the captured registry took)
+        self.waiting = deque()
+
+    def datagram_received(self, data, address):
+        if not data.startswith(HELLO_ACK):
+            return
+        now = time.monotonic()
+        # hello messages of peers that are not online are not acknowledged
+        while self.waiting and now - self.waiting[0][0] > self.replay.timeout:
+            self.waiting.popleft()
+            self.replay.samples.error("HELLO")
+        if self.waiting:
+            due, recorded = self.waiting.popleft()
+            self.replay.samples.add("HELLO", recorded, now - due)
+            self.replay.samples.count("hello_acks")
+
+
+class Replay:
+
+    def __init__(self, options, sources):
+        self.host = options["host"]
+        self.port = options["port"]
+        self.udpPort = options["udp_port"]
+        self.speed = options["speed"]
+        self.timeout = options["timeout"]
+        self.hashedPassword = options["hashed_password"]
+        self.lateness = options["lateness"]
+        self.sources = sources
+        self.samples = Samples()
+        self.start = None
+        # pseudonym -> event set when the login of the user succeeded in the replay
+        self.logins = {}
+
+    # time.monotonic() a captured time is due at
+    def due(self, captured):
+        return self.start + captured / self.speed
+
+    async def wait_until(self, due):
+        delay = due - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif -delay > self.lateness:
+            self.samples.count("late")
+
+    def login_event(self, username):
+        event = self.logins.get(username)
+        if event is None:
+            event = self.logins[username] = asyncio.Event()
+        return event
+
+    # a compressed replay would send the hello messages of a user before its login is answered,
+    # they wait for the login as the peer did
+    async def wait_login(self, username):
+        try:
+            await asyncio.wait_for(self.login_event(username).wait(), self.timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    # the secrets of the capture are replaced by ones the test registry accepts
+    def command(self, text):
+        fields = text.split()
+        if fields[0] == "JOIN" and len(fields) > 2 and fields[2] == traffic_capture.HASH:
+            fields[2] = self.hashedPassword
+        return " ".join(fields)
+
+    async def replay_connection(self, captured):
+        await self.wait_until(self.due(captured.opened))
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            self.samples.error("CONNECT")
+            return
+        self.samples.count("connections")
+        waiting = deque()
+        readTask = asyncio.get_running_loop().create_task(self.read(reader, waiting))
+        measures = []
+        try:
+            for capturedTime, text, recorded in captured.records:
+                due = self.due(capturedTime)
+                await self.wait_until(due)
+                fields = text.split()
+                if fields[0] in REPLIED:
+                    future = asyncio.get_running_loop().create_future()
+                    waiting.append(future)
+                    username = fields[1] if fields[0] == "LOGIN" and len(fields) > 1 else None
+                    measures.append(asyncio.ensure_future(self.measure(fields[0], future, due, recorded, username)))
+                writer.write(protocol.encode_command(self.command(text)))
+                await writer.drain()
+                self.samples.count("commands")
+            if measures:
+                await asyncio.gather(*measures)
+            if captured.closed is not None:
+                await self.wait_until(self.due(captured.closed))
+        except (OSError, ConnectionError):
+            self.samples.error("CONNECTION")
+        finally:
+            readTask.cancel()
+            writer.close()
+
+    # username: pseudonym of a LOGIN, its hello messages are sent once the login succeeded
+    async def measure(self, name, future, due, recorded, username=None):
+        try:
+            message = await asyncio.wait_for(future, self.timeout)
+            self.samples.add(name, recorded, time.monotonic() - due)
+        except (asyncio.TimeoutError, ConnectionError):
+            self.samples.error(name)
+            return
+        if username is not None and message.text().startswith("login-success"):
+            self.login_event(username).set()
+
+    # replies are matched to the commands in order, notifications are skipped
+    async def read(self, reader, waiting):
+        decoder = protocol.StreamDecoder(legacy=False)
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                decoder.feed(data)
+                for message in decoder:
+                    if message.kind == protocol.EVENT:
+                        continue
+                    # only the last frame of a roster answers JOIN-ROOM
+                    if message.kind == protocol.ROSTER and not decode_roster(message.payload)["last"]:
+                        continue
+                    if waiting:
+                        future = waiting.popleft()
+                        if not future.done():
+                            future.set_result(message)
+                    else:
+                        self.samples.count("unexpected_replies")
+        except (OSError, protocol.ProtocolError):
+            pass
+        finally:
+            while waiting:
+                future = waiting.popleft()
+                if not future.done():
+                    future.set_exception(ConnectionError("registry closed the connection"))
+
+    async def replay_hellos(self, captured):
+        await self.wait_until(self.due(captured.opened))
+        loop = asyncio.get_running_loop()
+        try:
+            transport, datagrams = await loop.create_datagram_endpoint(lambda: HelloDatagrams(self),
+                                                                       local_addr=(self.host, 0))
+        except OSError:
+            self.samples.error("HELLO")
+            return
+        try:
+            username = captured.username()
+            for capturedTime, text, recorded in captured.records:
+                due = self.due(capturedTime)
+                await self.wait_until(due)
+                await self.wait_login(username)
+                # the time waited for the login is not counted in the latency
+                due = max(due, time.monotonic())
+                datagrams.waiting.append((due, recorded))
+                transport.sendto(text.encode(), (self.host, self.udpPort))
+                self.samples.count("hellos")
+            # the last acknowledgements are waited for
+            await asyncio.sleep(min(self.timeout, 1.0))
+            for _ in datagrams.waiting:
+                self.samples.error("HELLO")
+        finally:
+            transport.close()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.start = time.monotonic()
+        tasks = [loop.create_task(self.replay_connection(captured) if captured.transport == "tcp"
+                                  else self.replay_hellos(captured)) for captured in self.sources]
+        await asyncio.gather(*tasks)
+        result = self.samples.result()
+        result["elapsed"] = time.monotonic() - self.start
+        return result
+
+
+def raise_file_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+# the sources of a user are replayed by the same worker process, the others are spread by source
+def worker_of(captured, processes):
+    return zlib.crc32((captured.username() or str(captured.source)).encode()) % processes
+
+
+def run_worker(options, worker):
+    raise_file_limit()
+    _, sources = load_sources(options["capture"])
+    mine = [captured for source, captured in sorted(sources.items())
+            if worker_of(captured, options["processes"]) == worker]
+    return asyncio.run(Replay(options, mine).run())
+
+
+# accounts that log in without signing up in the capture, and rooms that are joined without
+# being created in it, are made before the replay starts
+def prepare(host, port, sources, hashedPassword):
+    users, joined, rooms, created = set(), set(), set(), set()
+    for captured in sources.values():
+        for _, text, _ in captured.records:
+            fields = text.split()
+            if fields[0] == "JOIN" and len(fields) > 1:
+                joined.add(fields[1])
+            elif fields[0] == "LOGIN" and len(fields) > 1:
+                users.add(fields[1])
+            elif fields[0] == "CREATE" and len(fields) > 1:
+                created.add(fields[1])
+            elif fields[0] == "JOIN-ROOM" and len(fields) > 1:
+                rooms.add(fields[1])
+    with socket.create_connection((host, port)) as sock:
+        channel = protocol.RegistryChannel(sock)
+        for username in sorted(users - joined):
+            channel.send_command("JOIN " + username + " " + hashedPassword)
+            channel.receive_text()
+        for room in sorted(rooms - created):
+            channel.send_command("CREATE " + room)
+            channel.receive_text()
+    return len(users - joined), len(rooms - created)
+
+
+def merge(results):
+    merged = Samples().result()
+    merged["elapsed"] = max(result["elapsed"] for result in results)
+    for result in results:
+        for key in ("recorded", "replayed"):
+            for name, samples in result[key].items():
+                merged[key].setdefault(name, []).extend(samples)
+        for name, count in result["errors"].items():
+            merged["errors"][name] = merged["errors"].get(name, 0) + count
+        for name, value in result["counters"].items():
+            merged["counters"][name] += value
+    return merged
+
+
+def print_results(options, started, merged):
+    print(f"Replay of {options.capture} (captured {time.ctime(started)}) at {options.speed}x, "
+          f"{merged['elapsed']:.1f}s in total")
+    print("recorded: time the captured registry took for a command, replayed: from the time the command was "
+          "due until its reply")
+    print("-" * 104)
+    print("{:<16} {:>8} {:>7} {:>13} {:>13} {:>13} {:>13} {:>14}".format(
+        "Command", "Count", "Errors", "rec p50 (ms)", "rep p50 (ms)", "rec p99 (ms)", "rep p99 (ms)", "p99 divergence"))
+    print("-" * 104)
+    for name in sorted(set(merged["replayed"]) | set(merged["errors"])):
+        recorded = Bench_Results.summarize(merged["recorded"].get(name, []))
+        replayed = Bench_Results.summarize(merged["replayed"].get(name, []))
+        divergence = replayed["p99"] / recorded["p99"] if recorded["p99"] else float("inf") if replayed["p99"] else 1.0
+        print("{:<16} {:>8} {:>7} {:>13.2f} {:>13.2f} {:>13.2f} {:>13.2f} {:>13.1f}x".format(
+            name, replayed["count"], merged["errors"].get(name, 0), recorded["p50"] * 1000, replayed["p50"] * 1000,
+            recorded["p99"] * 1000, replayed["p99"] * 1000, divergence))
+    print("-" * 104)
+    print(", ".join(f"{name}={value}" for name, value in merged["counters"].items()))
+
+
+def bench_run(options, merged):
+    run = Bench_Results.BenchRun("replay", {"capture": os.path.basename(options.capture), "speed": options.speed,
+                                            "processes": options.processes})
+    for name, samples in merged["replayed"].items():
+        run.extend(name, samples)
+        run.extend("recorded " + name, merged["recorded"][name])
+    for name, count in merged["errors"].items():
+        run.count(name + " errors", count)
+    for name, value in merged["counters"].items():
+        run.count(name, value)
+    return run.finish(merged["elapsed"])
+
+
+def print_capture(started, sources):
+    print(f"Captured {time.ctime(started)}")
+    for source, captured in sorted(sources.items()):
+        closed = f"{captured.closed:.3f}s" if captured.closed is not None else "the end"
+        print(f"{captured.transport} #{source} {captured.opened:.3f}s to {closed}, {len(captured.records)} records")
+        for capturedTime, text, recorded in captured.records:
+            print(f"  {capturedTime:10.3f}s {recorded * 1000:8.2f}ms  {text}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", help="file written by the registry with --capture")
+    parser.add_argument("--host", default=None, help="test registry host, the address of this host by default")
+    parser.add_argument("--port", type=int, default=REGISTRY_PORT, help="tcp port of the test registry")
+    parser.add_argument("--udp-port", type=int, default=REGISTRY_UDP_PORT, help="udp port of the test registry")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression, 10 replays 10 times faster")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes, each with its own event loop")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds a reply is waited for")
+    parser.add_argument("--lateness", type=float, default=0.01,
+                        help="seconds behind the schedule a command is counted as late")
+    parser.add_argument("--prepare", action="store_true",
+                        help="sign up the users and create the rooms the capture uses without creating them")
+    parser.add_argument("--rounds", type=int, default=12,
+                        help="bcrypt rounds of the password hash, the peers hash with 12")
+    parser.add_argument("--print", action="store_true", help="print the capture instead of replaying it")
+    Bench_Results.add_arguments(parser)
+    options = parser.parse_args()
+
+    started, sources = load_sources(options.capture)
+    if options.print:
+        print_capture(started, sources)
+        sys.exit(0)
+    host = options.host or socket.gethostbyname(socket.gethostname())
+    # every redacted account has the password traffic_capture.PASSWORD
+    hashedPassword = bcrypt.hashpw(traffic_capture.PASSWORD.encode(), bcrypt.gensalt(options.rounds)).decode()
+    if options.prepare:
+        users, rooms = prepare(host, options.port, sources, hashedPassword)
+        print(f"Prepared {users} accounts and {rooms} rooms")
+    workerOptions = {
+        "capture": options.capture, "host": host, "port": options.port, "udp_port": options.udp_port,
+        "speed": options.speed, "timeout": options.timeout, "lateness": options.lateness,
+        "processes": options.processes, "hashed_password": hashedPassword,
+    }
+    if options.processes == 1:
+        results = [run_worker(workerOptions, 0)]
+    else:
+        with ProcessPoolExecutor(max_workers=options.processes) as pool:
+            results = list(pool.map(run_worker, [workerOptions] * options.processes, range(options.processes)))
+    merged = merge(results)
+    print_results(options, started, merged)
+    sys.exit(Bench_Results.finish(options, [bench_run(options, merged)]))
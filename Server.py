@@ -2,20 +2,37 @@
     ##  Implementation of registry
     ##  150114822 - Eren Ulaş
 '''
-import asyncio
-import queue
+import argparse
+import atexit
+import os
 import socket
+import sys
 import threading
 import select
 import logging
+import time
 import db
-import bcrypt
-import pickle
-import re
-
-
-# This class is used to process the peer messages sent to registry
+import profiling
+import protocol
+from log_pipeline import CONNECTION, LOG_QUEUE_LIMIT, console, parse_categories, setup_logging
+from registry_service import RegistryService, HELLO_FIRST_TIMEOUT, HELLO_RATE, HELLO_TIMEOUT
+from registry_stats import STATS_PORT, RegistryStats, serve_stats
+from auth_pool import AUTH_QUEUE_LIMIT, AuthPool
+from hello_ingest import HelloIngest
+from outbound import OUTBOUND_QUEUE_LIMIT, POLICIES, POLICY_DROP, OutboundQueue, OutboundWriter
+from presence import PresenceIndex
+from roster_versions import ROSTER_HISTORY, RosterVersions
+from striped import STRIPES
+from session_tokens import SESSION_TOKEN_TTL, SessionTokens
+from write_behind import WriteBehindQueue, WriteBehindStorage
+from timer_wheel import ExpiryScheduler
+from traffic_capture import TrafficCapture
+
+connectionLog = logging.getLogger(CONNECTION)
+
+# This class is used to read the peer messages sent to registry
 # for each peer connected to registry, a new client thread is created
+# the messages are processed by the registry service
 class ClientThread(threading.Thread):
     # initializations for client thread
     def __init__(self, ip, port, tcpClientSocket):
@@ -26,329 +43,158 @@ class ClientThread(threading.Thread):
         self.port = port
         # socket of the peer
         self.tcpClientSocket = tcpClientSocket
-        # username, online status and udp server initializations
+        # username and online status initializations
         self.username = None
         self.isOnline = True
-        self.udpServer = None
-        self.message_queue = queue.Queue()
+        # framed and legacy "#...#" peers are told apart by the first byte they send
+        self.decoder = protocol.StreamDecoder(legacy=None)
+        # messages to the peer are written by a writer thread of this connection
+        self.outbound = OutboundQueue(args.outbound_queue, args.outbound_policy, self.abort, name=ip + ":" + str(port))
+        self.writer = OutboundWriter(self.outbound, tcpClientSocket)
 
-        print("New thread started for " + ip + ":" + str(port))
+        console("New thread started for " + ip + ":" + str(port))
 
- # main of the thread
+    # main of the thread
     def run(self):
-        # locks for thread which will be used for thread synchronization
-        self.lock = threading.Lock()
-        print("Connection from: " + self.ip + ":" + str(port))
-        print("IP Connected: " + self.ip)
-
-        while True:
-            try:
+        console("Connection from: " + self.ip + ":" + str(self.port))
+        console("IP Connected: " + self.ip)
+        self.writer.start()
+        registry.stats.connection_opened()
+        capture = registry.capture
+        captureSource = capture.connection_opened(self.ip, self.port) if capture is not None else None
+
+        try:
+            while self.isOnline:
                 # waits for incoming messages from peers
-                raw_data = self.tcpClientSocket.recv(1024).decode()
-                # Split messages using the delimiter '# ' as tcp sockets does not preserve messages order so we have to delimit messages
-                #as to be able to identify them
-                messages = re.findall(r'#(.*?)#', raw_data)
-                # Add messages to the queue
-                for message in messages:
-                    self.message_queue.put(message)
-
-                # Process each message in the queue
-                while not self.message_queue.empty():
-                    message = self.message_queue.get()
-                    message = message.split()
-                #   JOIN    #
-                if(len(message)):
-                    if message[0] == "JOIN":
-                        # join-exist is sent to peer,
-                        # if an account with this username already exists
-                        if db.is_account_exist(message[1]):
-                            response = "join-exist"
-                            print("From-> " + self.ip + ":" + str(self.port) + " " + response)
-                            logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-                            self.tcpClientSocket.send(response.encode())
-                        # join-success is sent to peer,
-                        # if an account with this username is not exist, and the account is created
-                        else:
-                            db.register(message[1], message[2])
-                            response = "join-success"
-                            logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-                            self.tcpClientSocket.send(response.encode())
-                    #   LOGIN    #
-                    elif message[0] == 'LOGIN':
-                        # login-account-not-exist is sent to peer,
-                        # if an account with the username does not exist
-                        if not db.is_account_exist(message[1]):
-                            response = "login-account-not-exist"
-                            logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-                            self.tcpClientSocket.send(response.encode())
-                        # login-online is sent to peer,
-                        # if an account with the username already online
-                        elif db.is_account_online(message[1]):
-                            response = "login-online"
-                            logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-                            self.tcpClientSocket.send(response.encode())
-                        # login-success is sent to peer,
-                        # if an account with the username exists and not online
-                        else:
-                            # retrieves the account's password, and checks if the one entered by the user is correct
-                            retrieved_hashed_pass = db.get_password(message[1])
-                            # if password is correct, then peer's thread is added to threads list
-                            # peer is added to db with its username, port number, and ip address
-                            if bcrypt.checkpw(message[2].encode('utf-8'), retrieved_hashed_pass.encode('utf-8')):
-                                self.username = message[1]
-                                with self.lock:  # Acquire the lock before modifying shared data
-                                    try:
-                                        tcpThreads[self.username] = self
-                                    finally:
-                                        pass  # The lock is automatically released when the 'with' block is exited
-                                db.user_login(message[1], self.ip, message[3])
-                                # login-success is sent to peer,
-                                # and a udp server thread is created for this peer, and thread is started
-                                # timer thread of the udp server is started
-                                response = "login-success"
-                                logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-                                onlinePeers.append(self.username)
-                                self.tcpClientSocket.send(response.encode())
-                                self.udpServer = UDPServer(self.username, self.tcpClientSocket)
-                                self.udpServer.start()
-                                self.udpServer.timer.start()
-                            # if password not matches and then login-wrong-password response is sent
-                            else:
-                                response = "login-wrong-password"
-                                logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-                                self.tcpClientSocket.send(response.encode())
-                    #   LOGOUT  #
-                    elif message[0] == "LOGOUT":
-                        # if user is online,
-                        # removes the user from onlinePeers list
-                        # and removes the thread for this user from tcpThreads
-                        # socket is closed and timer thread of the udp for this
-                        # user is cancelled
-                        if len(message) > 1 and message[1] is not None and db.is_account_online(message[1]):
-                            db.user_logout(message[1])
-                            self.lock.acquire()
-                            try:
-                                if message[1] in tcpThreads:
-                                    del tcpThreads[message[1]]
-                                    print("Removed " + self.username + " from online peers")
-                            finally:
-                                self.lock.release()
-                            print(self.ip + ":" + str(self.port) + " is logged out")
-                            onlinePeers.remove(self.username)
-                            self.tcpClientSocket.close()
-                            self.udpServer.timer.cancel()
-                            break
-
-                    elif message[0] == "PRINT":
-                        response = "List of online users: " + ', '.join(str(user) for user in onlinePeers)
-                        logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-                        self.tcpClientSocket.send(response.encode())
-
-                    elif message[0] == "PRINT_CHATROOMS":
-                        response_db = db.get_all_chatroom_names()
-                        if "NO CHATROOMS HAVE BEEN CREATED YET" not in response_db:
-                            # response = "List of chat rooms:\n" + '\n'.join(str(room_name) for room_name in response_db)
-                            response = "List of chat rooms: " + ' '.join(response_db)
-                            logging.info(
-                                "Send to " + self.ip + ":" + str(self.port) + " -> " + "NO CHATROOMS HAVE BEEN CREATED YET")
-                            self.tcpClientSocket.send(response.encode())
-                        else:
-                            self.tcpClientSocket.send(response_db.encode())
-
-                    elif message[0] == "CREATE":
-                        response_db = db.save_chatroom(message[1])
-                        logging.info("Send to " + str(self.ip) + ":" + str(self.port) + " -> " + response_db)
-                        self.tcpClientSocket.send(response_db.encode())
-
-
-                    elif message[0] == "JOIN-ROOM":
-                        exists, response_db = db.is_room_exits(message[1])
-                        if not exists:
-                            logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response_db)
-                            self.tcpClientSocket.send(response_db.encode())
-                        else:
-                            response = "MEMBER-JOINED" + " " + message[2] + " " + message[3] + " " + message[5]
-                            members_list = db.get_chatroom_members(message[1])
-                            if ("not found" not in members_list):
-                                members_list_bytes = pickle.dumps(members_list)
-                                # Acquire lock before iterating through tcpThreads
-                                with lock:
-                                    for member in members_list:
-                                        member_name = member["username"]
-                                        if member_name in tcpThreads:
-                                            if member_name != self.username:
-                                                tcpThreads[member_name].tcpClientSocket.send(response.encode())
-                                        else:
-                                            print(f"Key '{member_name}' not found in tcpThreads.")
-                                # send to the new member the list of members too !
-                                # response = "You joined the room , start chatting !"
-                                # self.tcpClientSocket.send(response.encode())
-                                response_test=db.add_member(message[1], message[2], message[3], message[4], message[5])
-                                print("DB response for joining :" , response_test)
-                                self.tcpClientSocket.sendall(members_list_bytes)
-                                logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-
-                                #db.add_member(message[1], message[2], message[3], message[4], message[5])
-
-                            else:
-                                response = "You are the first member to join the room ! "
-                                response_test = db.add_member(message[1], message[2], message[3], message[4], message[5])
-                                print("DB response for joining :", response_test)
-                                self.tcpClientSocket.send(response.encode())
-                                logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-
-                    elif message[0] == "LEAVE":
-                        # message[1]=username, message[2]=room_name
-                        response_peers = "Peer-LEFT" + " " + message[1] + " " + message[2]
-                        response_peerleft = "YOU LEFT THE ROOM"
-                        members_list = db.get_chatroom_members(message[2])
-                        # Acquire lock before iterating over members_list
-                        with lock:
-                            for member in members_list:
-                                member_name = member["username"]
-                                if member_name != self.username:
-                                    if member_name in tcpThreads:
-                                        tcpThreads[member_name].tcpClientSocket.send(response_peers.encode())
-                                    logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response_peerleft)
-                            self.tcpClientSocket.send(response_peerleft.encode())
-
-                            db.leave_room(message[1], message[2])
-
-                    #   SEARCH  #
-                    elif message[0] == "SEARCH":
-                        # checks if an account with the username exists
-                        if db.is_account_exist(message[1]):
-                            # checks if the account is online
-                            # and sends the related response to peer
-                            if db.is_account_online(message[1]):
-                                peer_info = db.get_peer_ip_port(message[1])
-                                #peer_info [0] = ip addrress and peer_info[1]=port_number
-                                response = "search-success " + peer_info[0] + ":" + peer_info[1]
-                                logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-                                self.tcpClientSocket.send(response.encode())
-                            else:
-                                response = "search-user-not-online"
-                                logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-                                self.tcpClientSocket.send(response.encode())
-                        # enters if username does not exist
-                        else:
-                            response = "search-user-not-found"
-                            logging.info("Send to " + self.ip + ":" + str(self.port) + " -> " + response)
-                            self.tcpClientSocket.send(response.encode())
-
-                    elif message[0] == "PORTNUMBER":
-                       # Acquire the lock before accessing shared data
-                        with self.lock:
-                            if self.username in udpPortnumbers:
-                                udp_port = udpPortnumbers[self.username]
-                                self.tcpClientSocket.send(str(udp_port).encode())
-                            else:
-                                print(f"Username '{self.username}' not found in udpPortnumbers")
-
-            except OSError as oErr:
-                logging.error("OSError: {0}".format(oErr))
-
-    # function for resetting the timeout for the udp timer thread
-    def resetTimeout(self):
-        self.udpServer.resetTimer()
-
-
-
-# implementation of the udp server thread for clients
-class UDPServer(threading.Thread):
+                # peer closed the connection if nothing is received
+                if self.decoder.recv_into(self.tcpClientSocket) == 0:
+                    break
+                # a read can hold several messages or only a part of one,
+                # the decoder returns the complete ones and keeps the rest
+                for message in self.decoder:
+                    message = message.fields()
+                    if not len(message):
+                        continue
+                    received = time.monotonic_ns()
+                    online = registry.dispatch(self, message)
+                    if captureSource is not None:
+                        capture.command(captureSource, message, received)
+                    if not online:
+                        self.isOnline = False
+                        break
+        except protocol.ProtocolError as pErr:
+            connectionLog.error("ProtocolError: %s", pErr)
+        except OSError as oErr:
+            connectionLog.error("OSError: %s", oErr)
+        finally:
+            # the writer closes the socket after the waiting messages are written
+            self.outbound.close()
+            registry.stats.connection_closed()
+            # the counters of this thread are kept in the totals of the registry
+            registry.stats.retire_thread()
+            if captureSource is not None:
+                capture.connection_closed(captureSource)
+
+    # True if the peer uses the legacy "#...#" protocol
+    @property
+    def legacy(self):
+        return bool(self.decoder.legacy)
+
+    # queues a message to the peer, framed unless the peer uses the legacy protocol
+    # key: member a notification is about, see outbound.OutboundQueue
+    def send(self, kind, payload, key=None):
+        self.outbound.put(protocol.encode_reply(kind, payload, self.decoder.legacy), key, kind == protocol.EVENT)
+
+    # the reader stops, the writer writes the waiting messages and closes the socket
+    def close(self):
+        self.isOnline = False
+        self.outbound.close()
+        self.shutdown(socket.SHUT_RD)
+
+    # the peer does not read its messages, the connection is closed without writing them
+    def abort(self):
+        self.isOnline = False
+        self.shutdown(socket.SHUT_RDWR)
+
+    def shutdown(self, how):
+        try:
+            self.tcpClientSocket.shutdown(how)
+        except OSError:
+            pass
+
+
+# registry options
+# the threaded registry creates a thread for each connected peer,
+# the asyncio registry serves every peer from a single event loop
+parser = argparse.ArgumentParser(description="registry of the p2p chat")
+parser.add_argument("--mode", choices=["threaded", "async"], default=os.environ.get("REGISTRY_MODE", "threaded"),
+                    help="threaded (one thread per connection) or async (single asyncio event loop)")
+parser.add_argument("--workers", type=int, default=None,
+                    help="size of the worker pool for database calls in async mode")
+parser.add_argument("--hello-first-timeout", type=float, default=HELLO_FIRST_TIMEOUT,
+                    help="seconds a peer may stay silent after login before it is logged out")
+parser.add_argument("--hello-timeout", type=float, default=HELLO_TIMEOUT,
+                    help="seconds a peer may stay silent after a hello message before it is logged out")
+parser.add_argument("--hello-rate", type=int, default=HELLO_RATE,
+                    help="hello messages per second the registry aims for, more online peers send them less often")
+parser.add_argument("--storage", choices=sorted(db.BACKENDS), default=os.environ.get("REGISTRY_STORAGE", "mongo"),
+                    help="storage backend for accounts and chat rooms")
+parser.add_argument("--storage-uri", default=os.environ.get("REGISTRY_STORAGE_URI"),
+                    help="mongodb uri for the mongo backend, or the database file for the sqlite backend")
+parser.add_argument("--presence-mirror", action=argparse.BooleanOptionalAction, default=True,
+                    help="mirror the online peers to the online_peers collection in the background")
+parser.add_argument("--flush-size", type=int, default=500,
+                    help="queued presence and membership writes that trigger a flush")
+parser.add_argument("--flush-interval", type=float, default=0.05,
+                    help="seconds between flushes of the queued presence and membership writes")
+parser.add_argument("--online-write-concern", default=None,
+                    help="write concern of the online_peers writes on mongo, e.g. 0, 1 or majority")
+parser.add_argument("--auth-workers", type=int, default=None,
+                    help="password checks that run at the same time, the number of cores by default")
+parser.add_argument("--auth-queue", type=int, default=AUTH_QUEUE_LIMIT,
+                    help="password checks that may wait for a worker before LOGIN is answered with login-busy")
+parser.add_argument("--auth-processes", action="store_true",
+                    help="check passwords in worker processes instead of threads")
+parser.add_argument("--session-ttl", type=float, default=SESSION_TOKEN_TTL,
+                    help="seconds a session token can be used to resume a login")
+parser.add_argument("--outbound-queue", type=int, default=OUTBOUND_QUEUE_LIMIT,
+                    help="notifications that may wait for a slow peer before the outbound policy applies")
+parser.add_argument("--outbound-policy", choices=POLICIES, default=POLICY_DROP,
+                    help="what is done when the outbound queue of a peer is full")
+parser.add_argument("--roster-history", type=int, default=ROSTER_HISTORY,
+                    help="changes of a room kept for the peers that join it again, older peers get the whole roster")
+parser.add_argument("--lock-stripes", type=int, default=STRIPES,
+                    help="shards of the online peers, heartbeat timers and room locks, 1 for a single lock each")
+parser.add_argument("--timer-tick", type=float, default=1.0,
+                    help="resolution of the heartbeat timer wheel in seconds")
+parser.add_argument("--quiet", action=argparse.BooleanOptionalAction,
+                    default=os.environ.get("REGISTRY_QUIET", "") not in ("", "0"),
+                    help="server mode: the connections and commands are logged instead of printed")
+parser.add_argument("--log-level", action="append", default=[os.environ.get("REGISTRY_LOG_LEVEL", "")],
+                    help="level of every category, or of one as category=LEVEL, e.g. registry.command=WARNING")
+parser.add_argument("--log-sample", action="append", default=[os.environ.get("REGISTRY_LOG_SAMPLE", "")],
+                    help="category=N logs one record of every N, e.g. registry.hello=1000")
+parser.add_argument("--log-rate", action="append", default=[os.environ.get("REGISTRY_LOG_RATE", "")],
+                    help="category=N logs at most N records a second, e.g. registry.room=50")
+parser.add_argument("--stats-port", type=int, default=int(os.environ.get("REGISTRY_STATS_PORT", STATS_PORT)),
+                    help="port of the prometheus text endpoint on 127.0.0.1, 0 turns it off")
+parser.add_argument("--profile", choices=profiling.MODES, default=os.environ.get("P2P_PROFILE") or None,
+                    help="profile the registry, the files are written to P2P_PROFILE_DIR (profiles) at exit, "
+                         "SIGUSR1 toggles the sampler and SIGUSR2 writes the files")
+parser.add_argument("--capture", default=os.environ.get("REGISTRY_CAPTURE") or None,
+                    help="write the received commands and hello messages to this file, with the usernames and "
+                         "secrets redacted, for Performance_Test/Traffic_Replay.py")
+parser.add_argument("--log-queue", type=int, default=LOG_QUEUE_LIMIT,
+                    help="records that may wait for the log writer before new ones are dropped")
+args = parser.parse_args()
 
-    # udp server thread initializations
-    def __init__(self, username, clientSocket):
-        threading.Thread.__init__(self)
-        self.username = username
-        # timer thread for the udp server is initialized
-        self.timer = threading.Timer(80, self.waitHelloMessage)
-        self.tcpClientSocket = clientSocket
-        # Define a lock for thread safety
-        self.lock = threading.Lock()
-
-    def waitHelloMessage(self):
-        if self.username is not None:
-            with self.lock:  # Acquire the lock before accessing shared data
-                db.user_logout(self.username)
-                if self.username in tcpThreads:
-                    del tcpThreads[self.username]
-                    del udpPortnumbers[self.username]
-                    onlinePeers.remove(self.username)
-                    member_inroom, room_name = db.is_member_inroom(self.username)
-                    if room_name is not None:
-                        print(f'Removed {self.username} from chatroom: {room_name}')
-                        # Check if the chatroom exists before trying to get members
-                        is_room_exists, room_status = db.is_room_exits(room_name)
-                        if is_room_exists:
-                            members_list = db.get_chatroom_members(room_name)
-                            for member in members_list:
-                                member_name = member["username"]
-                                if member_name in tcpThreads:
-                                    if member_name != self.username:
-                                        response = f'{self.username} left the room due to disconnection'
-                                        tcpThreads[member_name].tcpClientSocket.send(response.encode())
-                            db.remove_member(self.username, room_name)
-                        else:
-                            print(f"Chatroom '{room_name}' does not exist.")
-            self.tcpClientSocket.close()
-            print("Removed " + self.username + " from online peers")
-        else:
-            print("Error: username or udpServer is not properly initialized.")
-
-    def resetTimeout(self):
-        self.udpServer.resetTimer()
-
-
-
-# implementation of the udp server thread for clients
-class UDPServer(threading.Thread):
-
-    # udp server thread initializations
-    def __init__(self, username, clientSocket):
-        threading.Thread.__init__(self)
-        self.username = username
-        # timer thread for the udp server is initialized
-        self.timer = threading.Timer(80, self.waitHelloMessage)
-        self.tcpClientSocket = clientSocket
-        # Define a lock for thread safety
-        self.lock = threading.Lock()
-
-    def waitHelloMessage(self):
-        if self.username is not None:
-            with self.lock:  # Acquire the lock before accessing shared data
-                db.user_logout(self.username)
-                if self.username in tcpThreads:
-                    del tcpThreads[self.username]
-                    del udpPortnumbers[self.username]
-                    onlinePeers.remove(self.username)
-                    member_inroom, room_name = db.is_member_inroom(self.username)
-                    if room_name is not None:
-                        print(f'Removed {self.username} from chatroom: {room_name}')
-                        # Check if the chatroom exists before trying to get members
-                        is_room_exists, room_status = db.is_room_exits(room_name)
-                        if is_room_exists:
-                            members_list = db.get_chatroom_members(room_name)
-                            for member in members_list:
-                                member_name = member["username"]
-                                if member_name in tcpThreads:
-                                    if member_name != self.username:
-                                        response = f'{self.username} left the room due to disconnection'
-                                        tcpThreads[member_name].tcpClientSocket.send(response.encode())
-                            db.remove_member(self.username, room_name)
-                        else:
-                            print(f"Chatroom '{room_name}' does not exist.")
-            self.tcpClientSocket.close()
-            print("Removed " + self.username + " from online peers")
-        else:
-            print("Error: username or udpServer is not properly initialized.")
-
-    # resets the timer for udp server
-    def resetTimer(self):
-        self.timer.cancel()
-        self.timer = threading.Timer(30, self.waitHelloMessage)
-        self.timer.start()
+# log file initialization
+# records are written by a background thread, frequent ones are sampled or rate limited
+setup_logging("registry.log", parse_categories(args.log_level), parse_categories(args.log_sample, int),
+              parse_categories(args.log_rate, float), args.log_queue, args.quiet)
 
+# profiling is off unless --profile, P2P_PROFILE or SIGUSR1 turns it on
+profiling.install("registry", args.profile or "")
 
 # tcp and udp server port initializations
 print("\033[31mRegisty started...\033[0m")
@@ -356,7 +202,13 @@ port = 15600
 portUDP = 15500
 
 # db initialization
-db = db.DB()
+storageOptions = {}
+if args.storage_uri and args.storage != "memory":
+    storageOptions["uri" if args.storage == "mongo" else "path"] = args.storage_uri
+if args.online_write_concern is not None and args.storage == "mongo":
+    w = args.online_write_concern
+    storageOptions["online_write_concern"] = {"w": int(w) if w.isdigit() else w}
+db = db.open_storage(args.storage, **storageOptions)
 
 # gets the ip address of this peer
 # first checks to get it for windows devices
@@ -372,16 +224,51 @@ except socket.gaierror:
 
 print("\033[96mRegistry IP address:\033[0m " + host)
 print("\033[96mRegistry port number: \033[0m" + str(port))
+print("\033[96mRegistry mode: \033[0m" + args.mode)
+print("\033[96mRegistry storage: \033[0m" + args.storage)
 
-chatrooms = []
-# onlinePeers list for online account
-onlinePeers = []
-# accounts list for accounts
-accounts = []
-# tcpThreads list for online client's thread
-tcpThreads = {}
-# udp port number of each peer
-udpPortnumbers = {}
+db.delete_all_online_peers()
+db.delete_all_members()
+
+# heartbeat timers of every online peer are kept in a single timer wheel
+timers = ExpiryScheduler(tick=args.timer_tick, shards=args.lock_stripes)
+# presence and membership writes are queued and flushed to the database in batches
+writeBehind = WriteBehindQueue(db, args.flush_size, args.flush_interval)
+db = WriteBehindStorage(db, writeBehind)
+# online peers are read from memory, the database only mirrors them
+presence = PresenceIndex(writeBehind if args.presence_mirror else None, args.lock_stripes)
+# bcrypt checks of LOGIN run on a bounded pool
+auth = AuthPool(args.auth_workers, args.auth_queue, args.auth_processes)
+# peers resume their login on a new connection with a session token
+tokens = SessionTokens(ttl=args.session_ttl)
+# room rosters are versioned so a peer joining a room again receives only the changes
+rosters = RosterVersions(args.roster_history, args.lock_stripes)
+# counters of the commands, answered on STATS and on http://127.0.0.1:<stats port>/metrics
+stats = RegistryStats()
+serve_stats(stats, args.stats_port)
+# received traffic is captured for a replay against a test registry
+capture = None
+if args.capture:
+    capture = TrafficCapture(args.capture)
+    atexit.register(capture.close)
+    print("\033[96mCapturing traffic to: \033[0m" + args.capture)
+
+if args.mode == "async":
+    import async_registry
+
+    async_registry.AsyncRegistry(db, host, port, portUDP, args.workers, timers,
+                                 helloFirstTimeout=args.hello_first_timeout,
+                                 helloTimeout=args.hello_timeout, presence=presence, auth=auth, tokens=tokens,
+                                 rosters=rosters, outboundLimit=args.outbound_queue,
+                                 outboundPolicy=args.outbound_policy, lockStripes=args.lock_stripes,
+                                 helloRate=args.hello_rate, stats=stats, capture=capture).run()
+    sys.exit(0)
+
+# online peers, their sessions and heartbeat timers
+registry = RegistryService(db, timers, args.hello_first_timeout, args.hello_timeout, presence, auth, tokens, rosters,
+                           args.lock_stripes, args.hello_rate, stats, capture)
+# a single thread fires the expired heartbeat timers
+timers.run_thread()
 
 # tcp and udp socket initializations
 tcpSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -389,22 +276,17 @@ udpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 tcpSocket.bind((host, port))
 udpSocket.bind((host, portUDP))
 tcpSocket.listen(5)
-db.delete_all_online_peers()
-db.delete_all_members()
+# hello messages are read without blocking, every waiting one in each wakeup
+udpSocket.setblocking(False)
+helloIngest = HelloIngest(registry)
 
 # input sockets that are listened
 inputs = [tcpSocket, udpSocket]
 
-# lock
-lock=threading.Lock()
-
-# log file initialization
-logging.basicConfig(filename="registry.log", level=logging.INFO)
-
 # as long as at least a socket exists to listen registry runs
+print("\n\033[92mListening for incoming connections...\033[0m")
 while inputs:
 
-    print("\n\033[92mListening for incoming connections...\033[0m")
     # monitors for the incoming connections
     readable, writable, exceptional = select.select(inputs, [], [])
     for s in readable:
@@ -415,30 +297,10 @@ while inputs:
             newThread = ClientThread(addr[0], addr[1], tcpClientSocket)
             newThread.start()
         # if the message received comes to the udp socket
+        # every waiting hello message is read, the timers of the online peers are reset
+        # and the acknowledgements are sent
         elif s is udpSocket:
-            # received the incoming udp message and parses it
-            message, clientAddress = s.recvfrom(1024)
-            message = message.decode().split()
-            print("UDP PORT IS:", clientAddress[1], "PORT NUMBER IS:", clientAddress[0])
-
-            # checks if it is a hello message
-            if message[0] == "HELLO":
-                with lock:  # Acquire the lock before accessing shared data
-                    # checks if the account that this hello message is sent from is online
-                    if message[1] in tcpThreads:
-                        print("Hello is received from " + message[1])
-                        logging.info(
-                            "Received from " + clientAddress[0] + ":" + str(clientAddress[1]) + " -> " + " ".join(
-                                message))
-                        # sending to the client its udp port which he sent from the message for future usage
-                        # Check if the username is already in udpPortnumbers
-                        if message[1] not in udpPortnumbers:
-                            udpPortnumbers[message[1]] = int(clientAddress[1])
-                            print("Peer port entered UDP : " , udpPortnumbers[message[1]])
-                        # resets the timeout for that peer since the hello message is received
-                        tcpThreads[message[1]].resetTimeout()
-                        # Send acknowledgment to the client
-                        s.sendto("HELLO_ACK".encode(), clientAddress)
+            helloIngest.drain(s)
 
 # registry tcp socket is closed
 tcpSocket.close()
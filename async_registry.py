@@ -0,0 +1,188 @@
+'''
+    ##  asyncio implementation of the registry
+    ##  Connections, the udp hello endpoint and the command dispatch run on a single event loop,
+    ##  mongo and bcrypt calls are moved to a bounded worker pool
+'''
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import protocol
+from log_pipeline import CONNECTION, console
+from hello_ingest import HelloIngest
+from outbound import OUTBOUND_QUEUE_LIMIT, POLICY_DROP, OutboundQueue
+from registry_service import RegistryService
+from timer_wheel import ExpiryScheduler
+
+# these commands only read the in-memory registry state so they are dispatched on the loop,
+# every other command calls the database or bcrypt and runs on the worker pool
+INLINE_COMMANDS = {"PRINT", "PORTNUMBER"}
+
+connectionLog = logging.getLogger(CONNECTION)
+
+
+# connection of a peer to the asyncio registry
+class AsyncSession:
+
+    def __init__(self, loop, reader, writer, outboundLimit=OUTBOUND_QUEUE_LIMIT, outboundPolicy=POLICY_DROP):
+        self.loop = loop
+        self.reader = reader
+        self.writer = writer
+        peername = writer.get_extra_info("peername")
+        # ip and port number of the connected peer
+        self.ip = peername[0]
+        self.port = peername[1]
+        self.username = None
+        # framed and legacy "#...#" peers are told apart by the first byte they send
+        self.decoder = protocol.StreamDecoder(legacy=None)
+        # messages to the peer wait on the outbound queue until the write task of this
+        # connection writes them, the task waits for a slow peer to drain its transport
+        self.outbound = OutboundQueue(outboundLimit, outboundPolicy, self.abort, self.wakeWriter,
+                                      self.ip + ":" + str(self.port))
+        self.outboundReady = asyncio.Event()
+        self.writeTask = loop.create_task(self.writeLoop())
+
+    # True if the peer uses the legacy "#...#" protocol
+    @property
+    def legacy(self):
+        return bool(self.decoder.legacy)
+
+    # replies can be sent from worker threads, they are queued and the write task is woken up
+    # key: member a notification is about, see outbound.OutboundQueue
+    def send(self, kind, payload, key=None):
+        self.outbound.put(protocol.encode_reply(kind, payload, self.decoder.legacy), key, kind == protocol.EVENT)
+
+    def wakeWriter(self):
+        self.loop.call_soon_threadsafe(self.outboundReady.set)
+
+    async def writeLoop(self):
+        try:
+            while not self.writer.is_closing():
+                data = self.outbound.take()
+                if data:
+                    self.writer.write(data)
+                    await self.writer.drain()
+                    continue
+                if self.outbound.closed:
+                    break
+                await self.outboundReady.wait()
+                self.outboundReady.clear()
+        except (ConnectionError, OSError) as oErr:
+            connectionLog.error("OSError: %s", oErr)
+        finally:
+            self.outbound.close()
+            if not self.writer.is_closing():
+                self.writer.close()
+            connectionLog.info("Outbound queue of %s: %s", self.outbound.name, self.outbound.stats())
+
+    # the waiting messages are written before the connection is closed
+    def close(self):
+        self.outbound.close()
+        self.wakeWriter()
+
+    # the peer does not read its messages, the connection is closed without writing them
+    def abort(self):
+        self.loop.call_soon_threadsafe(self.writer.transport.abort)
+
+
+# udp endpoint of the registry that receives the hello messages
+# the datagrams received in an iteration of the loop are processed together right after it
+class HelloProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, service):
+        self.service = service
+        self.transport = None
+        self.ingest = HelloIngest(service)
+        self.flushScheduled = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, clientAddress):
+        if self.ingest.feed(data, clientAddress) and not self.flushScheduled:
+            self.flushScheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.flushScheduled = False
+        self.ingest.flush(self.transport.sendto)
+
+
+class AsyncRegistry:
+
+    def __init__(self, db, host, port, portUDP, workers=None, timers=None, outboundLimit=OUTBOUND_QUEUE_LIMIT,
+                 outboundPolicy=POLICY_DROP, **serviceOptions):
+        self.host = host
+        self.port = port
+        self.portUDP = portUDP
+        # size of the pool that runs the blocking database and bcrypt calls
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.executor = None
+        self.loop = None
+        # heartbeat timers are advanced by a task of the loop
+        self.timers = timers or ExpiryScheduler()
+        # bound and overflow policy of the outbound queue of each connection
+        self.outboundLimit = outboundLimit
+        self.outboundPolicy = outboundPolicy
+        self.service = RegistryService(db, self.timers, **serviceOptions)
+
+    # reads the messages of a connection and dispatches them in order
+    async def handleConnection(self, reader, writer):
+        session = AsyncSession(self.loop, reader, writer, self.outboundLimit, self.outboundPolicy)
+        console("Connection from: " + session.ip + ":" + str(session.port))
+        self.service.stats.connection_opened()
+        capture = self.service.capture
+        captureSource = capture.connection_opened(session.ip, session.port) if capture is not None else None
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                session.decoder.feed(data)
+                for message in session.decoder:
+                    message = message.fields()
+                    if not len(message):
+                        continue
+                    received = time.monotonic_ns()
+                    online = await self.dispatch(session, message)
+                    if captureSource is not None:
+                        capture.command(captureSource, message, received)
+                    if not online:
+                        return
+        except protocol.ProtocolError as pErr:
+            connectionLog.error("ProtocolError: %s", pErr)
+        except OSError as oErr:
+            connectionLog.error("OSError: %s", oErr)
+        finally:
+            # the write task closes the connection after the waiting messages are written
+            session.close()
+            self.service.stats.connection_closed()
+            if captureSource is not None:
+                capture.connection_closed(captureSource)
+
+    async def dispatch(self, session, message):
+        if message[0] in INLINE_COMMANDS:
+            return self.service.dispatch(session, message)
+        return await self.loop.run_in_executor(self.executor, self.service.dispatch, session, message)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="registry-worker")
+        self.loop.set_default_executor(self.executor)
+        timerTask = self.loop.create_task(self.timers.run_async(self.executor))
+        server = await asyncio.start_server(self.handleConnection, self.host, self.port, backlog=1024)
+        transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: HelloProtocol(self.service), local_addr=(self.host, self.portUDP))
+        print("\033[92mListening for incoming connections (asyncio registry)...\033[0m")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            timerTask.cancel()
+            transport.close()
+            self.executor.shutdown(wait=False)
+
+    def run(self):
+        asyncio.run(self.serve())
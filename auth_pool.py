@@ -0,0 +1,81 @@
+'''
+    ##  Password verification of the registry
+    ##  bcrypt checks run on a pool of a fixed size, and a login that finds the pool and its queue
+    ##  full is answered right away with a busy reply instead of waiting behind the others
+'''
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+
+# checks that may wait for a worker of the pool
+AUTH_QUEUE_LIMIT = 64
+
+
+class AuthBusy(Exception):
+    pass
+
+
+# runs in the workers, a module level function so that it can be sent to a process pool
+def check_password(password, hashedPassword):
+    return bcrypt.checkpw(password.encode('utf-8'), hashedPassword.encode('utf-8'))
+
+
+# bounded pool of bcrypt checks
+# bcrypt releases the GIL while hashing so a thread pool already uses every core,
+# a process pool can be chosen for bcrypt builds that do not
+class AuthPool:
+
+    def __init__(self, workers=None, queueLimit=AUTH_QUEUE_LIMIT, processes=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.queueLimit = queueLimit
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="auth-worker")
+        # a check holds a slot from admission until it is done
+        self.slots = threading.BoundedSemaphore(self.workers + queueLimit)
+        self.lock = threading.Lock()
+        # counters
+        self.inFlight = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.checkTime = 0.0
+        self.checked = 0
+
+    # checks a password against its hash, blocks until a worker has checked it
+    # raises AuthBusy without waiting if the pool and its queue are full
+    def verify(self, password, hashedPassword):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise AuthBusy()
+        with self.lock:
+            self.accepted += 1
+            self.inFlight += 1
+        start = time.perf_counter()
+        try:
+            return self.executor.submit(check_password, password, hashedPassword).result()
+        finally:
+            elapsed = time.perf_counter() - start
+            self.slots.release()
+            with self.lock:
+                self.inFlight -= 1
+                self.checked += 1
+                self.checkTime += elapsed
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queueLimit,
+                "in_flight": self.inFlight,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "check_ms_mean": self.checkTime * 1000 / self.checked if self.checked else 0.0,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -1,15 +1,177 @@
-from pymongo import MongoClient
+import bisect
+import logging
+import sqlite3
+import threading
+
+# mongo is only needed by the mongo backend
+try:
+    from pymongo import ASCENDING, DeleteOne, MongoClient, ReplaceOne
+    from pymongo.errors import DuplicateKeyError, OperationFailure
+    from pymongo.write_concern import WriteConcern
+except ImportError:
+    MongoClient = None
+    ASCENDING = 1
+
+
+# storage interface of the registry
+# every backend returns the same values and messages, Performance_Test/Storage_Test.py checks them
+class Storage:
+
+    # checks if an account with the username exists
+    def is_account_exist(self, username):
+        raise NotImplementedError
+
+    # registers a user
+    def register(self, username, password):
+        raise NotImplementedError
+
+    # retrieves the password for a given username
+    def get_password(self, username):
+        raise NotImplementedError
+
+    # checks if an account with the username online
+    def is_account_online(self, username):
+        raise NotImplementedError
+
+    # logs in the user
+    def user_login(self, username, ip, port):
+        raise NotImplementedError
+
+    # logs out the user
+    def user_logout(self, username):
+        raise NotImplementedError
+
+    # retrieves the ip address and the port number of the username
+    def get_peer_ip_port(self, username):
+        raise NotImplementedError
+
+    def delete_all_online_peers(self):
+        raise NotImplementedError
+
+    # returns a message telling if the chatroom is created or already exists
+    def save_chatroom(self, room_name):
+        raise NotImplementedError
+
+    # a user can be a member of a single chatroom at a time
+    def add_member(self, room_name, username, ip_address, tcp_port_number, udp_port_number):
+        raise NotImplementedError
+
+    # returns (exists, message)
+    def is_room_exits(self, room_name):
+        raise NotImplementedError
+
+    def leave_room(self, username, room_name):
+        raise NotImplementedError
+
+    # returns (is member, room name)
+    def is_member_inroom(self, username):
+        raise NotImplementedError
+
+    # returns the list of room names, or a message if there is no room
+    def get_all_chatroom_names(self):
+        raise NotImplementedError
+
+    # returns the members in the order they joined, or a message if the room has no members
+    def get_chatroom_members(self, room_name):
+        raise NotImplementedError
+
+    # returns (members, cursor) with at most limit members that joined after the cursor,
+    # the cursor of the next page is None after the last page
+    def get_chatroom_members_page(self, room_name, after=None, limit=100):
+        raise NotImplementedError
+
+    # members of a room read page by page, for the callers that only walk over them
+    def iter_chatroom_members(self, room_name, page_size=500):
+        after = None
+        while True:
+            members, after = self.get_chatroom_members_page(room_name, after, page_size)
+            yield from members
+            if after is None:
+                return
+
+    def remove_member(self, username, room_name):
+        raise NotImplementedError
+
+    def delete_all_members(self):
+        raise NotImplementedError
+
+    # applies a batch of deferred writes, each one is (method name, arguments) of
+    # user_login, user_logout or remove_member and there is at most one write per key
+    def apply_batch(self, writes):
+        for method, arguments in writes:
+            getattr(self, method)(*arguments)
+
+    def close(self):
+        pass
+
+
+def member_record(username, ip_address, tcp_port_number, udp_port_number):
+    return {
+        "username": username,
+        "IP address": ip_address,
+        "TCP_Port_number": tcp_port_number,
+        "UDP_Port_number": udp_port_number
+    }
 
 
 # define PY_SSIZE_T_CLEAN
 # Includes database operations
-class DB:
+class DB(Storage):
+
+    # indexes of every lookup the registry makes: (collection, keys, unique)
+    # a membership is a document of the members collection, (room_name, _id) reads the roster of a room
+    # in the order the members joined and username finds the single room of a user
+    INDEXES = [
+        ("accounts", [("username", ASCENDING)], True),
+        ("online_peers", [("username", ASCENDING)], True),
+        ("chatrooms", [("room_name", ASCENDING)], True),
+        ("members", [("room_name", ASCENDING), ("_id", ASCENDING)], False),
+        ("members", [("username", ASCENDING)], True),
+    ]
+    # fields of a member document that are not returned to the registry
+    MEMBER_PROJECTION = {"_id": 0, "room_name": 0}
 
     # db initializations
-    def __init__(self):
-
-        self.client = MongoClient('mongodb://localhost:27017')
-        self.db = self.client['p2p-chat']
+    # online_write_concern is the write concern of the batched online_peers writes, e.g. {"w": 0},
+    # the collection is rebuilt from the logins after a restart so it does not need to be durable
+    # client options are passed to MongoClient, e.g. event_listeners for command monitoring
+    def __init__(self, uri='mongodb://localhost:27017', database='p2p-chat', online_write_concern=None,
+                 **client_options):
+        if MongoClient is None:
+            raise RuntimeError("pymongo is required for the mongo storage backend")
+        self.client = MongoClient(uri, **client_options)
+        self.db = self.client[database]
+        self.batched_online_peers = self.db.online_peers
+        if online_write_concern is not None:
+            self.batched_online_peers = self.db.online_peers.with_options(write_concern=WriteConcern(**online_write_concern))
+        self.ensure_indexes()
+        self.migrate_embedded_members()
+
+    # creates the indexes if they do not exist, creating an existing index does nothing
+    def ensure_indexes(self):
+        for collection, keys, unique in self.INDEXES:
+            try:
+                self.db[collection].create_index(keys, unique=unique)
+            except OperationFailure as e:
+                # a unique index can not be built over duplicate documents left by an older registry,
+                # the lookup still gets a plain index then
+                logging.warning(f"Could not create unique index on {collection} {keys}: {e}")
+                self.db[collection].create_index(keys, unique=False)
+
+    # moves the members embedded in the chatroom documents by older registries to the members collection
+    # the first room of a user is kept since a user can be a member of a single room
+    def migrate_embedded_members(self):
+        moved = 0
+        for chatroom in self.db.chatrooms.find({"members": {"$exists": True}}, {"room_name": 1, "members": 1}):
+            for member in chatroom.get("members", []):
+                try:
+                    self.db.members.insert_one({"room_name": chatroom["room_name"], **member})
+                    moved += 1
+                except DuplicateKeyError:
+                    pass
+            self.db.chatrooms.update_one({"_id": chatroom["_id"]}, {"$unset": {"members": ""}})
+        if moved:
+            logging.info(f"Moved {moved} embedded chatroom members to the members collection")
 
     # checks if an account with the username exists
     def is_account_exist(self, username):
@@ -38,7 +200,8 @@ class DB:
             "ip": ip,
             "port": port
         }
-        self.db.online_peers.insert_one(online_peer)
+        # username is unique in online_peers, a row left from an earlier session is replaced
+        self.db.online_peers.replace_one({"username": username}, online_peer, upsert=True)
 
     # logs out the user
     def user_logout(self, username):
@@ -56,8 +219,7 @@ class DB:
     def save_chatroom(self, room_name):
 
         chatroom_data = {
-            "room_name": room_name,
-            "members": []
+            "room_name": room_name
         }
         existing_room = self.db.chatrooms.find_one({"room_name": room_name})
         if existing_room is not None:
@@ -66,35 +228,32 @@ class DB:
             try:
                 self.db.chatrooms.insert_one(chatroom_data)
                 return f"Chatroom '{room_name}' created successfully."
+            except DuplicateKeyError:
+                return f"Chatroom with name '{room_name}' already exists."
             except Exception as e:
                 return f"Error creating chatroom '{room_name}': {e}"
 
 
     def add_member(self, room_name, username, ip_address, tcp_port_number,udp_port_number):
-            member_data = {
-                "username": username,
-                "IP address": ip_address,
-                "TCP_Port_number": tcp_port_number,
-                "UDP_Port_number" : udp_port_number
-            }
-
-            # Check if the user is not already a member of the chatroom
-            if not self.is_member_inroom(username)[0]:
-                try:
-                    self.db.chatrooms.update_one(
-                        {"room_name": room_name},
-                        {'$addToSet': {'members': member_data}}
-                    )
-                    return (f"Member '{username}' joined the chatroom '{room_name}' successfully.")
-                except Exception as e:
-                    return (f"Error adding member '{username}' to chatroom '{room_name}': {e}")
-            else:
+            member_data = member_record(username, ip_address, tcp_port_number, udp_port_number)
+            member_data["room_name"] = room_name
+
+            # joining a room that does not exist changes nothing
+            if self.db.chatrooms.count_documents({"room_name": room_name}, limit=1) == 0:
+                return (f"Member '{username}' joined the chatroom '{room_name}' successfully.")
+            # the unique username index keeps a user in a single room
+            try:
+                self.db.members.insert_one(member_data)
+                return (f"Member '{username}' joined the chatroom '{room_name}' successfully.")
+            except DuplicateKeyError:
                 return(f"Member '{username}' is already in the chatroom '{room_name}'.")
+            except Exception as e:
+                return (f"Error adding member '{username}' to chatroom '{room_name}': {e}")
 
     def is_room_exits(self, room_name):
         try:
             # Check if a chatroom with the given name exists
-            count = self.db.chatrooms.count_documents({'room_name': room_name})
+            count = self.db.chatrooms.count_documents({'room_name': room_name}, limit=1)
             if (count):
                 return count > 0 , (f"ROOM {room_name} EXISTS ")
             else :
@@ -105,10 +264,7 @@ class DB:
 
     def leave_room(self,username,room_name):
             try:
-                self.db.chatrooms.update_one(
-                    {"room_name": room_name},
-                    {'$pull': {'members': {'username': username}}}
-                )
+                self.db.members.delete_one({"room_name": room_name, "username": username})
                 return (f"Member '{username}' removed from the chatroom '{room_name}' successfully.")
             except Exception as e:
                 return (f"Error removing member '{username}' from chatroom '{room_name}': {e}")
@@ -116,13 +272,11 @@ class DB:
 
     def is_member_inroom(self, username):
             try:
-                # Find the chatroom where the user is a member
-                chatroom = self.db.chatrooms.find_one({"members.username": username})
+                # Find the membership of the user
+                member = self.db.members.find_one({"username": username}, {"room_name": 1, "_id": 0})
 
-                if chatroom is not None:
-                    # Extract the room_name from the chatroom document
-                    room_name = chatroom.get("room_name", None)
-                    return True, room_name
+                if member is not None:
+                    return True, member["room_name"]
                 else:
                     return False, None
 
@@ -148,40 +302,407 @@ class DB:
 
 
     def get_chatroom_members(self, room_name):
-            # Query the chatrooms collection to find the specified chatroom
-            chatroom = self.db.chatrooms.find_one({"room_name": room_name})
-            if len(chatroom["members"]):
-                # Extract the members from the chatroom document
-                members = chatroom.get("members", [])
+            # the members of the room in the order they joined
+            members = list(self.db.members.find({"room_name": room_name}, self.MEMBER_PROJECTION).sort("_id", ASCENDING))
+            if len(members):
                 return members
             else:
                 return f"Member not found."
 
+    def get_chatroom_members_page(self, room_name, after=None, limit=100):
+            query = {"room_name": room_name}
+            if after is not None:
+                query["_id"] = {"$gt": after}
+            # one more member than the page is read to know if there is a next page
+            documents = list(self.db.members.find(query, {"room_name": 0}).sort("_id", ASCENDING).limit(limit + 1))
+            page = documents[:limit]
+            cursor = page[-1]["_id"] if len(documents) > limit else None
+            for document in page:
+                del document["_id"]
+            return page, cursor
+
     def remove_member(self,username,room_name):
         try:
-            self.db.chatrooms.update_one(
-            {"room_name": room_name},
-            {'$pull': {'members': {'username': username}}})
+            self.db.members.delete_one({"room_name": room_name, "username": username})
             return (f"Member '{username}' removed from the chatroom '{room_name}' successfully.")
         except Exception as e:
              return (f"Error removing member '{username}' from chatroom '{room_name}': {e}")
 
     def delete_all_members(self):
         try:
-            # Find all documents in the chatrooms collection
-            cursor = self.db.chatrooms.find({}, {"room_name": 1, "_id": 0})
-
-            # Iterate through each chatroom and remove all members
-            for chatroom in cursor:
-                room_name = chatroom.get("room_name", None)
-                if room_name:
-                    self.db.chatrooms.update_one(
-                        {"room_name": room_name},
-                        {'$set': {'members': []}}
-                    )
+            self.db.members.delete_many({})
             return "All members in all rooms have been deleted successfully."
         except Exception as e:
             return f"Error deleting all members in all rooms: {e}"
 
-    
-    
+    # a batch is sent as one bulk write per collection
+    def apply_batch(self, writes):
+        online_peers = []
+        members = []
+        for method, arguments in writes:
+            if method == "user_login":
+                username, ip, port = arguments
+                online_peers.append(ReplaceOne({"username": username}, {"username": username, "ip": ip, "port": port},
+                                               upsert=True))
+            elif method == "user_logout":
+                online_peers.append(DeleteOne({"username": arguments[0]}))
+            elif method == "remove_member":
+                username, room_name = arguments
+                members.append(DeleteOne({"room_name": room_name, "username": username}))
+        # writes of different keys do not depend on each other
+        if online_peers:
+            self.batched_online_peers.bulk_write(online_peers, ordered=False)
+        if members:
+            self.db.members.bulk_write(members, ordered=False)
+
+    def close(self):
+        self.client.close()
+
+
+MongoStorage = DB
+
+
+# embedded storage in a sqlite file, no database server is needed
+# the registry calls it from many threads, a single connection is shared under a lock
+class SQLiteStorage(Storage):
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS accounts (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS online_peers (
+            username TEXT PRIMARY KEY,
+            ip TEXT,
+            port TEXT
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS chatrooms (
+            room_name TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_name TEXT NOT NULL,
+            username TEXT NOT NULL,
+            ip_address TEXT,
+            tcp_port_number TEXT,
+            udp_port_number TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS members_room_username ON members (room_name, username);
+        CREATE INDEX IF NOT EXISTS members_room_id ON members (room_name, id);
+        DROP INDEX IF EXISTS members_username;
+        CREATE UNIQUE INDEX IF NOT EXISTS members_unique_username ON members (username);
+    """
+
+    def __init__(self, path="p2p-chat.sqlite3"):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        with self.lock:
+            if path != ":memory:":
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(self.SCHEMA)
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).rowcount
+
+    def is_account_exist(self, username):
+        return len(self.query("SELECT 1 FROM accounts WHERE username = ?", (username,))) > 0
+
+    def register(self, username, password):
+        self.execute("INSERT INTO accounts (username, password) VALUES (?, ?)", (username, password))
+
+    def get_password(self, username):
+        return self.query("SELECT password FROM accounts WHERE username = ?", (username,))[0][0]
+
+    def is_account_online(self, username):
+        return len(self.query("SELECT 1 FROM online_peers WHERE username = ?", (username,))) > 0
+
+    def user_login(self, username, ip, port):
+        self.execute("INSERT OR REPLACE INTO online_peers (username, ip, port) VALUES (?, ?, ?)", (username, ip, port))
+
+    def user_logout(self, username):
+        self.execute("DELETE FROM online_peers WHERE username = ?", (username,))
+
+    def get_peer_ip_port(self, username):
+        return tuple(self.query("SELECT ip, port FROM online_peers WHERE username = ?", (username,))[0])
+
+    def delete_all_online_peers(self):
+        self.execute("DELETE FROM online_peers")
+
+    def save_chatroom(self, room_name):
+        try:
+            if self.execute("INSERT OR IGNORE INTO chatrooms (room_name) VALUES (?)", (room_name,)) == 0:
+                return f"Chatroom with name '{room_name}' already exists."
+            return f"Chatroom '{room_name}' created successfully."
+        except sqlite3.Error as e:
+            return f"Error creating chatroom '{room_name}': {e}"
+
+    def add_member(self, room_name, username, ip_address, tcp_port_number, udp_port_number):
+        try:
+            # like the mongo backend, joining a room that does not exist changes nothing
+            self.execute("INSERT INTO members (room_name, username, ip_address, tcp_port_number, udp_port_number) "
+                         "SELECT room_name, ?, ?, ?, ? FROM chatrooms WHERE room_name = ?",
+                         (username, ip_address, tcp_port_number, udp_port_number, room_name))
+            return f"Member '{username}' joined the chatroom '{room_name}' successfully."
+        # the unique username index keeps a user in a single room
+        except sqlite3.IntegrityError:
+            return f"Member '{username}' is already in the chatroom '{room_name}'."
+        except sqlite3.Error as e:
+            return f"Error adding member '{username}' to chatroom '{room_name}': {e}"
+
+    def is_room_exits(self, room_name):
+        try:
+            if self.query("SELECT 1 FROM chatrooms WHERE room_name = ?", (room_name,)):
+                return True, f"ROOM {room_name} EXISTS "
+            return False, f"ROOM {room_name} DOES NOT EXIST"
+        except sqlite3.Error as e:
+            return False, f"Error checking chatroom existence for '{room_name}': {e}"
+
+    def leave_room(self, username, room_name):
+        try:
+            self.execute("DELETE FROM members WHERE room_name = ? AND username = ?", (room_name, username))
+            return f"Member '{username}' removed from the chatroom '{room_name}' successfully."
+        except sqlite3.Error as e:
+            return f"Error removing member '{username}' from chatroom '{room_name}': {e}"
+
+    def is_member_inroom(self, username):
+        rows = self.query("SELECT room_name FROM members WHERE username = ? LIMIT 1", (username,))
+        if rows:
+            return True, rows[0][0]
+        return False, None
+
+    def get_all_chatroom_names(self):
+        try:
+            names = [row[0] for row in self.query("SELECT room_name FROM chatrooms ORDER BY rowid")]
+            if names:
+                return names
+            return "NO CHATROOMS HAVE BEEN CREATED YET"
+        except sqlite3.Error as e:
+            return f"Error getting chatroom names: {e}"
+
+    def get_chatroom_members(self, room_name):
+        rows = self.query("SELECT username, ip_address, tcp_port_number, udp_port_number FROM members "
+                          "WHERE room_name = ? ORDER BY id", (room_name,))
+        if rows:
+            return [member_record(*row) for row in rows]
+        return "Member not found."
+
+    def get_chatroom_members_page(self, room_name, after=None, limit=100):
+        rows = self.query("SELECT id, username, ip_address, tcp_port_number, udp_port_number FROM members "
+                          "WHERE room_name = ? AND id > ? ORDER BY id LIMIT ?",
+                          (room_name, after if after is not None else 0, limit + 1))
+        page = rows[:limit]
+        cursor = page[-1][0] if len(rows) > limit else None
+        return [member_record(*row[1:]) for row in page], cursor
+
+    def remove_member(self, username, room_name):
+        return self.leave_room(username, room_name)
+
+    def delete_all_members(self):
+        try:
+            self.execute("DELETE FROM members")
+            return "All members in all rooms have been deleted successfully."
+        except sqlite3.Error as e:
+            return f"Error deleting all members in all rooms: {e}"
+
+    BATCH_SQL = {
+        "user_login": "INSERT OR REPLACE INTO online_peers (username, ip, port) VALUES (?, ?, ?)",
+        "user_logout": "DELETE FROM online_peers WHERE username = ?",
+        "remove_member": "DELETE FROM members WHERE username = ? AND room_name = ?",
+    }
+
+    # a batch is written in a single transaction
+    def apply_batch(self, writes):
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                for method, arguments in writes:
+                    self.connection.execute(self.BATCH_SQL[method], arguments)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+# members of a room kept by the memory storage
+# the join numbers are in a sorted list so that a page is found with a binary search and sliced
+class MemoryRoom:
+
+    def __init__(self):
+        # username -> join number
+        self.usernames = {}
+        # join number -> member record
+        self.records = {}
+        # join numbers in the order the members joined
+        self.joins = []
+
+    def __len__(self):
+        return len(self.joins)
+
+    def add(self, join, record):
+        self.usernames[record["username"]] = join
+        self.records[join] = record
+        # join numbers only grow, the new one is the largest
+        self.joins.append(join)
+
+    # returns False if the user is not a member
+    def remove(self, username):
+        join = self.usernames.pop(username, None)
+        if join is None:
+            return False
+        del self.records[join]
+        del self.joins[bisect.bisect_left(self.joins, join)]
+        return True
+
+    def members(self):
+        return [self.records[join] for join in self.joins]
+
+    # members that joined after the join number after, and the join number of the last one if more follow
+    def page(self, after, limit):
+        start = 0 if after is None else bisect.bisect_right(self.joins, after)
+        joins = self.joins[start:start + limit + 1]
+        page = joins[:limit]
+        cursor = page[-1] if len(joins) > limit else None
+        return [self.records[join] for join in page], cursor
+
+    def clear(self):
+        self.usernames.clear()
+        self.records.clear()
+        self.joins.clear()
+
+
+# storage kept in the memory of the registry, nothing survives a restart
+# used for tests and benchmarks of the registry without a database
+class MemoryStorage(Storage):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # username -> password
+        self.accounts = {}
+        # username -> (ip, port)
+        self.online_peers = {}
+        # room name -> MemoryRoom
+        self.chatrooms = {}
+        # username -> room name
+        self.member_rooms = {}
+        # the join number is the cursor of the paged roster reads
+        self.joins = 0
+
+    def is_account_exist(self, username):
+        return username in self.accounts
+
+    def register(self, username, password):
+        with self.lock:
+            self.accounts[username] = password
+
+    def get_password(self, username):
+        return self.accounts[username]
+
+    def is_account_online(self, username):
+        return username in self.online_peers
+
+    def user_login(self, username, ip, port):
+        with self.lock:
+            self.online_peers[username] = (ip, port)
+
+    def user_logout(self, username):
+        with self.lock:
+            self.online_peers.pop(username, None)
+
+    def get_peer_ip_port(self, username):
+        return self.online_peers[username]
+
+    def delete_all_online_peers(self):
+        with self.lock:
+            self.online_peers.clear()
+
+    def save_chatroom(self, room_name):
+        with self.lock:
+            if room_name in self.chatrooms:
+                return f"Chatroom with name '{room_name}' already exists."
+            self.chatrooms[room_name] = MemoryRoom()
+        return f"Chatroom '{room_name}' created successfully."
+
+    def add_member(self, room_name, username, ip_address, tcp_port_number, udp_port_number):
+        with self.lock:
+            if username in self.member_rooms:
+                return f"Member '{username}' is already in the chatroom '{room_name}'."
+            room = self.chatrooms.get(room_name)
+            if room is not None:
+                self.joins += 1
+                room.add(self.joins, member_record(username, ip_address, tcp_port_number, udp_port_number))
+                self.member_rooms[username] = room_name
+        return f"Member '{username}' joined the chatroom '{room_name}' successfully."
+
+    def is_room_exits(self, room_name):
+        if room_name in self.chatrooms:
+            return True, f"ROOM {room_name} EXISTS "
+        return False, f"ROOM {room_name} DOES NOT EXIST"
+
+    def leave_room(self, username, room_name):
+        with self.lock:
+            room = self.chatrooms.get(room_name)
+            if room is not None and room.remove(username):
+                del self.member_rooms[username]
+        return f"Member '{username}' removed from the chatroom '{room_name}' successfully."
+
+    def is_member_inroom(self, username):
+        room_name = self.member_rooms.get(username)
+        return room_name is not None, room_name
+
+    def get_all_chatroom_names(self):
+        with self.lock:
+            names = list(self.chatrooms)
+        if names:
+            return names
+        return "NO CHATROOMS HAVE BEEN CREATED YET"
+
+    def get_chatroom_members(self, room_name):
+        with self.lock:
+            room = self.chatrooms.get(room_name)
+            members = room.members() if room is not None else []
+        if members:
+            return [dict(member) for member in members]
+        return "Member not found."
+
+    def get_chatroom_members_page(self, room_name, after=None, limit=100):
+        with self.lock:
+            room = self.chatrooms.get(room_name)
+            if room is None:
+                return [], None
+            page, cursor = room.page(after, limit)
+        return [dict(member) for member in page], cursor
+
+    def remove_member(self, username, room_name):
+        return self.leave_room(username, room_name)
+
+    def delete_all_members(self):
+        with self.lock:
+            for room in self.chatrooms.values():
+                room.clear()
+            self.member_rooms.clear()
+        return "All members in all rooms have been deleted successfully."
+
+
+BACKENDS = {
+    "mongo": MongoStorage,
+    "sqlite": SQLiteStorage,
+    "memory": MemoryStorage,
+}
+
+
+# creates the storage backend selected when the registry starts
+# options are passed to the backend, e.g. uri for mongo and path for sqlite
+def open_storage(backend="mongo", **options):
+    if backend not in BACKENDS:
+        raise ValueError("unknown storage backend '" + str(backend) + "', choose one of " + ", ".join(BACKENDS))
+    return BACKENDS[backend](**options)
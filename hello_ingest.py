@@ -0,0 +1,142 @@
+'''
+    ##  Hello message ingestion of the registry
+    ##  Every wakeup of the udp socket drains all the waiting hello messages, the heartbeat timers
+    ##  of their peers are reset in one batch and the acknowledgements are sent in a burst
+'''
+import logging
+import time
+
+import profiling
+from log_pipeline import CONNECTION, STATS
+
+# hello messages read in a single wakeup, the rest wait for the next one
+HELLO_BATCH = 1024
+
+HELLO_PREFIX = b"HELLO"
+HELLO_ACK = b"HELLO_ACK"
+WHITESPACE = b" \t\r\n"
+# a peer that ends its hello message with this flag receives an extended acknowledgement:
+# "HELLO_ACK <udp port the registry sees> <heartbeat interval>", older peers get "HELLO_ACK"
+HELLO_EXTENDED = b"+"
+
+connectionLog = logging.getLogger(CONNECTION)
+statsLog = logging.getLogger(STATS)
+
+
+def encode_hello_ack(udpPort, interval):
+    return b"%s %d %d" % (HELLO_ACK, udpPort, interval)
+
+
+# returns (udp port, interval) of an extended acknowledgement, (None, None) for "HELLO_ACK",
+# or None if the datagram is not an acknowledgement
+def parse_hello_ack(datagram):
+    if not datagram.startswith(HELLO_ACK):
+        return None
+    fields = datagram[len(HELLO_ACK):].split()
+    if len(fields) < 2:
+        return None, None
+    try:
+        return int(fields[0]), int(fields[1])
+    except ValueError:
+        return None, None
+
+
+# returns (username, extended) of a hello message, or None if the datagram is not a hello message
+# the username is taken by slicing the bytes, "HELLO user" and "HELLO  user" are both accepted
+def parse_hello(datagram):
+    if not datagram.startswith(HELLO_PREFIX) or datagram[5:6] not in (b" ", b"\t"):
+        return None
+    name = datagram[6:].strip(WHITESPACE)
+    end = len(name)
+    for separator in WHITESPACE:
+        position = name.find(separator)
+        if 0 <= position < end:
+            end = position
+    if end == 0:
+        return None
+    try:
+        return name[:end].decode(), name[end:].strip(WHITESPACE) == HELLO_EXTENDED
+    except UnicodeDecodeError:
+        return None
+
+
+# batch of hello messages
+# feed() takes the datagrams of a wakeup, flush() hands them to the registry service at once
+# and sends the acknowledgements
+class HelloIngest:
+
+    def __init__(self, service, batchLimit=HELLO_BATCH, reportInterval=60, clock=time.monotonic):
+        self.service = service
+        self.batchLimit = batchLimit
+        self.hellos = []
+        # counters
+        self.wakeups = 0
+        self.datagrams = 0
+        self.ignored = 0
+        self.acked = 0
+        self.lastBatch = 0
+        self.maxBatch = 0
+        self.clock = clock
+        self.reportInterval = reportInterval
+        self.lastReport = clock()
+
+    # keeps a received datagram, returns False if it is not a hello message
+    def feed(self, datagram, clientAddress):
+        hello = parse_hello(datagram)
+        if hello is None:
+            self.ignored += 1
+            return False
+        self.hellos.append((hello[0], clientAddress, hello[1]))
+        return True
+
+    # resets the timers of the online peers of the batch and acknowledges their hello messages
+    # sendto: function that sends a datagram to an address
+    def flush(self, sendto):
+        hellos, self.hellos = self.hellos, []
+        self.wakeups += 1
+        self.lastBatch = len(hellos)
+        self.maxBatch = max(self.maxBatch, len(hellos))
+        self.datagrams += len(hellos)
+        started = time.monotonic_ns()
+        with profiling.timed("HELLO batch"):
+            acks = self.service.handleHelloBatch(hellos)
+        for clientAddress, ack in acks:
+            try:
+                sendto(ack, clientAddress)
+                self.acked += 1
+            except OSError as oErr:
+                connectionLog.error("OSError: %s", oErr)
+        capture = self.service.capture
+        if capture is not None and hellos:
+            capture.hellos(hellos, started)
+        self.report()
+
+    # threaded registry: reads every waiting datagram of a non-blocking socket, then flushes them
+    def drain(self, sock):
+        for _ in range(self.batchLimit):
+            try:
+                datagram, clientAddress = sock.recvfrom(1024)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as oErr:
+                # e.g. an icmp error of an acknowledgement that could not be delivered
+                connectionLog.error("OSError: %s", oErr)
+                continue
+            self.feed(datagram, clientAddress)
+        self.flush(sock.sendto)
+
+    def stats(self):
+        return {
+            "wakeups": self.wakeups,
+            "datagrams": self.datagrams,
+            "ignored": self.ignored,
+            "acked": self.acked,
+            "last_batch": self.lastBatch,
+            "max_batch": self.maxBatch,
+            "datagrams_per_wakeup": self.datagrams / self.wakeups if self.wakeups else 0.0,
+        }
+
+    def report(self):
+        if self.clock() - self.lastReport >= self.reportInterval:
+            self.lastReport = self.clock()
+            statsLog.info("Hello messages: %s", self.stats())
@@ -0,0 +1,248 @@
+'''
+    ##  Logging pipeline of the registry and the peers
+    ##  A record is put on a queue by the thread that logs it and is formatted and written to the
+    ##  log file by a background thread, frequent events are sampled or rate limited per category
+'''
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# categories of the records, each is a logger with its own level, sampling and rate limit
+# the registry and the peer categories are children of "registry" and "peer"
+COMMAND = "registry.command"
+HELLO = "registry.hello"
+ROOM = "registry.room"
+CONNECTION = "registry.connection"
+STATS = "registry.stats"
+CONSOLE = "registry.console"
+PEER_REGISTRY = "peer.registry"
+PEER_CHAT = "peer.chat"
+PEER_ROOM = "peer.room"
+
+# records that may wait for the writer, records logged while it is full are dropped
+LOG_QUEUE_LIMIT = 10000
+# records formatted and written to the file at once by the writer
+LOG_BATCH = 256
+
+# a hello message of every HELLO_SAMPLE is logged, room messages are logged at most
+# ROOM_RATE times a second
+HELLO_SAMPLE = 100
+ROOM_RATE = 20
+DEFAULT_SAMPLES = {HELLO: HELLO_SAMPLE}
+DEFAULT_RATES = {PEER_ROOM: ROOM_RATE}
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# True in server mode, console() logs to the CONSOLE category at DEBUG instead of printing,
+# so its output is dropped unless the category is set to DEBUG
+quiet = False
+
+
+# puts the records on the queue as they are, the message is formatted from its arguments by the
+# writer thread, so the arguments of a record must not be changed after it is logged
+# (the callers pass strings and numbers)
+class LazyQueueHandler(logging.handlers.QueueHandler):
+
+    def __init__(self, recordQueue):
+        logging.handlers.QueueHandler.__init__(self, recordQueue)
+        self.dropped = 0
+
+    # only a traceback is formatted here, its frames do not outlive the call
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    # never blocks the thread that logs
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# background thread that formats the queued records and appends them to the log file,
+# every record waiting in the queue is written with a single write
+class LogWriter(threading.Thread):
+
+    def __init__(self, recordQueue, filename, batchLimit=LOG_BATCH):
+        threading.Thread.__init__(self, daemon=True, name="log-writer")
+        self.queue = recordQueue
+        self.batchLimit = batchLimit
+        self.formatter = logging.Formatter(LOG_FORMAT)
+        self.stream = open(filename, "a", encoding="utf-8")
+        self.written = 0
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            records = [self.queue.get()]
+            try:
+                while len(records) < self.batchLimit:
+                    records.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            lines = []
+            for record in records:
+                if record is None:
+                    stopped = True
+                    continue
+                try:
+                    lines.append(self.formatter.format(record) + "\n")
+                except Exception as e:
+                    # e.g. arguments that do not match the message
+                    lines.append("Unformattable record " + repr(record.msg) + ": " + str(e) + "\n")
+            try:
+                self.stream.write("".join(lines))
+                self.stream.flush()
+                self.written += len(lines)
+            except OSError:
+                pass
+        self.stream.close()
+
+    # writes the waiting records and stops
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+
+# passes one of every `every` records of a category, warnings and errors always pass
+class SampleFilter(logging.Filter):
+
+    def __init__(self, every):
+        logging.Filter.__init__(self)
+        self.every = max(1, int(every))
+        self.seen = 0
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        # a record can be counted twice by two threads, the sample only needs to be close
+        self.seen += 1
+        if self.seen % self.every == 1 or self.every == 1:
+            return True
+        self.suppressed += 1
+        return False
+
+
+# passes at most `rate` records a second of a category (token bucket with a burst of one
+# second), warnings and errors always pass
+class RateLimitFilter(logging.Filter):
+
+    def __init__(self, rate, clock=time.monotonic):
+        logging.Filter.__init__(self)
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.clock = clock
+        self.last = clock()
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.suppressed += 1
+            return False
+
+
+# "category=value" options, a value without a category applies to every category ("")
+# e.g. ["INFO", "registry.hello=WARNING"] -> {"": "INFO", "registry.hello": "WARNING"}
+def parse_categories(specs, convert=str):
+    values = {}
+    for spec in specs or ():
+        for part in spec.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            category, separator, value = part.rpartition("=")
+            values[category if separator else ""] = convert(value)
+    return values
+
+
+# the writer of the pipeline, stopped at exit after the waiting records are written
+writer = None
+handler = None
+
+
+# replaces the handlers of the root logger with the queue of the pipeline
+# levels, samples, rates: category -> level name, sample size, records per second,
+# the defaults sample the hello messages and rate limit the room messages
+def setup_logging(filename, levels=None, samples=None, rates=None, queueLimit=LOG_QUEUE_LIMIT, quietConsole=False):
+    global writer, handler, quiet
+    stop_logging()
+    # the records do not carry the file and line they are logged from, see "Optimization" in the
+    # documentation of the logging module, the format does not use them
+    logging._srcfile = None
+    recordQueue = queue.Queue(queueLimit)
+    handler = LazyQueueHandler(recordQueue)
+    root = logging.getLogger()
+    for previous in list(root.handlers):
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    for category, level in (levels or {}).items():
+        logging.getLogger(category or None).setLevel(level.upper())
+    for category, every in dict(DEFAULT_SAMPLES, **(samples or {})).items():
+        set_filter(category, SampleFilter(every) if every > 1 else None)
+    for category, rate in dict(DEFAULT_RATES, **(rates or {})).items():
+        set_filter(category, RateLimitFilter(rate) if rate > 0 else None)
+    quiet = quietConsole
+    writer = LogWriter(recordQueue, filename)
+    writer.start()
+    return writer
+
+
+# a category has at most one sampling or rate limiting filter
+def set_filter(category, recordFilter):
+    logger = logging.getLogger(category or None)
+    for previous in list(logger.filters):
+        if isinstance(previous, (SampleFilter, RateLimitFilter)):
+            logger.removeFilter(previous)
+    if recordFilter is not None:
+        logger.addFilter(recordFilter)
+
+
+# writes the waiting records and stops the writer thread
+def stop_logging():
+    global writer
+    if writer is not None:
+        writer.stop()
+        writer = None
+
+
+atexit.register(stop_logging)
+
+
+def stats():
+    suppressed = {}
+    for name, logger in list(logging.root.manager.loggerDict.items()):
+        for recordFilter in getattr(logger, "filters", ()):
+            if isinstance(recordFilter, (SampleFilter, RateLimitFilter)):
+                suppressed[name] = recordFilter.suppressed
+    return {"queued": handler.queue.qsize() if handler is not None else 0,
+            "written": writer.written if writer is not None else 0,
+            "dropped": handler.dropped if handler is not None else 0,
+            "suppressed": suppressed}
+
+
+consoleLog = logging.getLogger(CONSOLE)
+
+
+# interactive output of the registry, printed unless the registry runs in server mode
+def console(*values):
+    if quiet:
+        consoleLog.debug(" ".join(["%s"] * len(values)), *values)
+    else:
+        print(*values)
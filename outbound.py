@@ -0,0 +1,170 @@
+'''
+    ##  Outbound queues of the registry connections
+    ##  Messages to a peer are put on the queue of its connection and written by a writer of that
+    ##  connection, so a peer that reads slowly delays only its own messages
+'''
+import logging
+import threading
+from collections import deque
+
+from log_pipeline import CONNECTION
+
+# notifications that may wait for the writer of a connection
+OUTBOUND_QUEUE_LIMIT = 256
+
+# what is done with a notification that does not fit in the queue
+# drop: the notification is dropped
+# disconnect: the connection is closed, the peer logs in again
+# coalesce: it replaces the waiting notification about the same member, or is dropped if there is none
+POLICY_DROP = "drop"
+POLICY_DISCONNECT = "disconnect"
+POLICY_COALESCE = "coalesce"
+POLICIES = (POLICY_DROP, POLICY_DISCONNECT, POLICY_COALESCE)
+
+connectionLog = logging.getLogger(CONNECTION)
+
+
+# queued frame, the data of a coalesced notification is replaced in place
+class OutboundFrame:
+    __slots__ = ("data", "key")
+
+    def __init__(self, data, key):
+        self.data = data
+        self.key = key
+
+
+# bounded queue of the encoded frames of a connection
+# replies are always queued since a peer waits for each of them, only notifications (frames with
+# a key or limited=True) count against the limit, put never blocks
+class OutboundQueue:
+
+    def __init__(self, limit=OUTBOUND_QUEUE_LIMIT, policy=POLICY_DROP, onOverflow=None, onPut=None, name=""):
+        if policy not in POLICIES:
+            raise ValueError("unknown outbound policy " + str(policy))
+        self.limit = limit
+        self.policy = policy
+        # called without the lock when the disconnect policy closes the connection
+        self.onOverflow = onOverflow
+        # called without the lock after a frame is queued, e.g. to wake up an asyncio writer
+        self.onPut = onPut
+        self.name = name
+        self.frames = deque()
+        # key -> waiting frame of the notification, used by the coalesce policy
+        self.keyed = {}
+        self.notifications = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.maxDepth = 0
+        self.enqueued = 0
+        self.written = 0
+        self.writtenBytes = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflows = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    # queues a frame, returns False if it is dropped
+    # key: member the notification is about, notifications with the same key can be coalesced
+    def put(self, data, key=None, limited=False):
+        overflow = False
+        with self.condition:
+            if self.closed:
+                return False
+            limited = limited or key is not None
+            if limited and self.notifications >= self.limit:
+                self.overflows += 1
+                if self.policy == POLICY_COALESCE and key is not None and key in self.keyed:
+                    self.keyed[key].data = data
+                    self.coalesced += 1
+                    return True
+                if self.policy == POLICY_DISCONNECT:
+                    self.closed = True
+                    self.frames.clear()
+                    self.keyed.clear()
+                    self.notifications = 0
+                    overflow = True
+                else:
+                    self.dropped += 1
+                    if self.dropped == 1:
+                        connectionLog.warning("Outbound queue of %s is full, notifications are dropped", self.name)
+                    return False
+            else:
+                frame = OutboundFrame(data, key if limited else None)
+                self.frames.append(frame)
+                if limited:
+                    self.notifications += 1
+                    if key is not None:
+                        self.keyed[key] = frame
+                self.enqueued += 1
+                self.maxDepth = max(self.maxDepth, len(self.frames))
+                self.condition.notify()
+        if overflow:
+            connectionLog.warning("Outbound queue of %s is full, the connection is closed", self.name)
+            if self.onOverflow is not None:
+                self.onOverflow()
+            return False
+        if self.onPut is not None:
+            self.onPut()
+        return True
+
+    # takes every waiting frame and returns their data joined, b"" if nothing is waiting
+    def take(self):
+        with self.condition:
+            return self.takeLocked()
+
+    def takeLocked(self):
+        if not self.frames:
+            return b""
+        frames = self.frames
+        self.frames = deque()
+        self.keyed.clear()
+        self.notifications = 0
+        data = b"".join([frame.data for frame in frames])
+        self.written += len(frames)
+        self.writtenBytes += len(data)
+        return data
+
+    # blocks until frames are waiting, returns b"" once the queue is closed and empty
+    def wait(self):
+        with self.condition:
+            while not self.frames and not self.closed:
+                self.condition.wait()
+            return self.takeLocked()
+
+    # no frame is queued after close, the frames that are already waiting are still written
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {"depth": len(self.frames), "max_depth": self.maxDepth, "enqueued": self.enqueued,
+                    "written": self.written, "written_bytes": self.writtenBytes, "dropped": self.dropped,
+                    "coalesced": self.coalesced, "overflows": self.overflows}
+
+
+# writer thread of a connection of the threaded registry
+class OutboundWriter(threading.Thread):
+
+    def __init__(self, outbound, sock):
+        threading.Thread.__init__(self, daemon=True)
+        self.outbound = outbound
+        self.sock = sock
+
+    # the socket is closed by the writer once the queue is closed and the waiting frames are written
+    def run(self):
+        while True:
+            data = self.outbound.wait()
+            if not data:
+                break
+            try:
+                self.sock.sendall(data)
+            except OSError as oErr:
+                connectionLog.error("OSError: %s", oErr)
+                self.outbound.close()
+                break
+        self.sock.close()
+        connectionLog.info("Outbound queue of %s: %s", self.outbound.name, self.outbound.stats())
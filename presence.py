@@ -0,0 +1,122 @@
+'''
+    ##  Online peers of the registry
+    ##  The presence index is the only place the registry reads the online state from,
+    ##  the online_peers collection of the database is updated in the background as a mirror
+    ##  by the write-behind queue
+'''
+import threading
+
+from striped import STRIPES, ShardedMap
+
+PRINT_PREFIX = b"List of online users: "
+PRINT_SEPARATOR = b", "
+
+
+# online peer
+class PresenceEntry:
+    __slots__ = ("username", "ip", "tcpPort", "udpPort", "session", "helloInterval")
+
+    def __init__(self, username, ip, tcpPort, session):
+        self.username = username
+        # ip address and peer server port that are sent on SEARCH
+        self.ip = ip
+        self.tcpPort = tcpPort
+        # udp port is learned from the first hello message
+        self.udpPort = None
+        # connection of the peer to the registry
+        self.session = session
+        # heartbeat interval the last extended hello acknowledgement told the peer, the peer waits
+        # this long between its hello messages until it is acknowledged again
+        self.helloInterval = None
+
+
+# online peers by username
+# lookups are single dict reads and need no lock, changes lock only the shard of the username
+# the PRINT reply is kept encoded: a login appends to it, a logout makes it rebuilt
+# on the next PRINT, and PRINTs in between reuse the same bytes
+class PresenceIndex:
+
+    def __init__(self, mirror=None, shards=STRIPES):
+        self.peers = ShardedMap(shards)
+        # guards the encoded PRINT reply only
+        self.printLock = threading.Lock()
+        # optional mirror of the online peers in the database
+        self.mirror = mirror
+        self.printBuffer = bytearray(PRINT_PREFIX)
+        self.printPayload = bytes(PRINT_PREFIX)
+        self.printStale = False
+        self.printRebuild = False
+        # count of the rebuilds of the PRINT reply
+        self.printRebuilds = 0
+
+    def __len__(self):
+        return len(self.peers)
+
+    def __contains__(self, username):
+        return username in self.peers
+
+    def get(self, username):
+        return self.peers.get(username)
+
+    def session(self, username):
+        entry = self.peers.get(username)
+        return entry.session if entry is not None else None
+
+    def usernames(self):
+        return list(self.peers)
+
+    # adds a peer that logged in, returns False if the peer is already online
+    def add(self, username, ip, tcpPort, session):
+        # only the shard of the username is locked for the insert, a PRINT that rebuilds the reply
+        # after it already lists the peer, so the peer is appended only if no rebuild ran since
+        rebuilds = self.printRebuilds
+        if not self.peers.insert(username, PresenceEntry(username, ip, tcpPort, session)):
+            return False
+        with self.printLock:
+            if self.printRebuilds != rebuilds:
+                # the rebuild may or may not have listed the peer, the next PRINT rebuilds the reply
+                self.printRebuild = True
+            # a logout that removed the peer meanwhile makes the reply rebuilt instead
+            elif not self.printRebuild and username in self.peers:
+                if len(self.printBuffer) > len(PRINT_PREFIX):
+                    self.printBuffer += PRINT_SEPARATOR
+                self.printBuffer += username.encode()
+            self.printStale = True
+        if self.mirror is not None:
+            self.mirror.login(username, ip, tcpPort)
+        return True
+
+    # removes a peer that logged out or expired, returns its entry
+    # if session is given the peer is only removed while it is still logged in from that session
+    def remove(self, username, session=None):
+        entry = self.peers.pop_if(username, None if session is None else lambda entry: entry.session is session)
+        if entry is None:
+            return None
+        with self.printLock:
+            self.printRebuild = True
+            self.printStale = True
+        if self.mirror is not None:
+            self.mirror.logout(username)
+        return entry
+
+    # keeps the udp port the peer sends its hello messages from
+    # returns the entry of the peer, or None if it is not online
+    def set_udp_port(self, username, udpPort):
+        entry = self.peers.get(username)
+        if entry is not None and entry.udpPort is None:
+            entry.udpPort = udpPort
+        return entry
+
+    # encoded PRINT reply
+    def print_payload(self):
+        if not self.printStale:
+            return self.printPayload
+        with self.printLock:
+            if self.printRebuild:
+                self.printBuffer = bytearray(PRINT_PREFIX + PRINT_SEPARATOR.join(name.encode() for name in self.peers))
+                self.printRebuild = False
+                self.printRebuilds += 1
+            self.printPayload = bytes(self.printBuffer)
+            self.printStale = False
+            return self.printPayload
+
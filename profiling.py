@@ -0,0 +1,301 @@
+'''
+    ##  Profiling hooks of the registry and the peer
+    ##  Opt-in with P2P_PROFILE=sample|deterministic or with a signal: a stack sampler writes
+    ##  collapsed stacks for flamegraph tools, a per-thread cProfile writes pstats files, and both
+    ##  write the wall and cpu time of every handler
+'''
+import atexit
+import cProfile
+import contextlib
+import json
+import os
+import pstats
+import re
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+# profiling modes
+# sample: a thread records the stacks of every thread every SAMPLE_INTERVAL seconds, cheap enough
+# for a loaded registry, the samples are wall clock so threads waiting in select or recv show too
+# deterministic: every thread runs under a cProfile profile of its own, exact call counts but slow,
+# it is chosen at start and runs until exit
+SAMPLE = "sample"
+DETERMINISTIC = "deterministic"
+MODES = (SAMPLE, DETERMINISTIC)
+
+SAMPLE_INTERVAL = 0.005
+PROFILE_DIR = "profiles"
+
+# SIGUSR1 starts the sampler, or stops it and writes the files, SIGUSR2 writes the files and
+# keeps profiling, SIGTERM writes them before exit while profiling
+TOGGLE_SIGNAL = getattr(signal, "SIGUSR1", None)
+DUMP_SIGNAL = getattr(signal, "SIGUSR2", None)
+
+# "Thread-12 (run)" and "registry-worker_3" are counted as one thread in the collapsed stacks
+THREAD_NUMBER = re.compile(r"[-_]\d+")
+
+
+# "thread;outer function (file:line);...;innermost function (file:line)"
+def collapse(threadName, frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    names.append(THREAD_NUMBER.sub("", threadName))
+    return ";".join(reversed(names))
+
+
+# samples the stacks of every other thread
+class StackSampler(threading.Thread):
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        threading.Thread.__init__(self, daemon=True, name="profile-sampler")
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.stacks[collapse(names.get(ident, str(ident)), frame)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    # one "stack count" line for each stack, the input format of flamegraph.pl and speedscope
+    def write(self, path):
+        with open(path, "w") as collapsed:
+            for stack, count in self.stacks.most_common():
+                collapsed.write("%s %d\n" % (stack, count))
+
+
+# a cProfile profile for every thread
+# the hook of threading.setprofile runs once in each new thread and is replaced there by the
+# profile of that thread
+class ThreadProfiles:
+
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.setprofile(self.attach)
+        self.attach()
+
+    def attach(self, *hookArguments):
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    # merged profiles of every thread, e.g. for "python -m pstats" or flameprof
+    def write(self, path):
+        with self.lock:
+            profiles = list(self.profiles)
+        merged = None
+        for profile in profiles:
+            try:
+                if merged is None:
+                    merged = pstats.Stats(profile)
+                else:
+                    merged.add(profile)
+            except TypeError:
+                # a thread whose profile has not recorded a call yet
+                pass
+        if merged is not None:
+            merged.dump_stats(path)
+
+
+# wall and cpu time of the handlers, each thread adds to counters of its own without a lock
+class HandlerTimes:
+
+    def __init__(self):
+        self.local = threading.local()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def record(self, name, wallNs, cpuNs):
+        times = getattr(self.local, "times", None)
+        if times is None:
+            times = self.local.times = {}
+            with self.lock:
+                self.threads.append(times)
+        entry = times.get(name)
+        if entry is None:
+            entry = times[name] = [0, 0, 0]
+        entry[0] += 1
+        entry[1] += wallNs
+        entry[2] += cpuNs
+
+    # handler -> calls, wall and cpu milliseconds, the handlers that took longest first
+    def merged(self):
+        totals = {}
+        with self.lock:
+            threads = list(self.threads)
+        for times in threads:
+            for name, (calls, wallNs, cpuNs) in list(times.items()):
+                total = totals.setdefault(name, [0, 0, 0])
+                total[0] += calls
+                total[1] += wallNs
+                total[2] += cpuNs
+        return {name: {"calls": calls, "wall_ms": round(wallNs / 1e6, 3), "cpu_ms": round(cpuNs / 1e6, 3),
+                       "wall_us_mean": round(wallNs / calls / 1e3, 1), "cpu_us_mean": round(cpuNs / calls / 1e3, 1)}
+                for name, (calls, wallNs, cpuNs) in sorted(totals.items(), key=lambda item: -item[1][1])}
+
+    def write(self, path):
+        with open(path, "w") as breakdown:
+            json.dump(self.merged(), breakdown, indent=1)
+
+
+# times a handler while profiling, see timed()
+class HandlerTimer:
+    __slots__ = ("times", "name", "wallStart", "cpuStart")
+
+    def __init__(self, times, name):
+        self.times = times
+        self.name = name
+
+    def __enter__(self):
+        self.wallStart = time.perf_counter_ns()
+        self.cpuStart = time.thread_time_ns()
+
+    def __exit__(self, *exception):
+        self.times.record(self.name, time.perf_counter_ns() - self.wallStart, time.thread_time_ns() - self.cpuStart)
+
+
+# state of the profiling of this process, None while it is off
+handlerTimes = None
+sampler = None
+threadProfiles = None
+processName = "process"
+directory = PROFILE_DIR
+interval = SAMPLE_INTERVAL
+dumps = 0
+stateLock = threading.RLock()
+NOT_TIMED = contextlib.nullcontext()
+
+
+# with profiling.timed("JOIN-ROOM"): ... costs a call while profiling is off
+def timed(name):
+    times = handlerTimes
+    if times is None:
+        return NOT_TIMED
+    return HandlerTimer(times, name)
+
+
+def is_enabled():
+    return handlerTimes is not None
+
+
+def start(mode=SAMPLE):
+    global handlerTimes, sampler, threadProfiles
+    if mode not in MODES:
+        raise ValueError("unknown profiling mode " + str(mode))
+    with stateLock:
+        if handlerTimes is not None:
+            return
+        handlerTimes = HandlerTimes()
+        if mode == SAMPLE:
+            sampler = StackSampler(interval)
+            sampler.start()
+        else:
+            threadProfiles = ThreadProfiles()
+            threadProfiles.start()
+
+
+# writes the files of the profile so far, returns their paths
+# <name>-<pid>-<n>.collapsed (sampler), <name>-<pid>-<n>.prof (deterministic),
+# <name>-<pid>-<n>-handlers.json (both)
+def dump():
+    global dumps
+    with stateLock:
+        if handlerTimes is None:
+            return []
+        os.makedirs(directory, exist_ok=True)
+        dumps += 1
+        prefix = os.path.join(directory, "%s-%d-%d" % (processName, os.getpid(), dumps))
+        paths = []
+        if sampler is not None:
+            sampler.write(prefix + ".collapsed")
+            paths.append(prefix + ".collapsed")
+        if threadProfiles is not None:
+            threadProfiles.write(prefix + ".prof")
+            paths.append(prefix + ".prof")
+        handlerTimes.write(prefix + "-handlers.json")
+        paths.append(prefix + "-handlers.json")
+        return paths
+
+
+# writes the files and stops the sampler, a deterministic profile runs until exit
+def stop():
+    global handlerTimes, sampler
+    with stateLock:
+        paths = dump()
+        if sampler is not None:
+            sampler.stop()
+            sampler = None
+            handlerTimes = None
+        return paths
+
+
+def toggle(signalNumber=None, frame=None):
+    if handlerTimes is None:
+        start(SAMPLE)
+    elif sampler is not None:
+        stop()
+
+
+def dump_on_signal(signalNumber, frame):
+    dump()
+
+
+# the files are written, then the signal is raised again with its default action
+def dump_and_exit(signalNumber, frame):
+    stop()
+    signal.signal(signalNumber, signal.SIG_DFL)
+    os.kill(os.getpid(), signalNumber)
+
+
+# called once by the main thread of Server.py and Peer.py
+# mode, profileDirectory and sampleInterval default to P2P_PROFILE, P2P_PROFILE_DIR and
+# P2P_PROFILE_INTERVAL (milliseconds), the files are written at exit if profiling is on
+def install(name, mode=None, profileDirectory=None, sampleInterval=None):
+    global processName, directory, interval
+    processName = name
+    directory = profileDirectory or os.environ.get("P2P_PROFILE_DIR", PROFILE_DIR)
+    interval = sampleInterval or float(os.environ.get("P2P_PROFILE_INTERVAL", SAMPLE_INTERVAL * 1000)) / 1000
+    mode = mode if mode is not None else os.environ.get("P2P_PROFILE", "")
+    if TOGGLE_SIGNAL is not None:
+        signal.signal(TOGGLE_SIGNAL, toggle)
+        signal.signal(DUMP_SIGNAL, dump_on_signal)
+    if mode:
+        start(mode)
+        # the default action of SIGTERM would skip the files, the harness stops the registry with it
+        signal.signal(signal.SIGTERM, dump_and_exit)
+    atexit.register(stop)
+
+
+# environment that turns profiling on in a child process, e.g. a registry started by a benchmark
+def environment(mode, profileDirectory, base=None):
+    env = dict(os.environ if base is None else base)
+    env["P2P_PROFILE"] = mode
+    env["P2P_PROFILE_DIR"] = os.path.abspath(profileDirectory)
+    return env
+
+
+# files written by the processes profiled into a directory
+def collect(profileDirectory):
+    if not os.path.isdir(profileDirectory):
+        return []
+    return sorted(os.path.join(profileDirectory, name) for name in os.listdir(profileDirectory)
+                  if name.endswith((".collapsed", ".prof", "-handlers.json")))
@@ -0,0 +1,208 @@
+'''
+    ##  Wire protocol shared by the registry and the peers
+    ##  Messages are sent as length-prefixed frames with a typed envelope,
+    ##  the "#...#" text protocol is kept for peers and registries that are not upgraded yet
+'''
+import struct
+import time
+from collections import namedtuple
+
+# frame header: payload length (4 bytes) and message kind (1 byte) in network byte order
+HEADER = struct.Struct("!IB")
+# frames larger than this are treated as a broken stream
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+# message kinds
+# command sent from a peer to the registry, e.g. "LOGIN user password 60000"
+COMMAND = 1
+# text reply of the registry to a command
+TEXT = 2
+# member list of a chat room
+MEMBERS = 3
+# notification pushed by the registry, e.g. "MEMBER-JOINED user ip port"
+EVENT = 4
+# versioned member list of a chat room, whole or the changes since a version, see roster_versions.py
+ROSTER = 5
+
+# legacy commands are written as "#COMMAND arg1 arg2#", framed streams never start with '#'
+# since the first byte of a frame is the high byte of its length
+LEGACY_DELIMITER = ord("#")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# typed message envelope
+class Message(namedtuple("Message", ["kind", "payload"])):
+    __slots__ = ()
+
+    def text(self):
+        return self.payload.decode(errors="replace")
+
+    def fields(self):
+        return self.text().split()
+
+
+def encode_frame(kind, payload):
+    return HEADER.pack(len(payload), kind) + payload
+
+
+def encode_command(command, legacy=False):
+    if legacy:
+        return ("#" + command + "#").encode()
+    return encode_frame(COMMAND, command.encode())
+
+
+# replies to legacy peers are written without any framing, as the registry always did
+def encode_reply(kind, payload, legacy=False):
+    if legacy:
+        return payload
+    return encode_frame(kind, payload)
+
+
+# incremental decoder of a tcp stream
+# received bytes are kept in a reusable bytearray, complete messages are taken out of it
+# and the unread tail is moved to the front only when the free space runs out
+class StreamDecoder:
+
+    # legacy: True for "#...#" commands, False for frames, None to detect it from the first byte
+    def __init__(self, legacy=False, bufferSize=65536):
+        self.legacy = legacy
+        self.buffer = bytearray(bufferSize)
+        # unread bytes are buffer[start:end]
+        self.start = 0
+        self.end = 0
+
+    # reads from a socket straight into the buffer, returns 0 if the connection is closed
+    def recv_into(self, sock, size=None):
+        self.reserve(size or 4096)
+        with memoryview(self.buffer) as view:
+            with view[self.end:] as free:
+                received = sock.recv_into(free)
+        self.end += received
+        return received
+
+    # adds bytes that were read somewhere else, e.g. by an asyncio stream
+    def feed(self, data):
+        self.reserve(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    # makes room for at least size more bytes after the unread ones
+    def reserve(self, size):
+        if self.start == self.end:
+            self.start = self.end = 0
+        if len(self.buffer) - self.end >= size:
+            return
+        unread = self.end - self.start
+        if self.start:
+            self.buffer[:unread] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, unread
+        if len(self.buffer) - self.end < size:
+            self.buffer.extend(bytes(size - (len(self.buffer) - self.end)))
+
+    def __iter__(self):
+        while True:
+            message = self.next_message()
+            if message is None:
+                return
+            yield message
+
+    # returns the next complete message, or None if more bytes are needed
+    def next_message(self):
+        if self.start == self.end:
+            return None
+        if self.legacy is None:
+            self.legacy = self.buffer[self.start] == LEGACY_DELIMITER
+        if self.legacy:
+            return self.next_legacy_message()
+        return self.next_frame()
+
+    def next_frame(self):
+        if self.end - self.start < HEADER.size:
+            return None
+        length, kind = HEADER.unpack_from(self.buffer, self.start)
+        if length > MAX_FRAME_SIZE:
+            raise ProtocolError("frame of " + str(length) + " bytes is too large")
+        payloadStart = self.start + HEADER.size
+        if self.end - payloadStart < length:
+            # the rest of the frame is read into the buffer without growing it again and again
+            self.reserve(payloadStart + length - self.end)
+            return None
+        with memoryview(self.buffer) as view:
+            payload = view[payloadStart:payloadStart + length].tobytes()
+        self.start = payloadStart + length
+        return Message(kind, payload)
+
+    def next_legacy_message(self):
+        opening = self.buffer.find(b"#", self.start, self.end)
+        if opening < 0:
+            # bytes outside of "#...#" are dropped like the registry always did
+            self.start = self.end
+            return None
+        closing = self.buffer.find(b"#", opening + 1, self.end)
+        if closing < 0:
+            # the command is split across reads, the rest of it is waited for
+            self.start = opening
+            if self.end - opening > MAX_FRAME_SIZE:
+                raise ProtocolError("unterminated legacy command")
+            return None
+        with memoryview(self.buffer) as view:
+            payload = view[opening + 1:closing].tobytes()
+        self.start = closing + 1
+        return Message(COMMAND, payload)
+
+
+# connection of a peer to the registry
+# sends commands and returns the replies and notifications of the registry as messages
+class RegistryChannel:
+
+    def __init__(self, sock, legacy=False):
+        self.sock = sock
+        self.legacy = legacy
+        self.decoder = StreamDecoder(legacy=False)
+        # time.monotonic() of the last command, the registry takes a command as a heartbeat
+        self.lastSent = 0.0
+
+    def send_command(self, command):
+        self.sock.sendall(encode_command(command, self.legacy))
+        self.lastSent = time.monotonic()
+
+    # blocks until a message is received, returns None if the registry closed the connection
+    def receive(self):
+        if self.legacy:
+            return self.receive_legacy()
+        while True:
+            message = self.decoder.next_message()
+            if message is not None:
+                return message
+            if self.decoder.recv_into(self.sock) == 0:
+                return None
+
+    # legacy replies have no framing, a member list is told apart from a text
+    # reply by not being valid utf-8
+    def receive_legacy(self):
+        data = self.sock.recv(65536)
+        if not data:
+            return None
+        try:
+            data.decode()
+            return Message(TEXT, data)
+        except UnicodeDecodeError:
+            return Message(MEMBERS, data)
+
+    # receives the reply of the last command, skipping the notifications received before it
+    # legacy replies and notifications can not be told apart so the first message is returned
+    def receive_reply(self):
+        while True:
+            message = self.receive()
+            if message is None or self.legacy or message.kind != EVENT:
+                return message
+
+    # receives a text reply, an empty string is returned if the connection is closed
+    def receive_text(self):
+        message = self.receive()
+        if message is None:
+            return ""
+        return message.text()
@@ -0,0 +1,446 @@
+'''
+    ##  Command handling of the registry
+    ##  Shared by the threaded registry (Server.py) and the asyncio registry (async_registry.py)
+'''
+import logging
+import pickle
+import threading
+import time
+
+import profiling
+import protocol
+from hello_ingest import HELLO_ACK, encode_hello_ack
+from log_pipeline import COMMAND, HELLO, ROOM, console
+from db import member_record
+from auth_pool import AuthBusy, AuthPool
+from presence import PresenceIndex
+from registry_stats import RegistryStats
+from roster_codec import encode_members, encode_roster
+from roster_versions import NO_VERSION, ROSTER_PAGE, RosterVersions
+from session_tokens import SessionTokens
+from striped import STRIPES, StripedLocks
+
+# the first hello message is expected 80 seconds after login,
+# after that every hello message gives the peer another 30 seconds
+HELLO_FIRST_TIMEOUT = 80
+HELLO_TIMEOUT = 30
+# peers send a hello message every HELLO_INTERVAL seconds while the registry receives fewer than
+# HELLO_RATE of them per second, with more online peers they are told to send them less often
+HELLO_INTERVAL = 20
+HELLO_INTERVAL_MAX = 120
+HELLO_RATE = 1000
+
+# reply to a command the registry failed to process
+COMMAND_ERROR = "command-error"
+
+# commands that start the heartbeat timer of a peer instead of resetting it
+LOGIN_COMMANDS = ("LOGIN", "RESUME")
+
+# the messages are formatted by the writer thread of the log, see log_pipeline
+commandLog = logging.getLogger(COMMAND)
+helloLog = logging.getLogger(HELLO)
+roomLog = logging.getLogger(ROOM)
+
+
+# This class keeps the online state of the registry and processes the peer messages
+# a session is the connection a message is received from, it provides
+# ip, port, username, legacy, send(kind, payload, key=None) and close()
+# send never blocks, notifications are sent with the username they are about as their key
+# so that a full outbound queue can coalesce them, see outbound.OutboundQueue
+class RegistryService:
+
+    def __init__(self, db, timers, helloFirstTimeout=HELLO_FIRST_TIMEOUT, helloTimeout=HELLO_TIMEOUT, presence=None,
+                 auth=None, tokens=None, rosters=None, lockStripes=STRIPES, helloRate=HELLO_RATE, stats=None,
+                 capture=None):
+        self.db = db
+        # heartbeat timers of the online peers, see timer_wheel.ExpiryScheduler
+        self.timers = timers
+        # seconds a peer may stay silent after login and after a hello message
+        self.helloFirstTimeout = helloFirstTimeout
+        self.helloTimeout = helloTimeout
+        # hello messages per second the heartbeat interval of the peers is adapted to
+        self.helloRate = helloRate
+        # online peers with their addresses and sessions
+        self.presence = presence if presence is not None else PresenceIndex()
+        # bounded pool of the bcrypt checks of LOGIN
+        self.auth = auth if auth is not None else AuthPool()
+        # session tokens that let a peer log in again on a new connection without its password
+        self.tokens = tokens if tokens is not None else SessionTokens()
+        # versions of the room rosters, a peer joining a room again receives only the changes
+        self.rosters = rosters if rosters is not None else RosterVersions()
+        # a change of a room roster and its roster version are made under the lock of the room,
+        # so the versions follow the order of the changes in the database
+        self.roomLocks = StripedLocks(lockStripes)
+        # count, errors and latency of every command, answered on STATS
+        self.stats = stats if stats is not None else RegistryStats()
+        self.stats.add_gauge("online_peers", lambda: len(self.presence))
+        # chat rooms are counted once here and then on every CREATE, reading the gauge does not
+        # scan the chat rooms of the database
+        names = self.db.get_all_chatroom_names()
+        self.rooms = len(names) if isinstance(names, list) else 0
+        self.roomsLock = threading.Lock()
+        self.stats.add_gauge("rooms", lambda: self.rooms)
+        # traffic capture the connections record their commands to, None unless --capture is given
+        self.capture = capture
+        self.handlers = {
+            "JOIN": self.handleJoin,
+            "LOGIN": self.handleLogin,
+            "LOGOUT": self.handleLogout,
+            "RESUME": self.handleResume,
+            "PRINT": self.handlePrint,
+            "PRINT_CHATROOMS": self.handlePrintChatrooms,
+            "CREATE": self.handleCreate,
+            "JOIN-ROOM": self.handleJoinRoom,
+            "LEAVE": self.handleLeave,
+            "SEARCH": self.handleSearch,
+            "PORTNUMBER": self.handlePortnumber,
+            "STATS": self.handleStats,
+        }
+
+    # processes a message that is already split into its fields
+    # returns False if the connection of the session should be closed
+    # any command of a logged in peer proves that it is alive, like a hello message
+    def dispatch(self, session, message):
+        handler = self.handlers.get(message[0])
+        if handler is None:
+            commandLog.info("Unknown message from %s:%s -> %s", session.ip, session.port, " ".join(message))
+            return True
+        start = time.perf_counter_ns()
+        try:
+            with profiling.timed(message[0]):
+                result = handler(session, message)
+        except Exception:
+            # a command the handler fails on, e.g. one with missing fields, is rejected and the
+            # connection stays open
+            self.stats.record(message[0], time.perf_counter_ns() - start, errors=1)
+            commandLog.error("Command from %s:%s failed -> %s", session.ip, session.port, message[0], exc_info=True)
+            self.reply(session, COMMAND_ERROR)
+            return True
+        self.stats.record(message[0], time.perf_counter_ns() - start)
+        if result is False:
+            return False
+        # the timer started by a login keeps its longer first timeout
+        if session.username is not None and message[0] not in LOGIN_COMMANDS:
+            self.timers.reset(session.username, self.heartbeatTimeout(self.peerInterval(session.username)))
+        return True
+
+    # heartbeat interval a peer is waiting with, the one it was last told or the current one;
+    # a peer that was told a longer interval than the current one keeps waiting that long
+    def peerInterval(self, username):
+        entry = self.presence.get(username)
+        current = self.heartbeatInterval()
+        if entry is None or entry.helloInterval is None:
+            return current
+        return max(entry.helloInterval, current)
+
+    # seconds between the hello messages of a peer, adapted to the number of online peers
+    def heartbeatInterval(self):
+        return min(HELLO_INTERVAL_MAX, max(HELLO_INTERVAL, len(self.presence) // self.helloRate))
+
+    # seconds a peer may stay silent, grows with the heartbeat interval
+    def heartbeatTimeout(self, interval=None):
+        return self.helloTimeout * (interval or self.heartbeatInterval()) / HELLO_INTERVAL
+
+    def reply(self, session, response):
+        commandLog.info("Send to %s:%s -> %s", session.ip, session.port, response)
+        session.send(protocol.TEXT, response.encode())
+
+    #   JOIN    #
+    def handleJoin(self, session, message):
+        # join-exist is sent to peer,
+        # if an account with this username already exists
+        if self.db.is_account_exist(message[1]):
+            response = "join-exist"
+            console("From-> " + session.ip + ":" + str(session.port) + " " + response)
+        # join-success is sent to peer,
+        # if an account with this username is not exist, and the account is created
+        else:
+            self.db.register(message[1], message[2])
+            response = "join-success"
+        self.reply(session, response)
+
+    #   LOGIN    #
+    def handleLogin(self, session, message):
+        # login-account-not-exist is sent to peer,
+        # if an account with the username does not exist
+        if not self.db.is_account_exist(message[1]):
+            self.reply(session, "login-account-not-exist")
+        # login-online is sent to peer,
+        # if an account with the username already online
+        elif message[1] in self.presence:
+            self.reply(session, "login-online")
+        # login-success is sent to peer,
+        # if an account with the username exists and not online
+        else:
+            # retrieves the account's password, and checks if the one entered by the user is correct
+            retrieved_hashed_pass = self.db.get_password(message[1])
+            # login-busy is sent to peer without checking the password,
+            # if too many logins are being checked, the peer retries later
+            try:
+                verified = self.auth.verify(message[2], retrieved_hashed_pass)
+            except AuthBusy:
+                self.reply(session, "login-busy")
+                return
+            # if password is correct, then peer is added to the online peers
+            # with its username, port number, ip address and session
+            if verified:
+                # another session may have logged in with the same account meanwhile
+                if not self.presence.add(message[1], session.ip, message[3], session):
+                    self.reply(session, "login-online")
+                    return
+                session.username = message[1]
+                # login-success is sent to peer and the heartbeat timer of the peer is started
+                # a peer that asks for a session token gets it after login-success
+                if len(message) > 4 and message[4] == "token":
+                    self.reply(session, "login-success " + self.tokens.issue(session.username))
+                else:
+                    self.reply(session, "login-success")
+                self.startHeartbeat(session)
+            # if password not matches and then login-wrong-password response is sent
+            else:
+                self.reply(session, "login-wrong-password")
+
+    #   LOGOUT  #
+    def handleLogout(self, session, message):
+        # if user is online, removes the user from the online peers
+        # socket is closed and heartbeat timer of this user is cancelled
+        if len(message) > 1 and self.presence.remove(message[1]) is not None:
+            self.tokens.revoke(message[1])
+            console("Removed " + message[1] + " from online peers")
+            console(session.ip + ":" + str(session.port) + " is logged out")
+            self.timers.cancel(message[1])
+            session.close()
+            return False
+
+    #   RESUME  #
+    def handleResume(self, session, message):
+        # message[1]=session token, message[2]=peer server port
+        # resume-invalid is sent to peer if the token is not valid anymore, the peer logs in again
+        username = self.tokens.verify(message[1]) if len(message) > 2 else None
+        if username is None:
+            self.reply(session, "resume-invalid")
+            return
+        # the token takes over a session that is still online, e.g. a connection that is lost
+        # before the heartbeat timer of the peer expired
+        previous = self.presence.remove(username)
+        if previous is not None:
+            self.timers.cancel(username)
+            if previous.session is not session:
+                previous.session.close()
+        if not self.presence.add(username, session.ip, message[2], session):
+            self.reply(session, "login-online")
+            return
+        session.username = username
+        self.reply(session, "resume-success")
+        self.startHeartbeat(session)
+
+    # the reply is kept encoded by the presence index
+    def handlePrint(self, session, message):
+        response = self.presence.print_payload()
+        commandLog.info("Send to %s:%s -> PRINT (%d online)", session.ip, session.port, len(self.presence))
+        session.send(protocol.TEXT, response)
+
+    def handlePrintChatrooms(self, session, message):
+        response_db = self.db.get_all_chatroom_names()
+        if "NO CHATROOMS HAVE BEEN CREATED YET" not in response_db:
+            self.reply(session, "List of chat rooms: " + ' '.join(response_db))
+        else:
+            self.reply(session, response_db)
+
+    def handleCreate(self, session, message):
+        response = self.db.save_chatroom(message[1])
+        if "created successfully" in response:
+            with self.roomsLock:
+                self.rooms += 1
+        self.reply(session, response)
+
+    def handleJoinRoom(self, session, message):
+        # message[1]=room_name, message[2]=username, message[3]=ip address
+        # message[4]=tcp port number, message[5]=udp port number
+        # message[6]=roster version the peer has, peers that send it receive ROSTER frames
+        exists, response_db = self.db.is_room_exits(message[1])
+        if not exists:
+            self.reply(session, response_db)
+            return
+        # legacy peers can not tell a roster frame apart without framing
+        if len(message) > 6 and not session.legacy:
+            self.joinVersionedRoom(session, message)
+            return
+        response = "MEMBER-JOINED" + " " + message[2] + " " + message[3] + " " + message[5]
+        members_list = self.db.get_chatroom_members(message[1])
+        if "not found" not in members_list:
+            # legacy peers receive the member list pickled as they always did
+            members_list_bytes = pickle.dumps(members_list) if session.legacy else encode_members(members_list)
+            # the other members of the room are informed about the new member
+            for member in members_list:
+                member_name = member["username"]
+                member_session = self.presence.session(member_name)
+                if member_session is None:
+                    console(f"Member '{member_name}' is not online.")
+                elif member_name != session.username:
+                    member_session.send(protocol.EVENT, response.encode(), message[2])
+            response_test = self.addMember(message)
+            console("DB response for joining :", response_test)
+            # the new member receives the list of members
+            session.send(protocol.MEMBERS, members_list_bytes)
+            roomLog.info("Send to %s:%s -> %s", session.ip, session.port, response)
+        else:
+            response_test = self.addMember(message)
+            console("DB response for joining :", response_test)
+            self.reply(session, "You are the first member to join the room ! ")
+
+    # the joining peer receives the changes since its roster version, or the whole roster in pages
+    # if it has no version or its version is too old, the other members are informed as before
+    # the member is added and the roster is read under the lock of the room, as in the legacy
+    # branch, so a peer that joins right after reads a roster with this member and informs it
+    def joinVersionedRoom(self, session, message):
+        room_name = message[1]
+        with self.roomLocks.for_key(room_name):
+            response_test = self.addMemberLocked(message)
+            version, frames = self.rosterFrames(room_name, message[6], message[2])
+        for frame in frames:
+            session.send(protocol.ROSTER, frame)
+        roomLog.info("Send to %s:%s -> ROSTER %s (%d frames)", session.ip, session.port, version, len(frames))
+        response = "MEMBER-JOINED" + " " + message[2] + " " + message[3] + " " + message[5]
+        for member in self.db.iter_chatroom_members(room_name):
+            member_session = self.presence.session(member["username"])
+            if member_session is not None and member_session is not session:
+                member_session.send(protocol.EVENT, response.encode(), message[2])
+        console("DB response for joining :", response_test)
+
+    # encoded ROSTER frames of a room for a peer that has the roster version known, the changes
+    # since it in one frame or the whole roster in pages; the joining member itself is left out
+    # called under the lock of the room so the version and the members agree
+    def rosterFrames(self, room_name, known, username):
+        changes = self.rosters.changes_since(room_name, known) if known != NO_VERSION else None
+        if changes is not None:
+            version, joined, left = changes
+            joined = [member for member in joined if member["username"] != username]
+            return version, [encode_roster(version, False, 0, True, joined, left)]
+        version = self.rosters.version(room_name)
+        frames, page, after = [], 0, None
+        while True:
+            members, after = self.db.get_chatroom_members_page(room_name, after, ROSTER_PAGE)
+            members = [member for member in members if member["username"] != username]
+            frames.append(encode_roster(version, True, page, after is None, members))
+            page += 1
+            if after is None:
+                return version, frames
+
+    # adds the peer of a JOIN-ROOM message to the room and records the new roster version
+    def addMember(self, message):
+        with self.roomLocks.for_key(message[1]):
+            return self.addMemberLocked(message)
+
+    def addMemberLocked(self, message):
+        response = self.db.add_member(message[1], message[2], message[3], message[4], message[5])
+        if "successfully" in response:
+            self.rosters.joined(message[1], member_record(message[2], message[3], message[4], message[5]))
+        return response
+
+    def handleLeave(self, session, message):
+        # message[1]=username, message[2]=room_name
+        response_peers = "Peer-LEFT" + " " + message[1] + " " + message[2]
+        # the roster is read page by page, only the usernames are needed
+        for member in self.db.iter_chatroom_members(message[2]):
+            member_session = self.presence.session(member["username"])
+            if member_session is not None and member_session is not session:
+                member_session.send(protocol.EVENT, response_peers.encode(), message[1])
+        self.reply(session, "YOU LEFT THE ROOM")
+        with self.roomLocks.for_key(message[2]):
+            self.db.leave_room(message[1], message[2])
+            self.rosters.left(message[2], message[1])
+
+    #   SEARCH  #
+    def handleSearch(self, session, message):
+        # checks if an account with the username exists
+        if self.db.is_account_exist(message[1]):
+            # checks if the account is online
+            # and sends the related response to peer
+            peer_info = self.presence.get(message[1])
+            if peer_info is not None:
+                self.reply(session, "search-success " + peer_info.ip + ":" + str(peer_info.tcpPort))
+            else:
+                self.reply(session, "search-user-not-online")
+        # enters if username does not exist
+        else:
+            self.reply(session, "search-user-not-found")
+
+    def handlePortnumber(self, session, message):
+        entry = self.presence.get(session.username)
+        if entry is not None and entry.udpPort is not None:
+            session.send(protocol.TEXT, str(entry.udpPort).encode())
+        else:
+            console(f"Udp port of '{session.username}' is not known yet")
+
+    # counters of the commands and gauges of the registry state as json
+    def handleStats(self, session, message):
+        self.reply(session, self.stats.summary())
+
+    # processes a hello message received from the udp port of the registry
+    # returns True if the peer is online and the hello message should be acknowledged
+    def handleHello(self, username, clientAddress):
+        return bool(self.handleHelloBatch([(username, clientAddress, False)]))
+
+    # processes the hello messages of a wakeup of the udp socket, see hello_ingest.HelloIngest
+    # hellos: (username, client address, extended) of each message
+    # returns (client address, acknowledgement) of the peers that are online
+    # an extended acknowledgement tells the peer its udp port and its heartbeat interval
+    # every hello message of the batch is recorded with the mean latency of the batch, the ones
+    # from peers that are not online as errors
+    def handleHelloBatch(self, hellos):
+        start = time.perf_counter_ns()
+        online = []
+        interval = self.heartbeatInterval()
+        for username, clientAddress, extended in hellos:
+            # checks if the account that this hello message is sent from is online
+            # and keeps the udp port of the peer, it is sent to the peer on PORTNUMBER
+            entry = self.presence.set_udp_port(username, clientAddress[1])
+            if entry is not None:
+                online.append((username, clientAddress, extended))
+                # the extended acknowledgement tells the peer the interval
+                if extended:
+                    entry.helloInterval = interval
+                # sampled, see log_pipeline.HELLO_SAMPLE
+                helloLog.info("Hello from %s at %s:%s", username, clientAddress[0], clientAddress[1])
+        # resets the timeouts of the peers since their hello messages are received
+        self.timers.reset_many([username for username, _, _ in online], self.heartbeatTimeout(interval))
+        if hellos:
+            self.stats.record("HELLO", (time.perf_counter_ns() - start) // len(hellos),
+                              len(hellos) - len(online), len(hellos))
+        return [(clientAddress, encode_hello_ack(clientAddress[1], interval) if extended else HELLO_ACK)
+                for _, clientAddress, extended in online]
+
+    # starts the heartbeat timer of a peer that logged in or resumed on the session
+    def startHeartbeat(self, session):
+        self.timers.start(session.username, self.helloFirstTimeout,
+                          lambda username: self.waitHelloMessage(username, session))
+
+    # called when no hello message is received from a peer in time
+    # the peer is logged out and the members of its chat room are informed
+    # a timer that fires while a RESUME takes over the peer only removes the session it was started for
+    def waitHelloMessage(self, username, session=None):
+        if username is None:
+            console("Error: username is not properly initialized.")
+            return
+        entry = self.presence.remove(username, session)
+        if entry is None:
+            return
+        member_inroom, room_name = self.db.is_member_inroom(username)
+        if room_name is not None:
+            console(f'Removed {username} from chatroom: {room_name}')
+            # Check if the chatroom exists before trying to get members
+            is_room_exists, room_status = self.db.is_room_exits(room_name)
+            if is_room_exists:
+                response = f'{username} left the room due to disconnection'
+                for member in self.db.iter_chatroom_members(room_name):
+                    member_session = self.presence.session(member["username"])
+                    if member_session is not None and member["username"] != username:
+                        member_session.send(protocol.EVENT, response.encode(), username)
+                with self.roomLocks.for_key(room_name):
+                    self.db.remove_member(username, room_name)
+                    self.rosters.left(room_name, username)
+            else:
+                console(f"Chatroom '{room_name}' does not exist.")
+        entry.session.close()
+        console("Removed " + username + " from online peers")
@@ -0,0 +1,254 @@
+'''
+    ##  Statistics of the registry
+    ##  Count, errors and a latency histogram of every command, and gauges of the registry state,
+    ##  answered on STATS and on a local http endpoint in the prometheus text format
+'''
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from log_pipeline import STATS
+
+# commands that are reported even before they are received
+COMMANDS = ("JOIN", "LOGIN", "SEARCH", "CREATE", "JOIN-ROOM", "LEAVE", "PRINT", "PRINT_CHATROOMS", "PORTNUMBER",
+            "HELLO")
+
+# latency histogram in microseconds with HDR style buckets: values below 2^PRECISION_BITS have a bucket
+# each, above that every power of two is split into 2^(PRECISION_BITS - 1) buckets, so a value is
+# off by at most 1/2^(PRECISION_BITS - 1) of itself (12.5%)
+PRECISION_BITS = 4
+HALF_BUCKETS = 1 << (PRECISION_BITS - 1)
+# up to 2^40 microseconds, longer latencies are counted in the last bucket
+BUCKETS = (40 - PRECISION_BITS + 2) * HALF_BUCKETS
+
+# local http endpoint of the prometheus text format, 0 turns it off
+STATS_PORT = 15700
+STATS_HOST = "127.0.0.1"
+
+statsLog = logging.getLogger(STATS)
+
+
+def bucket_index(micros):
+    if micros < (1 << PRECISION_BITS):
+        return micros
+    shift = micros.bit_length() - PRECISION_BITS
+    return min(BUCKETS - 1, shift * HALF_BUCKETS + (micros >> shift))
+
+
+# highest value in microseconds counted in a bucket
+def bucket_limit(index):
+    if index < (1 << PRECISION_BITS):
+        return index
+    shift = index // HALF_BUCKETS - 1
+    return ((index - shift * HALF_BUCKETS + 1) << shift) - 1
+
+
+# counters of a command recorded by a single thread, only that thread changes them
+class CommandCounts:
+    __slots__ = ("count", "errors", "totalNs", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.totalNs = 0
+        self.buckets = [0] * BUCKETS
+
+
+# counters of a thread: command -> CommandCounts, and the connections it opened and closed
+class ThreadCounts:
+    __slots__ = ("commands", "opened", "closed")
+
+    def __init__(self):
+        self.commands = {}
+        self.opened = 0
+        self.closed = 0
+
+
+# merged counters of a command
+class CommandStats:
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.totalNs = 0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, counts):
+        self.count += counts.count
+        self.errors += counts.errors
+        self.totalNs += counts.totalNs
+        self.buckets = [total + value for total, value in zip(self.buckets, counts.buckets)]
+
+    # latency in microseconds that the fraction of the commands did not exceed
+    def percentile(self, fraction):
+        if not self.count:
+            return 0
+        rank = max(1, round(fraction * self.count))
+        seen = 0
+        for index, value in enumerate(self.buckets):
+            seen += value
+            if seen >= rank:
+                return bucket_limit(index)
+        return bucket_limit(BUCKETS - 1)
+
+    def summary(self):
+        return {"count": self.count, "errors": self.errors,
+                "mean_us": round(self.totalNs / self.count / 1000, 1) if self.count else 0.0,
+                "p50_us": self.percentile(0.5), "p90_us": self.percentile(0.9), "p99_us": self.percentile(0.99),
+                "max_us": self.percentile(1.0)}
+
+
+# counters of the registry
+# every thread records into counters of its own without a lock, the counters of all the threads
+# are merged when they are read; a read that runs while a thread records may miss that record
+# a connection thread retires its counters into a shared aggregate before it ends, see retire_thread
+class RegistryStats:
+
+    def __init__(self, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.local = threading.local()
+        # counters of the threads that recorded and did not retire
+        self.threads = []
+        self.threadsLock = threading.Lock()
+        # counters of the retired threads: command -> CommandStats, and their connections
+        self.retired = {}
+        self.retiredConnections = 0
+        # name -> function returning the current value
+        self.gauges = {"threads": threading.active_count}
+        self.started = time.time()
+
+    def counts(self):
+        counts = getattr(self.local, "counts", None)
+        if counts is None:
+            counts = self.local.counts = ThreadCounts()
+            with self.threadsLock:
+                self.threads.append(counts)
+        return counts
+
+    # records a command that took elapsedNs, count commands of a batch can be recorded at once
+    # with the mean of their latency
+    def record(self, command, elapsedNs, errors=0, count=1):
+        commands = self.counts().commands
+        counts = commands.get(command)
+        if counts is None:
+            counts = commands[command] = CommandCounts()
+        counts.count += count
+        counts.errors += errors
+        counts.totalNs += elapsedNs * count
+        counts.buckets[bucket_index(elapsedNs // 1000)] += count
+
+    def connection_opened(self):
+        self.counts().opened += 1
+
+    def connection_closed(self):
+        self.counts().closed += 1
+
+    # folds the counters of the calling thread into the retired aggregate, called by a thread
+    # that is about to end so that a thread per connection does not keep counters forever
+    def retire_thread(self):
+        counts = getattr(self.local, "counts", None)
+        if counts is None:
+            return
+        del self.local.counts
+        with self.threadsLock:
+            self.threads.remove(counts)
+            for command, commandCounts in counts.commands.items():
+                self.retired.setdefault(command, CommandStats()).add(commandCounts)
+            self.retiredConnections += counts.opened - counts.closed
+
+    def add_gauge(self, name, function):
+        self.gauges[name] = function
+
+    # merged counters: command -> CommandStats
+    def commands(self):
+        merged = {command: CommandStats() for command in COMMANDS}
+        with self.threadsLock:
+            threads = list(self.threads)
+            for command, stats in self.retired.items():
+                merged.setdefault(command, CommandStats()).add(stats)
+        for counts in threads:
+            for command, commandCounts in list(counts.commands.items()):
+                merged.setdefault(command, CommandStats()).add(commandCounts)
+        return merged
+
+    def gauge_values(self):
+        with self.threadsLock:
+            threads = list(self.threads)
+            connections = self.retiredConnections
+        values = {"connections": connections + sum(counts.opened - counts.closed for counts in threads)}
+        for name, function in self.gauges.items():
+            try:
+                values[name] = function()
+            except Exception as e:
+                statsLog.error("Gauge %s failed: %s", name, e)
+        return values
+
+    # reply of STATS
+    def summary(self):
+        return json.dumps({"uptime_s": round(time.time() - self.started), "gauges": self.gauge_values(),
+                           "commands": {command: stats.summary() for command, stats in self.commands().items()}},
+                          separators=(",", ":"))
+
+    # prometheus text exposition format
+    def exposition(self):
+        lines = ["# HELP registry_commands_total Commands processed by the registry.",
+                 "# TYPE registry_commands_total counter"]
+        commands = self.commands()
+        for command, stats in commands.items():
+            lines.append('registry_commands_total{command="%s"} %d' % (command, stats.count))
+        lines += ["# HELP registry_command_errors_total Commands that failed.",
+                  "# TYPE registry_command_errors_total counter"]
+        for command, stats in commands.items():
+            lines.append('registry_command_errors_total{command="%s"} %d' % (command, stats.errors))
+        lines += ["# HELP registry_command_latency_seconds Latency of the commands.",
+                  "# TYPE registry_command_latency_seconds histogram"]
+        for command, stats in commands.items():
+            # only the buckets that counted a command are written, a bucket never becomes empty again
+            seen = 0
+            for index, value in enumerate(stats.buckets):
+                if value:
+                    seen += value
+                    lines.append('registry_command_latency_seconds_bucket{command="%s",le="%.6f"} %d'
+                                 % (command, (bucket_limit(index) + 1) / 1e6, seen))
+            lines.append('registry_command_latency_seconds_bucket{command="%s",le="+Inf"} %d' % (command, stats.count))
+            lines.append('registry_command_latency_seconds_sum{command="%s"} %.9f' % (command, stats.totalNs / 1e9))
+            lines.append('registry_command_latency_seconds_count{command="%s"} %d' % (command, stats.count))
+        for name, value in self.gauge_values().items():
+            lines.append("# TYPE registry_%s gauge" % name)
+            lines.append("registry_%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+
+# answers GET /metrics, only to clients on this host
+class StatsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.client_address[0] not in ("127.0.0.1", "::1"):
+            self.send_error(403)
+            return
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.stats.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # the requests are not written to stderr
+    def log_message(self, format, *args):
+        statsLog.debug("Stats endpoint: " + format, *args)
+
+
+# starts the http endpoint on a daemon thread, returns the server or None if the port is 0
+def serve_stats(stats, port=STATS_PORT, host=STATS_HOST):
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), StatsRequestHandler)
+    server.daemon_threads = True
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, daemon=True, name="stats-endpoint").start()
+    return server
@@ -0,0 +1,102 @@
+'''
+    ##  Overlay tree fan-out of the chat room messages
+    ##  Instead of sending a message to every member, the sender sends it to a few members
+    ##  and each of them forwards it to a few more, along a tree of bounded degree
+'''
+import bisect
+from collections import deque
+
+# fan-out modes of a room
+FANOUT_FLAT = "flat"
+FANOUT_TREE = "tree"
+
+# children of a member in the tree
+TREE_DEGREE = 4
+
+# datagrams forwarded along the tree start with this marker and carry their origin,
+# text typed by a user never starts with a NUL byte
+TREE_MARKER = b"\x00T"
+
+# forwarded messages that are remembered to drop the duplicates a changing roster can cause
+SEEN_MESSAGES = 1024
+
+
+def encode_tree_message(origin, sequence, text):
+    return TREE_MARKER + f"{origin} {sequence}\n".encode() + text.encode()
+
+
+# returns (origin, sequence, text) of a tree datagram, or None if it is a plain datagram
+def decode_tree_message(datagram):
+    if not datagram.startswith(TREE_MARKER):
+        return None
+    header, _, text = datagram[len(TREE_MARKER):].partition(b"\n")
+    try:
+        origin, sequence = header.decode().split()
+        return origin, int(sequence), text.decode()
+    except ValueError:
+        return None
+
+
+# fan-out tree of a room
+# the members, this peer included, are kept sorted by username so that every member builds the
+# same tree from the same roster, the tree of a message is rooted at its origin: a member at
+# distance p after the origin in the sorted ring forwards to the members at distances
+# p * degree + 1 ... p * degree + degree, so joins and leaves only insert or remove a name
+class OverlayTree:
+
+    def __init__(self, username, degree=TREE_DEGREE):
+        self.username = username
+        self.degree = degree
+        self.names = [username]
+        # username -> (ip address, udp port)
+        self.addresses = {}
+        self.seenSet = set()
+        self.seenOrder = deque()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, username):
+        return username in self.addresses or username == self.username
+
+    def add(self, username, address):
+        if username not in self:
+            bisect.insort(self.names, username)
+        if username != self.username:
+            self.addresses[username] = address
+
+    def remove(self, username):
+        if username == self.username or username not in self.addresses:
+            return
+        del self.addresses[username]
+        del self.names[bisect.bisect_left(self.names, username)]
+
+    # usernames a member forwards a message of the origin to
+    def children(self, origin, member=None):
+        count = len(self.names)
+        # an origin that already left the room keeps its place in the ring
+        originIndex = bisect.bisect_left(self.names, origin) % count
+        memberIndex = bisect.bisect_left(self.names, member if member is not None else self.username)
+        position = (memberIndex - originIndex) % count
+        first = position * self.degree + 1
+        last = min(first + self.degree, count)
+        return [self.names[(originIndex + distance) % count] for distance in range(first, last)]
+
+    # (username, address) of the members this peer sends a message of the origin to
+    def destinations(self, origin):
+        return [(name, self.addresses[name]) for name in self.children(origin) if name in self.addresses]
+
+    # addresses this peer sends a message of the origin to
+    def targets(self, origin):
+        return [address for _, address in self.destinations(origin)]
+
+    # True if the message is received for the first time
+    def first_seen(self, origin, sequence):
+        key = (origin, sequence)
+        if key in self.seenSet:
+            return False
+        self.seenSet.add(key)
+        self.seenOrder.append(key)
+        if len(self.seenOrder) > SEEN_MESSAGES:
+            self.seenSet.discard(self.seenOrder.popleft())
+        return True
@@ -0,0 +1,176 @@
+'''
+    ##  Binary encoding of the chat room rosters
+    ##  Replaces pickle on the framed registry to peer path, legacy "#...#" peers still receive
+    ##  the pickled member list
+'''
+import socket
+import struct
+import sys
+from array import array
+
+# a member list is stored column by column so that each column is encoded and decoded at once:
+#   member count (4 bytes),
+#   length of the usernames (4 bytes) and the usernames in utf-8 separated by "\n",
+#   address kind (1 byte): ADDRESS_IPV4 with 4 bytes for each member, or ADDRESS_TEXT with the
+#   length of the addresses (4 bytes) and the addresses in utf-8 separated by "\n",
+#   tcp port (2 bytes) of each member and udp port (2 bytes) of each member, 0 if not known
+# a roster frame is
+#   flags (1 byte): ROSTER_SNAPSHOT and ROSTER_LAST, page number (4 bytes),
+#   version length (1 byte), version in ascii, the members that joined as a member list,
+#   the count of the members that left (4 bytes), the length of their usernames (4 bytes) and their
+#   usernames separated by "\n"
+# usernames and addresses never contain whitespace since the commands are split on it,
+# all numbers are in network byte order
+COUNT = struct.Struct("!I")
+ROSTER_HEADER = struct.Struct("!BIB")
+IPV4 = struct.Struct("4B")
+
+ADDRESS_IPV4 = 4
+ADDRESS_TEXT = 0
+
+ROSTER_SNAPSHOT = 1
+ROSTER_LAST = 2
+
+SEPARATOR = "\n"
+# ports are kept in arrays of unsigned 16 bit numbers, swapped on little endian hosts
+SWAP_PORTS = sys.byteorder == "little"
+
+
+class CodecError(ValueError):
+    pass
+
+
+def port_number(port):
+    return int(port) if port not in (None, "", "None") else 0
+
+
+def encode_names(parts, names):
+    data = SEPARATOR.join(names).encode()
+    parts.append(COUNT.pack(len(data)))
+    parts.append(data)
+
+
+# only a dotted quad is packed, inet_aton would also take "127.1" or "1" and the decoded
+# roster would not hold the address that was stored
+def encode_ipv4(address):
+    try:
+        return socket.inet_pton(socket.AF_INET, address)
+    except (OSError, TypeError):
+        raise CodecError("not a dotted quad ipv4 address: " + repr(address))
+
+
+def encode_addresses(parts, addresses):
+    try:
+        packed = b"".join([encode_ipv4(address) for address in addresses])
+        parts.append(bytes([ADDRESS_IPV4]))
+        parts.append(packed)
+        return
+    except CodecError:
+        pass
+    # a host name, an ipv6 address or any other address is sent as it is
+    parts.append(bytes([ADDRESS_TEXT]))
+    encode_names(parts, addresses)
+
+
+def encode_ports(parts, ports):
+    column = array("H", ports)
+    if SWAP_PORTS:
+        column.byteswap()
+    parts.append(column.tobytes())
+
+
+# member records of the database, see db.member_record
+def encode_members_into(parts, members):
+    parts.append(COUNT.pack(len(members)))
+    encode_names(parts, [member["username"] for member in members])
+    encode_addresses(parts, [member["IP address"] for member in members])
+    encode_ports(parts, [port_number(member.get("TCP_Port_number")) for member in members])
+    encode_ports(parts, [port_number(member["UDP_Port_number"]) for member in members])
+
+
+def encode_members(members):
+    parts = []
+    encode_members_into(parts, members)
+    return b"".join(parts)
+
+
+def encode_roster(version, snapshot, page, last, members=(), left=()):
+    flags = (ROSTER_SNAPSHOT if snapshot else 0) | (ROSTER_LAST if last else 0)
+    versionData = version.encode()
+    parts = [ROSTER_HEADER.pack(flags, page, len(versionData)), versionData]
+    encode_members_into(parts, members)
+    parts.append(COUNT.pack(len(left)))
+    encode_names(parts, left)
+    return b"".join(parts)
+
+
+# the decoders read from a memoryview of the payload, a column is turned into strings or
+# numbers at once without copying it into bytes first
+def decode_names(view, offset, count):
+    (length,) = COUNT.unpack_from(view, offset)
+    offset += COUNT.size
+    if offset + length > len(view):
+        raise CodecError("names past the end of the payload")
+    names = str(view[offset:offset + length], "utf-8").split(SEPARATOR) if count else []
+    if len(names) != count:
+        raise CodecError("expected " + str(count) + " names, found " + str(len(names)))
+    return names, offset + length
+
+
+def decode_addresses(view, offset, count):
+    kind = view[offset]
+    offset += 1
+    if kind == ADDRESS_IPV4:
+        end = offset + 4 * count
+        if end > len(view):
+            raise CodecError("addresses past the end of the payload")
+        return ["%d.%d.%d.%d" % address for address in IPV4.iter_unpack(view[offset:end])], end
+    if kind == ADDRESS_TEXT:
+        return decode_names(view, offset, count)
+    raise CodecError("unknown address kind " + str(kind))
+
+
+def decode_ports(view, offset, count):
+    end = offset + 2 * count
+    if end > len(view):
+        raise CodecError("ports past the end of the payload")
+    column = array("H")
+    column.frombytes(view[offset:end])
+    if SWAP_PORTS:
+        column.byteswap()
+    return column, end
+
+
+# returns ([(username, ip address, tcp port, udp port)], offset after the list)
+def decode_members_from(view, offset):
+    (count,) = COUNT.unpack_from(view, offset)
+    offset += COUNT.size
+    usernames, offset = decode_names(view, offset, count)
+    addresses, offset = decode_addresses(view, offset, count)
+    tcpPorts, offset = decode_ports(view, offset, count)
+    udpPorts, offset = decode_ports(view, offset, count)
+    return list(zip(usernames, addresses, tcpPorts, udpPorts)), offset
+
+
+def decode_members(payload):
+    try:
+        with memoryview(payload) as view:
+            return decode_members_from(view, 0)[0]
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise CodecError("broken member list: " + str(e))
+
+
+# returns a dict with version, snapshot, page, last, members and left
+def decode_roster(payload):
+    try:
+        with memoryview(payload) as view:
+            flags, page, versionLength = ROSTER_HEADER.unpack_from(view, 0)
+            offset = ROSTER_HEADER.size
+            version = str(view[offset:offset + versionLength], "ascii")
+            members, offset = decode_members_from(view, offset + versionLength)
+            (count,) = COUNT.unpack_from(view, offset)
+            left, offset = decode_names(view, offset + COUNT.size, count)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise CodecError("broken roster: " + str(e))
+    return {"version": version, "snapshot": bool(flags & ROSTER_SNAPSHOT), "page": page,
+            "last": bool(flags & ROSTER_LAST), "members": members, "left": left}
@@ -0,0 +1,91 @@
+'''
+    ##  Versions of the chat room rosters
+    ##  Every join and leave of a room gets the next version of the room, a peer that joins the
+    ##  room again tells the version it already has and receives only the changes since then
+'''
+import secrets
+import threading
+from collections import deque
+
+from striped import STRIPES, ShardedMap
+
+# changes of a room that are kept, a peer with an older version receives the whole roster
+ROSTER_HISTORY = 256
+# members sent in a single frame of a whole roster
+ROSTER_PAGE = 500
+
+# roster versions are "<epoch>:<number>", the epoch is random for every run of the registry
+# so a version from an earlier run is never mistaken for one of this run
+NO_VERSION = "-"
+
+JOINED = "+"
+LEFT = "-"
+
+
+# changes of a room after a version, guarded by the lock of the room
+class RoomHistory:
+    __slots__ = ("version", "changes", "lock")
+
+    def __init__(self, limit):
+        self.version = 0
+        # (version, JOINED or LEFT, username, member record or None)
+        self.changes = deque(maxlen=limit)
+        self.lock = threading.Lock()
+
+
+class RosterVersions:
+
+    def __init__(self, historyLimit=ROSTER_HISTORY, shards=STRIPES):
+        self.historyLimit = historyLimit
+        self.epoch = secrets.token_hex(4)
+        # room name -> RoomHistory, changes of different rooms do not wait for each other
+        self.rooms = ShardedMap(shards)
+
+    def format(self, number):
+        return self.epoch + ":" + str(number)
+
+    # current version of the room
+    def version(self, room_name):
+        history = self.rooms.get(room_name)
+        return self.format(history.version if history is not None else 0)
+
+    # records a change of the room and returns the new version
+    def record(self, room_name, change, username, member=None):
+        history = self.rooms.get_or_create(room_name, lambda: RoomHistory(self.historyLimit))
+        with history.lock:
+            history.version += 1
+            history.changes.append((history.version, change, username, member))
+            return self.format(history.version)
+
+    def joined(self, room_name, member):
+        return self.record(room_name, JOINED, member["username"], member)
+
+    def left(self, room_name, username):
+        return self.record(room_name, LEFT, username)
+
+    # returns (version, joined member records, usernames that left) since the version,
+    # only the last change of a member is returned, None if the changes are not kept anymore
+    def changes_since(self, room_name, version):
+        epoch, _, number = version.partition(":")
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        number = int(number)
+        history = self.rooms.get(room_name)
+        if history is None:
+            return (self.format(0), [], []) if number == 0 else None
+        with history.lock:
+            current = history.version
+            if number > current:
+                return None
+            if number == current:
+                return self.format(current), [], []
+            # the change right after the version must still be kept
+            if not history.changes or history.changes[0][0] > number + 1:
+                return None
+            last = {}
+            for changeVersion, change, username, member in history.changes:
+                if changeVersion > number:
+                    last[username] = (change, member)
+        joined = [member for change, member in last.values() if change == JOINED]
+        left = [username for username, (change, _) in last.items() if change == LEFT]
+        return self.format(current), joined, left
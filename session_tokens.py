@@ -0,0 +1,68 @@
+'''
+    ##  Session tokens of the registry
+    ##  LOGIN gives the peer a signed token that expires, the peer sends it with RESUME on a new
+    ##  connection and is logged in again after an HMAC check instead of a bcrypt check
+'''
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+# seconds a token can be used to resume
+SESSION_TOKEN_TTL = 3600
+
+
+def encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+# issues and checks the tokens
+# a token is "<username:expiry:nonce>.<hmac-sha256 of it>" in base64, only the last token
+# issued to a user is accepted and LOGOUT revokes it, the secret is random for every run
+# of the registry so the peers log in again with their password after a restart
+class SessionTokens:
+
+    def __init__(self, secret=None, ttl=SESSION_TOKEN_TTL, clock=time.time):
+        self.secret = secret or os.urandom(32)
+        self.ttl = ttl
+        self.clock = clock
+        # username -> nonce of the last token issued to the user
+        self.nonces = {}
+        self.lock = threading.Lock()
+
+    def sign(self, body):
+        return hmac.new(self.secret, body, hashlib.sha256).digest()
+
+    def issue(self, username):
+        nonce = secrets.token_hex(8)
+        body = f"{username}:{int(self.clock() + self.ttl)}:{nonce}".encode()
+        with self.lock:
+            self.nonces[username] = nonce
+        return encode(body) + "." + encode(self.sign(body))
+
+    # returns the username of a valid token, or None
+    def verify(self, token):
+        try:
+            body, signature = token.split(".")
+            body, signature = decode(body), decode(signature)
+            if not hmac.compare_digest(signature, self.sign(body)):
+                return None
+            username, expiry, nonce = body.decode().rsplit(":", 2)
+            if int(expiry) < self.clock():
+                return None
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if self.nonces.get(username) != nonce:
+            return None
+        return username
+
+    def revoke(self, username):
+        with self.lock:
+            self.nonces.pop(username, None)
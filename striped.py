@@ -0,0 +1,84 @@
+'''
+    ##  Striped locks and sharded maps of the registry
+    ##  Shared state keyed by username or room name is split into shards, each with its own lock,
+    ##  so that peers with different usernames rarely wait for each other
+'''
+import threading
+
+# stripes of a map or a set of locks
+STRIPES = 16
+
+
+# locks picked by the hash of a key, e.g. a lock for each room without a lock object per room
+class StripedLocks:
+
+    def __init__(self, stripes=STRIPES):
+        self.locks = [threading.Lock() for _ in range(max(1, stripes))]
+
+    def __len__(self):
+        return len(self.locks)
+
+    def for_key(self, key):
+        return self.locks[hash(key) % len(self.locks)]
+
+
+# dict split into shards by the hash of the key
+# reads are single dict reads without a lock, changes lock only the shard of the key
+class ShardedMap:
+
+    def __init__(self, shards=STRIPES):
+        self.shards = [{} for _ in range(max(1, shards))]
+        self.locks = [threading.Lock() for _ in self.shards]
+
+    def index(self, key):
+        return hash(key) % len(self.shards)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def __contains__(self, key):
+        return key in self.shards[self.index(key)]
+
+    def __iter__(self):
+        for shard in self.shards:
+            yield from list(shard)
+
+    def get(self, key, default=None):
+        return self.shards[self.index(key)].get(key, default)
+
+    def values(self):
+        return [value for shard in self.shards for value in list(shard.values())]
+
+    # adds the value if the key is not in the map, returns False if it already is
+    def insert(self, key, value):
+        index = self.index(key)
+        with self.locks[index]:
+            shard = self.shards[index]
+            if key in shard:
+                return False
+            shard[key] = value
+            return True
+
+    # removes the key if the predicate accepts its value, returns the removed value or None
+    def pop_if(self, key, predicate=None):
+        index = self.index(key)
+        with self.locks[index]:
+            shard = self.shards[index]
+            value = shard.get(key)
+            if value is None or (predicate is not None and not predicate(value)):
+                return None
+            del shard[key]
+            return value
+
+    # returns the value of the key, created by the factory under the lock of the shard if it is missing
+    def get_or_create(self, key, factory):
+        value = self.get(key)
+        if value is not None:
+            return value
+        index = self.index(key)
+        with self.locks[index]:
+            shard = self.shards[index]
+            value = shard.get(key)
+            if value is None:
+                value = shard[key] = factory()
+            return value
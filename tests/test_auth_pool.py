@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+bcrypt = pytest.importorskip("bcrypt")
+
+import auth_pool
+from auth_pool import AuthBusy, AuthPool
+
+
+@pytest.fixture
+def pool():
+    pool = AuthPool(workers=1, queueLimit=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_verify_checks_the_password(pool):
+    hashed = bcrypt.hashpw(b"secret", bcrypt.gensalt(4)).decode()
+    assert pool.verify("secret", hashed)
+    assert not pool.verify("wrong", hashed)
+    assert pool.stats()["accepted"] == 2
+
+
+def test_full_pool_rejects_without_waiting(pool, monkeypatch):
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def slow_check(password, hashedPassword):
+        started.release()
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(auth_pool, "check_password", slow_check)
+    results = []
+    # one check on the worker and one waiting for it fill the pool
+    threads = [threading.Thread(target=lambda: results.append(pool.verify("secret", "hash"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert started.acquire(timeout=5)
+    deadline = time.monotonic() + 5
+    while pool.stats()["in_flight"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(AuthBusy):
+        pool.verify("secret", "hash")
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [True, True]
+    stats = pool.stats()
+    assert (stats["accepted"], stats["rejected"], stats["in_flight"]) == (2, 1, 0)
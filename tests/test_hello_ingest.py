@@ -0,0 +1,81 @@
+import select
+import socket
+
+import pytest
+
+from hello_ingest import HELLO_ACK, HelloIngest, encode_hello_ack, parse_hello, parse_hello_ack
+
+
+# online peers acknowledge with the extended acknowledgement if it was asked for
+class Service:
+
+    def __init__(self, online):
+        self.online = online
+        self.capture = None
+        self.batches = []
+
+    def handleHelloBatch(self, hellos):
+        self.batches.append(hellos)
+        return [(clientAddress, encode_hello_ack(clientAddress[1], 20) if extended else HELLO_ACK)
+                for username, clientAddress, extended in hellos if username in self.online]
+
+
+@pytest.mark.parametrize("datagram, hello", [
+    (b"HELLO alice", ("alice", False)),
+    (b"HELLO  alice\n", ("alice", False)),
+    (b"HELLO alice +", ("alice", True)),
+    (b"HELLO\talice\t+\r\n", ("alice", True)),
+    (b"HELLO alice x", ("alice", False)),
+    (b"HELLO ", None),
+    (b"HELLOalice", None),
+    (b"HELLO_ACK", None),
+    (b"HELLO \xff", None),
+])
+def test_parse_hello(datagram, hello):
+    assert parse_hello(datagram) == hello
+
+
+def test_parse_hello_ack():
+    assert parse_hello_ack(encode_hello_ack(50001, 60)) == (50001, 60)
+    assert parse_hello_ack(HELLO_ACK) == (None, None)
+    assert parse_hello_ack(b"HELLO_ACK x y") == (None, None)
+    assert parse_hello_ack(b"HELLO alice") is None
+
+
+def test_flush_hands_the_batch_to_the_service_and_acknowledges_online_peers():
+    service = Service({"alice", "bob"})
+    ingest = HelloIngest(service)
+    assert ingest.feed(b"HELLO alice +", ("10.0.0.1", 50001))
+    assert ingest.feed(b"HELLO bob", ("10.0.0.2", 50002))
+    assert ingest.feed(b"HELLO carol", ("10.0.0.3", 50003))
+    assert not ingest.feed(b"PING", ("10.0.0.4", 50004))
+    sent = []
+    ingest.flush(lambda datagram, address: sent.append((datagram, address)))
+    assert len(service.batches) == 1
+    assert sent == [(b"HELLO_ACK 50001 20", ("10.0.0.1", 50001)), (HELLO_ACK, ("10.0.0.2", 50002))]
+    stats = ingest.stats()
+    assert (stats["datagrams"], stats["ignored"], stats["acked"], stats["max_batch"]) == (3, 1, 2, 3)
+
+
+def test_drain_reads_every_waiting_datagram_in_one_batch():
+    registry = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        registry.bind(("127.0.0.1", 0))
+        peer.bind(("127.0.0.1", 0))
+        peer.settimeout(5)
+        for _ in range(5):
+            peer.sendto(b"HELLO alice +", registry.getsockname())
+        ingest = HelloIngest(Service({"alice"}), batchLimit=3)
+        registry.setblocking(False)
+        # datagrams on the loopback are in the socket buffer when sendto returns
+        assert select.select([registry], [], [], 5)[0]
+        ingest.drain(registry)
+        assert [len(batch) for batch in ingest.service.batches] == [3]
+        ingest.drain(registry)
+        assert [len(batch) for batch in ingest.service.batches] == [3, 2]
+        for _ in range(5):
+            assert peer.recv(1024) == encode_hello_ack(peer.getsockname()[1], 20)
+    finally:
+        registry.close()
+        peer.close()
@@ -0,0 +1,72 @@
+import socket
+
+import pytest
+
+from outbound import POLICY_COALESCE, POLICY_DISCONNECT, POLICY_DROP, OutboundQueue, OutboundWriter
+
+
+def test_replies_are_never_limited():
+    queue = OutboundQueue(limit=1)
+    assert queue.put(b"a", key="alice")
+    for _ in range(10):
+        assert queue.put(b"r")
+    assert queue.take() == b"a" + b"r" * 10
+    assert queue.take() == b""
+
+
+def test_drop_policy_drops_notifications_over_the_limit():
+    queue = OutboundQueue(limit=2, policy=POLICY_DROP)
+    assert queue.put(b"1", key="alice")
+    assert queue.put(b"2", limited=True)
+    assert not queue.put(b"3", key="bob")
+    assert queue.take() == b"12"
+    # the limit counts the waiting notifications only
+    assert queue.put(b"4", key="bob")
+    assert queue.stats()["dropped"] == 1
+
+
+def test_coalesce_policy_replaces_the_waiting_notification_about_the_same_member():
+    queue = OutboundQueue(limit=2, policy=POLICY_COALESCE)
+    queue.put(b"alice-joined ", key="alice")
+    queue.put(b"bob-joined ", key="bob")
+    assert queue.put(b"alice-left ", key="alice")
+    assert not queue.put(b"carol-joined ", key="carol")
+    assert queue.take() == b"alice-left bob-joined "
+    assert queue.stats()["coalesced"] == 1
+
+
+def test_disconnect_policy_closes_the_queue():
+    overflows = []
+    queue = OutboundQueue(limit=1, policy=POLICY_DISCONNECT, onOverflow=lambda: overflows.append(1))
+    queue.put(b"1", key="alice")
+    assert not queue.put(b"2", key="bob")
+    assert overflows == [1]
+    assert not queue.put(b"reply")
+    assert queue.wait() == b""
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        OutboundQueue(policy="block")
+
+
+def test_writer_writes_the_waiting_frames_and_closes_the_socket():
+    registry, peer = socket.socketpair()
+    try:
+        queue = OutboundQueue()
+        writer = OutboundWriter(queue, registry)
+        writer.start()
+        queue.put(b"login-success")
+        queue.put(b" MEMBER-JOINED bob", key="bob")
+        queue.close()
+        writer.join(5)
+        assert not writer.is_alive()
+        received = b""
+        while True:
+            data = peer.recv(1024)
+            if not data:
+                break
+            received += data
+        assert received == b"login-success MEMBER-JOINED bob"
+    finally:
+        peer.close()
@@ -0,0 +1,98 @@
+import threading
+
+from presence import PRINT_PREFIX, PresenceIndex
+
+
+def printed(presence):
+    payload = presence.print_payload()
+    assert payload.startswith(PRINT_PREFIX)
+    names = payload[len(PRINT_PREFIX):]
+    return names.decode().split(", ") if names else []
+
+
+# mirror of the online peers in the database
+class Mirror:
+
+    def __init__(self):
+        self.online = set()
+
+    def login(self, username, ip, port):
+        self.online.add(username)
+
+    def logout(self, username):
+        self.online.discard(username)
+
+
+def test_print_follows_logins_and_logouts():
+    mirror = Mirror()
+    presence = PresenceIndex(mirror)
+    assert printed(presence) == []
+    assert presence.add("alice", "10.0.0.1", "60001", None)
+    assert presence.add("bob", "10.0.0.2", "60002", None)
+    assert not presence.add("alice", "10.0.0.9", "60009", None)
+    assert printed(presence) == ["alice", "bob"]
+    assert presence.print_payload() is presence.print_payload()
+    presence.remove("alice")
+    assert printed(presence) == ["bob"]
+    assert mirror.online == {"bob"}
+
+
+def test_remove_of_another_session_keeps_the_peer():
+    presence = PresenceIndex()
+    session = object()
+    presence.add("alice", "10.0.0.1", "60001", session)
+    assert presence.remove("alice", object()) is None
+    assert presence.remove("alice", session).session is session
+    assert "alice" not in presence
+
+
+def test_udp_port_is_learned_once():
+    presence = PresenceIndex()
+    presence.add("alice", "10.0.0.1", "60001", None)
+    assert presence.set_udp_port("alice", 50001).udpPort == 50001
+    assert presence.set_udp_port("alice", 50002).udpPort == 50001
+    assert presence.set_udp_port("bob", 50003) is None
+
+
+def test_print_rebuilt_between_the_insert_and_the_append_lists_the_peer_once():
+    presence = PresenceIndex()
+    presence.add("alice", "10.0.0.1", "60001", None)
+    presence.remove("alice")
+    insert = presence.peers.insert
+
+    def insert_then_print(username, entry):
+        inserted = insert(username, entry)
+        presence.print_payload()
+        return inserted
+
+    presence.peers.insert = insert_then_print
+    presence.add("bob", "10.0.0.2", "60002", None)
+    assert printed(presence) == ["bob"]
+
+
+def test_concurrent_logins_and_rebuilds_list_every_peer_once():
+    presence = PresenceIndex()
+    stop = threading.Event()
+
+    def rebuild():
+        while not stop.is_set():
+            presence.add("leaving", "10.0.0.1", "60001", None)
+            presence.remove("leaving")
+            presence.print_payload()
+
+    def log_in(worker):
+        for index in range(2000):
+            presence.add("peer%d_%d" % (worker, index), "10.0.0.1", "60001", None)
+
+    rebuilder = threading.Thread(target=rebuild)
+    rebuilder.start()
+    workers = [threading.Thread(target=log_in, args=(worker,)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    stop.set()
+    rebuilder.join()
+    names = printed(presence)
+    assert len(names) == len(set(names)) == 8000
+    assert set(names) == set(presence.usernames())
@@ -0,0 +1,83 @@
+import socket
+
+import pytest
+
+import protocol
+
+
+def test_frames_split_across_reads_are_reassembled():
+    data = protocol.encode_command("LOGIN alice secret 60000") + protocol.encode_frame(protocol.TEXT, b"ok")
+    decoder = protocol.StreamDecoder(bufferSize=8)
+    messages = []
+    for index in range(len(data)):
+        decoder.feed(data[index:index + 1])
+        messages.extend(decoder)
+    assert messages == [protocol.Message(protocol.COMMAND, b"LOGIN alice secret 60000"),
+                        protocol.Message(protocol.TEXT, b"ok")]
+
+
+def test_several_frames_in_one_read():
+    decoder = protocol.StreamDecoder()
+    decoder.feed(b"".join(protocol.encode_command("PRINT") for _ in range(3)))
+    assert [message.fields() for message in decoder] == [["PRINT"]] * 3
+    assert decoder.next_message() is None
+
+
+def test_empty_frame():
+    decoder = protocol.StreamDecoder()
+    decoder.feed(protocol.encode_frame(protocol.EVENT, b""))
+    assert list(decoder) == [protocol.Message(protocol.EVENT, b"")]
+
+
+def test_legacy_commands_are_detected_from_the_first_byte():
+    decoder = protocol.StreamDecoder(legacy=None)
+    decoder.feed(b"#LOGIN alice secret 60000#")
+    decoder.feed(b"#PRI")
+    assert [message.fields() for message in decoder] == [["LOGIN", "alice", "secret", "60000"]]
+    assert decoder.legacy
+    decoder.feed(b"NT#")
+    assert [message.fields() for message in decoder] == [["PRINT"]]
+
+
+def test_framed_stream_is_detected_from_the_first_byte():
+    decoder = protocol.StreamDecoder(legacy=None)
+    decoder.feed(protocol.encode_command("PRINT #1"))
+    assert [message.text() for message in decoder] == ["PRINT #1"]
+    assert decoder.legacy is False
+
+
+def test_bytes_outside_of_legacy_commands_are_dropped():
+    decoder = protocol.StreamDecoder(legacy=True)
+    decoder.feed(b"noise#PRINT#noise")
+    assert [message.text() for message in decoder] == ["PRINT"]
+
+
+def test_frame_over_max_frame_size_is_rejected():
+    decoder = protocol.StreamDecoder()
+    decoder.feed(protocol.HEADER.pack(protocol.MAX_FRAME_SIZE + 1, protocol.COMMAND))
+    with pytest.raises(protocol.ProtocolError):
+        decoder.next_message()
+
+
+def test_frame_of_max_frame_size_waits_for_its_payload():
+    decoder = protocol.StreamDecoder()
+    decoder.feed(protocol.HEADER.pack(protocol.MAX_FRAME_SIZE, protocol.COMMAND) + b"x")
+    assert decoder.next_message() is None
+
+
+def test_legacy_reply_is_not_framed():
+    assert protocol.encode_reply(protocol.TEXT, b"login-success", legacy=True) == b"login-success"
+    assert protocol.encode_command("PRINT", legacy=True) == b"#PRINT#"
+
+
+def test_channel_skips_events_before_the_reply():
+    registry, peer = socket.socketpair()
+    try:
+        channel = protocol.RegistryChannel(peer)
+        registry.sendall(protocol.encode_frame(protocol.EVENT, b"MEMBER-JOINED bob 10.0.0.2 60002")
+                         + protocol.encode_frame(protocol.TEXT, b"search-user-not-online"))
+        assert channel.receive_reply() == protocol.Message(protocol.TEXT, b"search-user-not-online")
+        registry.close()
+        assert channel.receive_text() == ""
+    finally:
+        peer.close()
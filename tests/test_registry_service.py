@@ -0,0 +1,117 @@
+import pytest
+
+pytest.importorskip("bcrypt")
+
+import db
+import protocol
+from hello_ingest import parse_hello_ack
+from registry_service import HELLO_INTERVAL, HELLO_INTERVAL_MAX, RegistryService
+from timer_wheel import ExpiryScheduler
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Session:
+
+    def __init__(self, username, port):
+        self.ip = "127.0.0.1"
+        self.port = port
+        self.username = username
+        self.legacy = False
+        self.replies = []
+        self.closed = False
+
+    def send(self, kind, payload, key=None):
+        if kind == protocol.TEXT:
+            self.replies.append(payload.decode())
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def registry(clock):
+    # a single hello message per second, every online peer makes the interval a second longer
+    service = RegistryService(db.MemoryStorage(), ExpiryScheduler(clock=clock), helloRate=1)
+    yield service
+    service.auth.shutdown()
+
+
+def log_in(registry, username, port):
+    session = Session(username, port)
+    registry.presence.add(username, session.ip, str(port), session)
+    session.username = username
+    registry.startHeartbeat(session)
+    return session
+
+
+def expire(registry):
+    registry.timers.fire(registry.timers.collect())
+
+
+def test_command_keeps_the_interval_a_peer_was_told_after_the_population_shrinks(registry, clock):
+    alice = log_in(registry, "alice", 1)
+    others = [log_in(registry, "peer" + str(index), 2 + index) for index in range(HELLO_INTERVAL_MAX)]
+    [(_, ack)] = registry.handleHelloBatch([("alice", ("127.0.0.1", 50001), True)])
+    assert parse_hello_ack(ack) == (50001, HELLO_INTERVAL_MAX)
+    # the population shrinks, the current interval is the shortest again
+    for session in others:
+        registry.presence.remove(session.username, session)
+        registry.timers.cancel(session.username)
+    assert registry.heartbeatInterval() == HELLO_INTERVAL
+    clock.now = 10.0
+    registry.dispatch(alice, ["PRINT"])
+    # alice sends its next hello message HELLO_INTERVAL_MAX seconds after the command
+    clock.now = 10.0 + HELLO_INTERVAL_MAX - 1
+    expire(registry)
+    assert "alice" in registry.presence
+
+
+def test_command_uses_the_current_interval_when_it_grew(registry, clock):
+    alice = log_in(registry, "alice", 1)
+    registry.handleHelloBatch([("alice", ("127.0.0.1", 50001), True)])
+    assert registry.presence.get("alice").helloInterval == HELLO_INTERVAL
+    for index in range(HELLO_INTERVAL_MAX):
+        log_in(registry, "peer" + str(index), 2 + index)
+    assert registry.peerInterval("alice") == HELLO_INTERVAL_MAX
+
+
+def test_silent_peer_expires(registry, clock):
+    alice = log_in(registry, "alice", 1)
+    registry.dispatch(alice, ["PRINT"])
+    clock.now = registry.heartbeatTimeout() + 2
+    expire(registry)
+    assert "alice" not in registry.presence
+
+
+def test_timer_of_a_replaced_session_does_not_expire_the_resumed_one(registry, clock):
+    registry.db.register("alice", "unused")
+    old = log_in(registry, "alice", 1)
+    token = registry.tokens.issue("alice")
+    clock.now = registry.helloFirstTimeout + 2
+    # the timer fired and the expiry waits for its turn while the peer resumes
+    batch = registry.timers.collect()
+    new = Session(None, 2)
+    registry.dispatch(new, ["RESUME", token, "60002"])
+    assert new.replies == ["resume-success"]
+    registry.timers.fire(batch)
+    assert registry.presence.session("alice") is new
+
+
+def test_failing_handler_is_rejected(registry):
+    alice = log_in(registry, "alice", 1)
+    assert registry.dispatch(alice, ["JOIN-ROOM"])
+    assert alice.replies == ["command-error"]
+    assert registry.stats.commands()["JOIN-ROOM"].errors == 1
@@ -0,0 +1,75 @@
+import pytest
+
+from room_overlay import SEEN_MESSAGES, OverlayTree, decode_tree_message, encode_tree_message
+
+
+def room(size, degree=3, username="peer000"):
+    tree = OverlayTree(username, degree)
+    for index in range(size):
+        name = "peer%03d" % index
+        tree.add(name, ("10.0.0.1", 50000 + index))
+    return tree
+
+
+# members a message of the origin reaches when it is forwarded along the tree from the root
+def reached(tree, origin, root=None):
+    root = root if root is not None else origin
+    seen = {root}
+    waiting = [root]
+    while waiting:
+        member = waiting.pop()
+        for child in tree.children(origin, member):
+            assert child not in seen
+            seen.add(child)
+            waiting.append(child)
+    return seen
+
+
+@pytest.mark.parametrize("size", [1, 2, 4, 10, 50, 101])
+def test_every_member_receives_a_message_exactly_once(size):
+    tree = room(size)
+    for origin in tree.names:
+        assert reached(tree, origin) == set(tree.names)
+
+
+def test_children_are_bounded_by_the_degree():
+    tree = room(100, degree=4)
+    assert all(len(tree.children("peer042", member)) <= 4 for member in tree.names)
+
+
+def test_origin_that_left_keeps_its_place():
+    tree = room(20)
+    tree.remove("peer007")
+    assert "peer007" not in tree
+    # the member after the origin in the ring forwards its message as the origin did
+    assert tree.children("peer007", "peer008") == tree.children("peer007", "peer007")
+    assert reached(tree, "peer007", "peer008") == set(tree.names)
+
+
+def test_add_and_remove_keep_the_names_sorted():
+    tree = OverlayTree("m", 2)
+    for name in ("z", "a", "q", "a"):
+        tree.add(name, (name, 1))
+    assert tree.names == ["a", "m", "q", "z"]
+    tree.remove("q")
+    tree.remove("m")
+    tree.remove("nobody")
+    assert tree.names == ["a", "m", "z"]
+    assert len(tree) == 3
+    assert tree.targets("m") == [("z", 1), ("a", 1)]
+
+
+def test_tree_messages_round_trip():
+    datagram = encode_tree_message("alice", 7, "hello room")
+    assert decode_tree_message(datagram) == ("alice", 7, "hello room")
+    assert decode_tree_message(b"plain text") is None
+    assert decode_tree_message(b"\x00Tbroken\n") is None
+
+
+def test_duplicates_are_dropped_within_the_window():
+    tree = OverlayTree("alice")
+    assert tree.first_seen("bob", 1)
+    assert not tree.first_seen("bob", 1)
+    for sequence in range(2, SEEN_MESSAGES + 2):
+        tree.first_seen("bob", sequence)
+    assert tree.first_seen("bob", 1)
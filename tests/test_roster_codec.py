@@ -0,0 +1,51 @@
+import pytest
+
+from db import member_record
+from roster_codec import (CodecError, decode_members, decode_roster, encode_ipv4, encode_members,
+                          encode_roster)
+
+
+def members(*addresses):
+    return [member_record("user" + str(index), address, str(60000 + index), str(50000 + index))
+            for index, address in enumerate(addresses)]
+
+
+def test_members_round_trip():
+    records = members("10.0.0.1", "192.168.1.20")
+    assert decode_members(encode_members(records)) == [("user0", "10.0.0.1", 60000, 50000),
+                                                       ("user1", "192.168.1.20", 60001, 50001)]
+
+
+def test_unknown_ports_are_zero():
+    record = member_record("alice", "10.0.0.1", None, "None")
+    assert decode_members(encode_members([record])) == [("alice", "10.0.0.1", 0, 0)]
+
+
+def test_empty_member_list():
+    assert decode_members(encode_members([])) == []
+
+
+@pytest.mark.parametrize("address", ["127.1", "1", "01.2.3.4", "::1", "peer.example"])
+def test_addresses_that_are_not_dotted_quads_are_kept_as_they_are(address):
+    decoded = decode_members(encode_members(members("10.0.0.1", address)))
+    assert [member[1] for member in decoded] == ["10.0.0.1", address]
+
+
+@pytest.mark.parametrize("address", ["127.1", "1", "256.0.0.1", "1.2.3.4 "])
+def test_ipv4_column_takes_only_dotted_quads(address):
+    with pytest.raises(CodecError, match="dotted quad"):
+        encode_ipv4(address)
+
+
+def test_roster_round_trip():
+    payload = encode_roster("ab12:7", False, 3, True, members("10.0.0.1"), ["bob", "carol"])
+    assert decode_roster(payload) == {"version": "ab12:7", "snapshot": False, "page": 3, "last": True,
+                                      "members": [("user0", "10.0.0.1", 60000, 50000)],
+                                      "left": ["bob", "carol"]}
+
+
+def test_truncated_payload_is_rejected():
+    payload = encode_roster("ab12:7", True, 0, True, members("10.0.0.1", "10.0.0.2"))
+    for length in (0, 5, len(payload) // 2, len(payload) - 1):
+        with pytest.raises(CodecError):
+            decode_roster(payload[:length])
@@ -0,0 +1,44 @@
+from db import member_record
+from roster_versions import NO_VERSION, RosterVersions
+
+
+def member(username):
+    return member_record(username, "10.0.0.1", "60001", "50001")
+
+
+def test_changes_since_a_version_keep_the_last_change_of_each_member():
+    rosters = RosterVersions()
+    first = rosters.joined("lobby", member("alice"))
+    rosters.joined("lobby", member("bob"))
+    rosters.left("lobby", "alice")
+    rosters.joined("lobby", member("carol"))
+    version, joined, left = rosters.changes_since("lobby", first)
+    assert version == rosters.version("lobby")
+    assert [record["username"] for record in joined] == ["bob", "carol"]
+    assert left == ["alice"]
+
+
+def test_current_version_has_no_changes():
+    rosters = RosterVersions()
+    version = rosters.joined("lobby", member("alice"))
+    assert rosters.changes_since("lobby", version) == (version, [], [])
+    assert rosters.changes_since("empty", rosters.version("empty")) == (rosters.version("empty"), [], [])
+
+
+def test_versions_of_rooms_are_independent():
+    rosters = RosterVersions()
+    rosters.joined("lobby", member("alice"))
+    assert rosters.joined("games", member("bob")) == rosters.version("games")
+    assert rosters.version("lobby") == rosters.version("games")
+    assert rosters.changes_since("games", rosters.version("lobby"))[1:] == ([], [])
+
+
+def test_unknown_or_forgotten_versions_need_the_whole_roster():
+    rosters = RosterVersions(historyLimit=2)
+    first = rosters.joined("lobby", member("alice"))
+    for username in ("bob", "carol", "dave"):
+        rosters.joined("lobby", member(username))
+    assert rosters.changes_since("lobby", first) is None
+    assert rosters.changes_since("lobby", NO_VERSION) is None
+    assert rosters.changes_since("lobby", RosterVersions().version("lobby")) is None
+    assert rosters.changes_since("lobby", rosters.format(99)) is None
@@ -0,0 +1,48 @@
+from session_tokens import SessionTokens
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_issued_token_resumes_its_user():
+    tokens = SessionTokens()
+    assert tokens.verify(tokens.issue("alice")) == "alice"
+    assert tokens.verify(tokens.issue("user:with:colons")) == "user:with:colons"
+
+
+def test_token_expires():
+    clock = Clock()
+    tokens = SessionTokens(ttl=60, clock=clock)
+    token = tokens.issue("alice")
+    clock.now += 60
+    assert tokens.verify(token) == "alice"
+    clock.now += 1
+    assert tokens.verify(token) is None
+
+
+def test_only_the_last_token_of_a_user_is_accepted():
+    tokens = SessionTokens()
+    first = tokens.issue("alice")
+    second = tokens.issue("alice")
+    assert tokens.verify(first) is None
+    assert tokens.verify(second) == "alice"
+    tokens.revoke("alice")
+    assert tokens.verify(second) is None
+
+
+def test_tampered_or_foreign_tokens_are_rejected():
+    tokens = SessionTokens()
+    token = tokens.issue("alice")
+    body, signature = token.split(".")
+    other = tokens.issue("mallory").split(".")[0]
+    assert tokens.verify(other + "." + signature) is None
+    assert tokens.verify(body + "." + signature[:-2]) is None
+    assert tokens.verify(SessionTokens().issue("alice")) is None
+    for broken in ("", ".", "not-a-token", body, "%%%." + signature):
+        assert tokens.verify(broken) is None
@@ -0,0 +1,60 @@
+import threading
+
+from striped import ShardedMap, StripedLocks
+
+
+def test_same_key_gets_the_same_lock():
+    locks = StripedLocks(4)
+    assert len(locks) == 4
+    assert locks.for_key("lobby") is locks.for_key("lobby")
+    assert len({id(locks.for_key("room" + str(index))) for index in range(100)}) == 4
+
+
+def test_insert_keeps_the_first_value():
+    peers = ShardedMap(4)
+    assert peers.insert("alice", 1)
+    assert not peers.insert("alice", 2)
+    assert peers.get("alice") == 1
+    assert "alice" in peers and "bob" not in peers
+    assert len(peers) == 1
+
+
+def test_pop_if_removes_only_accepted_values():
+    peers = ShardedMap(4)
+    peers.insert("alice", 1)
+    assert peers.pop_if("alice", lambda value: value == 2) is None
+    assert peers.pop_if("alice", lambda value: value == 1) == 1
+    assert peers.pop_if("alice") is None
+    assert len(peers) == 0
+
+
+def test_concurrent_inserts_keep_one_value_per_key():
+    peers = ShardedMap(4)
+    winners = []
+
+    def insert(worker):
+        for index in range(1000):
+            if peers.insert(index, worker):
+                winners.append(index)
+
+    threads = [threading.Thread(target=insert, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(winners) == list(range(1000))
+    assert sorted(peers) == list(range(1000))
+    assert len(peers.values()) == 1000
+
+
+def test_get_or_create_calls_the_factory_once():
+    rooms = ShardedMap(4)
+    created = []
+
+    def factory():
+        created.append(1)
+        return object()
+
+    first = rooms.get_or_create("lobby", factory)
+    assert rooms.get_or_create("lobby", factory) is first
+    assert len(created) == 1
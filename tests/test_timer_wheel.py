@@ -0,0 +1,79 @@
+import logging
+
+from log_pipeline import STATS
+from timer_wheel import ExpiryScheduler, TimerWheel
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timer_never_fires_before_its_delay():
+    wheel = TimerWheel(tick=1.0)
+    wheel.schedule("alice", 3, 0.0)
+    assert wheel.advance(3.0) == []
+    assert wheel.advance(4.0) == ["alice"]
+    assert "alice" not in wheel
+
+
+def test_timers_beyond_the_first_level_cascade_down():
+    wheel = TimerWheel(tick=1.0, slotsPerLevel=4, levels=3)
+    delays = {"a": 2, "b": 5, "c": 17, "d": 40, "e": 100}
+    for key, delay in delays.items():
+        wheel.schedule(key, delay, 0.0)
+    fired = {}
+    for second in range(1, 110):
+        for key in wheel.advance(float(second)):
+            fired[key] = second
+    assert fired == {key: delay + 1 for key, delay in delays.items()}
+    assert len(wheel) == 0
+
+
+def test_reschedule_and_cancel():
+    wheel = TimerWheel(tick=1.0)
+    wheel.schedule("alice", 2, 0.0)
+    wheel.schedule("bob", 2, 0.0)
+    wheel.schedule("alice", 10, 1.0)
+    assert wheel.cancel("bob")
+    assert not wheel.cancel("bob")
+    assert wheel.advance(5.0) == []
+    assert wheel.advance(12.0) == ["alice"]
+
+
+def test_scheduler_resets_and_expires_with_callbacks():
+    clock = Clock()
+    scheduler = ExpiryScheduler(clock=clock, shards=4)
+    expired = []
+    for username in ("alice", "bob", "carol"):
+        scheduler.start(username, 10, expired.append)
+    clock.now = 8.0
+    scheduler.reset("alice", 10)
+    scheduler.reset_many(["bob", "nobody"], 10)
+    scheduler.cancel("carol")
+    clock.now = 12.0
+    scheduler.fire(scheduler.collect())
+    assert expired == []
+    clock.now = 20.0
+    scheduler.fire(scheduler.collect())
+    assert sorted(expired) == ["alice", "bob"]
+    stats = scheduler.stats()
+    assert (stats["started"], stats["resets"], stats["cancelled"], stats["expirations"], stats["pending"]) == \
+        (3, 2, 1, 2, 0)
+
+
+def test_failing_callback_is_logged_with_its_traceback(caplog):
+    def fail(username):
+        raise KeyError(username)
+
+    expired = []
+    with caplog.at_level(logging.ERROR, logger=STATS):
+        ExpiryScheduler.fire([("alice", fail), ("bob", expired.append)])
+    assert expired == ["bob"]
+    [record] = caplog.records
+    assert record.name == STATS
+    assert record.exc_info is not None
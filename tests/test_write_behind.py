@@ -0,0 +1,76 @@
+import db
+from write_behind import WriteBehindQueue, WriteBehindStorage
+
+
+# storage that only records the batches it is given
+class RecordingStorage:
+
+    def __init__(self):
+        self.batches = []
+
+    def apply_batch(self, writes):
+        self.batches.append(list(writes))
+
+
+class FailingStorage:
+
+    def apply_batch(self, writes):
+        raise OSError("database is down")
+
+
+def queue_of(storage):
+    # the background thread never flushes on its own during a test
+    return WriteBehindQueue(storage, flushSize=10 ** 6, flushInterval=3600)
+
+
+def test_last_write_of_a_user_replaces_the_earlier_ones():
+    storage = RecordingStorage()
+    queue = queue_of(storage)
+    queue.logout("alice")
+    queue.login("alice", "10.0.0.1", "60001")
+    queue.login("bob", "10.0.0.2", "60002")
+    assert queue.flush() == 2
+    assert sorted(storage.batches[0]) == [("user_login", ("alice", "10.0.0.1", "60001")),
+                                          ("user_login", ("bob", "10.0.0.2", "60002"))]
+    stats = queue.stats()
+    assert (stats["enqueued"], stats["coalesced"], stats["flushed"], stats["depth"]) == (3, 1, 2, 0)
+
+
+def test_login_and_logout_in_one_window_write_nothing():
+    storage = RecordingStorage()
+    queue = queue_of(storage)
+    queue.login("alice", "10.0.0.1", "60001")
+    queue.logout("alice")
+    assert len(queue) == 0
+    assert queue.flush() == 0
+    assert storage.batches == []
+    assert queue.stats()["cancelled"] == 1
+
+
+def test_failed_flush_is_counted():
+    queue = queue_of(FailingStorage())
+    queue.login("alice", "10.0.0.1", "60001")
+    assert queue.flush() == 1
+    assert queue.stats()["failed"] == 1
+    assert len(queue) == 0
+
+
+def test_queued_room_removal_is_read_back():
+    memory = db.MemoryStorage()
+    memory.save_chatroom("lobby")
+    memory.add_member("lobby", "alice", "10.0.0.1", "60001", "50001")
+    memory.add_member("lobby", "bob", "10.0.0.2", "60002", "50002")
+    queue = queue_of(memory)
+    storage = WriteBehindStorage(memory, queue)
+    storage.leave_room("alice", "lobby")
+    # the removal is not in the storage yet but the registry reads its own write
+    assert memory.is_member_inroom("alice") == (True, "lobby")
+    assert storage.is_member_inroom("alice") == (False, None)
+    assert [member["username"] for member in storage.get_chatroom_members("lobby")] == ["bob"]
+    assert [member["username"] for member in storage.iter_chatroom_members("lobby")] == ["bob"]
+    members, cursor = storage.get_chatroom_members_page("lobby", limit=1)
+    assert ([member["username"] for member in members], cursor) == (["bob"], None)
+    # rejoining waits for the removal to be written
+    storage.add_member("lobby", "alice", "10.0.0.1", "60001", "50001")
+    assert len(queue) == 0
+    assert storage.is_member_inroom("alice") == (True, "lobby")
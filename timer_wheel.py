@@ -0,0 +1,240 @@
+'''
+    ##  Heartbeat expiry of the registry
+    ##  A hierarchical timer wheel keeps the deadline of every online peer, one thread or task
+    ##  advances it and fires the expired peers in batches
+'''
+import asyncio
+import logging
+import threading
+import time
+
+from log_pipeline import STATS
+from striped import STRIPES
+
+statsLog = logging.getLogger(STATS)
+
+
+# hierarchical timer wheel
+# level 0 has a slot for each tick, a slot of level n covers slotsPerLevel^n ticks,
+# a timer is kept in the lowest level that can tell its deadline apart from the current tick
+# and moves down a level whenever the wheel below it completes a turn
+# the wheel is not thread safe, ExpiryScheduler guards each of its wheels with a lock
+class TimerWheel:
+
+    def __init__(self, tick=1.0, slotsPerLevel=64, levels=4, now=0.0):
+        self.tick = tick
+        self.slotsPerLevel = slotsPerLevel
+        self.levels = levels
+        self.origin = now
+        # last tick that is processed
+        self.currentTick = 0
+        self.wheels = [[set() for _ in range(slotsPerLevel)] for _ in range(levels)]
+        # key -> (deadline tick, level, slot)
+        self.entries = {}
+        # number of ticks a level covers, the last level keeps everything beyond it
+        self.spans = [slotsPerLevel ** level for level in range(levels + 1)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def ticks(self, now):
+        return int((now - self.origin) / self.tick)
+
+    # schedules or reschedules a key, both in O(1)
+    def schedule(self, key, delay, now):
+        self.cancel(key)
+        # a timer never fires before its delay has passed
+        deadline = max(self.ticks(now + delay) + 1, self.currentTick + 1)
+        self.place(key, deadline)
+
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.wheels[entry[1]][entry[2]].discard(key)
+        return entry is not None
+
+    def place(self, key, deadline):
+        # deadlines beyond the range of the wheel wait in the last level and are placed again
+        # when they come around
+        reachable = min(deadline, self.currentTick + self.spans[self.levels] - 1)
+        for level in range(self.levels):
+            # the deadline falls in the current turn of the next level
+            if reachable // self.spans[level + 1] == self.currentTick // self.spans[level + 1]:
+                break
+        slot = (reachable // self.spans[level]) % self.slotsPerLevel
+        self.wheels[level][slot].add(key)
+        self.entries[key] = (deadline, level, slot)
+
+    # moves the timers of a slot to the lower levels
+    def cascade(self, level):
+        slot = (self.currentTick // self.spans[level]) % self.slotsPerLevel
+        keys = self.wheels[level][slot]
+        self.wheels[level][slot] = set()
+        for key in keys:
+            deadline = self.entries.pop(key)[0]
+            self.place(key, deadline)
+
+    # processes every tick up to now and returns the keys whose deadline has passed
+    def advance(self, now):
+        expired = []
+        target = self.ticks(now)
+        while self.currentTick < target:
+            self.currentTick += 1
+            for level in range(self.levels - 1, 0, -1):
+                if self.currentTick % self.spans[level] == 0:
+                    self.cascade(level)
+            slot = self.currentTick % self.slotsPerLevel
+            keys = self.wheels[0][slot]
+            if keys:
+                self.wheels[0][slot] = set()
+                for key in keys:
+                    deadline = self.entries.pop(key)[0]
+                    if deadline > self.currentTick:
+                        self.place(key, deadline)
+                    else:
+                        expired.append(key)
+        return expired
+
+
+# timer wheel of a part of the peers with its own lock and counters
+class TimerShard:
+
+    def __init__(self, tick, now):
+        self.wheel = TimerWheel(tick, now=now)
+        self.callbacks = {}
+        self.lock = threading.Lock()
+        self.started = 0
+        self.resets = 0
+        self.cancelled = 0
+        self.expirations = 0
+        self.batches = 0
+
+
+# single expiry scheduler for the heartbeat timers of all online peers
+# provides start, reset and cancel for the registry service and counts what it does
+# the peers are split into shards by the hash of their username so that hello messages
+# of different peers rarely wait for the same lock
+class ExpiryScheduler:
+
+    def __init__(self, tick=1.0, reportInterval=60, clock=time.monotonic, shards=STRIPES):
+        self.tick = tick
+        self.clock = clock
+        self.shards = [TimerShard(tick, clock()) for _ in range(max(1, shards))]
+        # the reset rate is measured between two calls of stats()
+        self.rateLock = threading.Lock()
+        self.rateTime = clock()
+        self.rateResets = 0
+        self.reportInterval = reportInterval
+        self.lastReport = clock()
+
+    def shard(self, username):
+        return self.shards[hash(username) % len(self.shards)]
+
+    # starts the timer of a peer that has just logged in
+    def start(self, username, timeout, callback):
+        shard = self.shard(username)
+        with shard.lock:
+            shard.wheel.schedule(username, timeout, self.clock())
+            shard.callbacks[username] = callback
+            shard.started += 1
+
+    # resets the timer of a peer since a hello message is received from it
+    def reset(self, username, timeout):
+        shard = self.shard(username)
+        with shard.lock:
+            if username in shard.wheel:
+                shard.wheel.schedule(username, timeout, self.clock())
+                shard.resets += 1
+
+    # resets the timers of the peers of a batch of hello messages, each shard is locked once
+    def reset_many(self, usernames, timeout):
+        if len(self.shards) == 1:
+            byShard = {0: usernames}
+        else:
+            byShard = {}
+            for username in usernames:
+                byShard.setdefault(hash(username) % len(self.shards), []).append(username)
+        now = self.clock()
+        for index, names in byShard.items():
+            shard = self.shards[index]
+            with shard.lock:
+                for username in names:
+                    if username in shard.wheel:
+                        shard.wheel.schedule(username, timeout, now)
+                        shard.resets += 1
+
+    # cancels the timer of a peer that logged out
+    def cancel(self, username):
+        shard = self.shard(username)
+        with shard.lock:
+            if shard.wheel.cancel(username):
+                shard.cancelled += 1
+            shard.callbacks.pop(username, None)
+
+    # advances the wheels to the current time and returns the expired peers with their callbacks
+    def collect(self):
+        batch = []
+        now = self.clock()
+        for shard in self.shards:
+            with shard.lock:
+                expired = shard.wheel.advance(now)
+                if expired:
+                    batch.extend((username, shard.callbacks.pop(username)) for username in expired)
+                    shard.expirations += len(expired)
+                    shard.batches += 1
+        return batch
+
+    @staticmethod
+    def fire(batch):
+        for username, callback in batch:
+            try:
+                callback(username)
+            except Exception:
+                statsLog.error("Error expiring %s", username, exc_info=True)
+
+    def stats(self):
+        totals = {"pending": 0, "started": 0, "resets": 0, "cancelled": 0, "expirations": 0, "expiry_batches": 0}
+        for shard in self.shards:
+            with shard.lock:
+                totals["pending"] += len(shard.wheel)
+                totals["started"] += shard.started
+                totals["resets"] += shard.resets
+                totals["cancelled"] += shard.cancelled
+                totals["expirations"] += shard.expirations
+                totals["expiry_batches"] += shard.batches
+        with self.rateLock:
+            now = self.clock()
+            elapsed = now - self.rateTime
+            totals["resets_per_second"] = (totals["resets"] - self.rateResets) / elapsed if elapsed > 0 else 0.0
+            self.rateTime, self.rateResets = now, totals["resets"]
+        return totals
+
+    def report(self):
+        if self.clock() - self.lastReport >= self.reportInterval:
+            self.lastReport = self.clock()
+            statsLog.info("Heartbeat timers: %s", self.stats())
+
+    # threaded registry: a single daemon thread advances the wheel and fires the expired peers
+    def run_thread(self):
+        def loop():
+            while True:
+                time.sleep(self.tick)
+                self.fire(self.collect())
+                self.report()
+        thread = threading.Thread(target=loop, name="expiry-scheduler", daemon=True)
+        thread.start()
+        return thread
+
+    # asyncio registry: a task advances the wheel, expired peers are logged out on the worker pool
+    # since that calls the database
+    async def run_async(self, executor=None):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.tick)
+            batch = self.collect()
+            if batch:
+                loop.run_in_executor(executor, self.fire, batch)
+            self.report()
@@ -0,0 +1,207 @@
+'''
+    ##  Traffic capture of the registry
+    ##  Every command frame received over tcp and every udp hello message is written to a compact
+    ##  binary log with the time it arrived, the connection or address it came from and how long
+    ##  the registry took for it; usernames, passwords, password hashes and session tokens are
+    ##  replaced when they are captured, see Performance_Test/Traffic_Replay.py
+'''
+import hashlib
+import hmac
+import logging
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from log_pipeline import CONNECTION, STATS
+
+# file header: magic and the wall clock time the capture started
+MAGIC = b"P2PCAP\x00\x01"
+FILE_HEADER = struct.Struct("!8sd")
+# record header: kind, microseconds since the capture started, source, microseconds the registry
+# took for the record, payload length
+RECORD = struct.Struct("!BQIIH")
+
+# record kinds
+# a tcp connection was opened, payload "tcp <ip>:<port>", or a udp address sent its first hello
+# message, payload "udp <ip>:<port>"
+OPEN = 1
+# command received on the connection of the source, payload is the redacted command text
+COMMAND = 2
+# the connection of the source was closed, no payload
+CLOSE = 3
+# hello message received from the udp address of the source, payload is the redacted datagram
+HELLO = 4
+
+# captured records that may wait for the writer before new ones are dropped (bytes)
+CAPTURE_BUFFER = 16 * 1024 * 1024
+CAPTURE_FLUSH_INTERVAL = 0.5
+
+# replacements of the secrets, the replay puts a password hash of its own in place of HASH
+PASSWORD = "redacted"
+HASH = "-"
+TOKEN = "-"
+# field -> what it holds, for the commands that carry a username or a secret
+USERNAME_FIELD = "username"
+SENSITIVE_FIELDS = {
+    "JOIN": {1: USERNAME_FIELD, 2: HASH},
+    "LOGIN": {1: USERNAME_FIELD, 2: PASSWORD},
+    "LOGOUT": {1: USERNAME_FIELD},
+    "RESUME": {1: TOKEN},
+    "JOIN-ROOM": {2: USERNAME_FIELD},
+    "LEAVE": {1: USERNAME_FIELD},
+    "SEARCH": {1: USERNAME_FIELD},
+}
+# commands that are captured as they are, any other command is captured without its arguments
+PLAIN_COMMANDS = {"PRINT", "PRINT_CHATROOMS", "CREATE", "PORTNUMBER", "STATS"}
+
+Record = namedtuple("Record", ["kind", "time", "source", "elapsed", "payload"])
+
+connectionLog = logging.getLogger(CONNECTION)
+statsLog = logging.getLogger(STATS)
+
+
+# capture file that is written by a background thread
+# record() only appends to a buffer under a lock, the writer swaps it every flush interval
+class TrafficCapture:
+
+    def __init__(self, path, bufferLimit=CAPTURE_BUFFER, flushInterval=CAPTURE_FLUSH_INTERVAL,
+                 clock=time.monotonic_ns):
+        self.path = path
+        self.bufferLimit = bufferLimit
+        self.flushInterval = flushInterval
+        self.clock = clock
+        self.started = clock()
+        # usernames are replaced by a keyed hash, the same user has the same pseudonym in the
+        # whole capture but the key is never written so the names can not be guessed back
+        self.key = os.urandom(32)
+        self.output = open(path, "wb")
+        self.output.write(FILE_HEADER.pack(MAGIC, time.time()))
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+        self.sources = 0
+        # udp address -> source
+        self.udpSources = {}
+        # metrics
+        self.records = 0
+        self.dropped = 0
+        self.written = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="traffic-capture", daemon=True)
+        self.thread.start()
+
+    def pseudonym(self, username):
+        return "u" + hmac.new(self.key, username.encode(), hashlib.sha256).hexdigest()[:12]
+
+    # command text with the usernames and secrets replaced
+    def redact(self, message):
+        command = message[0]
+        fields = SENSITIVE_FIELDS.get(command)
+        if fields is None:
+            return command if command not in PLAIN_COMMANDS else " ".join(message)
+        redacted = list(message)
+        for index, kind in fields.items():
+            if index < len(redacted):
+                redacted[index] = self.pseudonym(redacted[index]) if kind == USERNAME_FIELD else kind
+        return " ".join(redacted)
+
+    def record(self, kind, source, startedNs, payload=b"", elapsedNs=0):
+        header = RECORD.pack(kind, max(0, startedNs - self.started) // 1000, source,
+                             min(0xFFFFFFFF, elapsedNs // 1000), len(payload))
+        with self.lock:
+            if len(self.buffer) >= self.bufferLimit:
+                self.dropped += 1
+                return
+            self.buffer += header
+            self.buffer += payload
+            self.records += 1
+
+    def new_source(self):
+        with self.lock:
+            self.sources += 1
+            return self.sources
+
+    # returns the source of the connection
+    def connection_opened(self, ip, port):
+        source = self.new_source()
+        self.record(OPEN, source, self.clock(), ("tcp %s:%s" % (ip, port)).encode())
+        return source
+
+    def connection_closed(self, source):
+        self.record(CLOSE, source, self.clock())
+
+    # message: fields of the command, received: clock() when its frame was decoded
+    def command(self, source, message, received):
+        self.record(COMMAND, source, received, self.redact(message).encode()[:0xFFFF], self.clock() - received)
+
+    # hellos: (username, udp address, extended) of a batch, received: clock() when the batch started
+    # called by the single thread or event loop that reads the udp socket
+    def hellos(self, hellos, received):
+        elapsedNs = self.clock() - received
+        for username, clientAddress, extended in hellos:
+            source = self.udpSources.get(clientAddress)
+            if source is None:
+                source = self.udpSources[clientAddress] = self.new_source()
+                self.record(OPEN, source, received, ("udp %s:%s" % clientAddress[:2]).encode())
+            payload = "HELLO " + self.pseudonym(username) + (" +" if extended else "")
+            self.record(HELLO, source, received, payload.encode(), elapsedNs)
+
+    def run(self):
+        while not self.stopped.wait(self.flushInterval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.buffer:
+                return
+            data, self.buffer = self.buffer, bytearray()
+        try:
+            self.output.write(data)
+            self.output.flush()
+            self.written += len(data)
+        except OSError as oErr:
+            connectionLog.error("Traffic capture %s: %s", self.path, oErr)
+
+    # writes the records that are still buffered and closes the file
+    def close(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.output.close()
+        statsLog.info("Traffic capture %s: %s", self.path, self.stats())
+
+    def stats(self):
+        return {"records": self.records, "dropped": self.dropped, "bytes": self.written,
+                "sources": self.sources}
+
+
+# returns the wall clock time the capture started and the records of a capture file
+def read_capture(path):
+    with open(path, "rb") as capture:
+        data = capture.read()
+    if len(data) < FILE_HEADER.size:
+        raise ValueError(path + " is not a traffic capture")
+    magic, started = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(path + " is not a traffic capture")
+    records = []
+    offset = FILE_HEADER.size
+    # a capture of a registry that was killed may end in the middle of a record
+    while offset + RECORD.size <= len(data):
+        kind, micros, source, elapsed, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + length > len(data):
+            break
+        records.append(Record(kind, micros / 1e6, source, elapsed / 1e6, data[offset:offset + length]))
+        offset += length
+    return started, records
+
+
+# "tcp 10.0.0.5:51234" -> ("tcp", ("10.0.0.5", 51234))
+def parse_open(payload):
+    transport, address = payload.decode().split(" ", 1)
+    host, port = address.rsplit(":", 1)
+    return transport, (host, int(port))
@@ -0,0 +1,244 @@
+'''
+    ##  Write-behind of the presence and membership writes of the registry
+    ##  Logins, logouts and room removals are queued per user, a write that is replaced before
+    ##  it is flushed is never sent, and the queue is flushed to the storage in batches
+'''
+import logging
+import threading
+import time
+
+from log_pipeline import STATS
+
+ONLINE = "online"
+MEMBER = "member"
+
+statsLog = logging.getLogger(STATS)
+
+
+# queue of the deferred writes
+# each user has at most one pending write per kind: the last one replaces the earlier ones,
+# and a login that is followed by a logout in the same flush window is dropped altogether
+class WriteBehindQueue:
+
+    def __init__(self, storage, flushSize=500, flushInterval=0.05, reportInterval=60):
+        self.storage = storage
+        self.flushSize = flushSize
+        self.flushInterval = flushInterval
+        # (kind, username) -> (method name, arguments, first method in the window)
+        self.pending = {}
+        # batch that is being written to the storage
+        self.inflight = {}
+        # number of member writes that are pending or being flushed
+        self.memberWrites = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        # a single flush runs at a time so that batches are applied in order
+        self.flushLock = threading.Lock()
+        # metrics
+        self.enqueued = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.failed = 0
+        self.flushTime = 0.0
+        self.lastFlushTime = 0.0
+        self.maxFlushTime = 0.0
+        self.maxDepth = 0
+        self.reportInterval = reportInterval
+        self.lastReport = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, kind, username, method, arguments):
+        key = (kind, username)
+        with self.lock:
+            self.enqueued += 1
+            previous = self.pending.get(key)
+            first = method if previous is None else previous[2]
+            if previous is not None:
+                self.coalesced += 1
+            if first == "user_login" and method == "user_logout":
+                # the peer was not online before the login, nothing has to be written
+                del self.pending[key]
+                self.cancelled += 1
+            else:
+                if previous is None and kind == MEMBER:
+                    self.memberWrites += 1
+                self.pending[key] = (method, arguments, first)
+            self.maxDepth = max(self.maxDepth, len(self.pending))
+            if len(self.pending) >= self.flushSize:
+                self.wakeup.notify()
+
+    # presence mirror interface used by PresenceIndex
+    def login(self, username, ip, port):
+        self.put(ONLINE, username, "user_login", (username, ip, port))
+
+    def logout(self, username):
+        self.put(ONLINE, username, "user_logout", (username,))
+
+    def remove_member(self, username, room_name):
+        self.put(MEMBER, username, "remove_member", (username, room_name))
+
+    # drops the pending writes of a kind, e.g. when the whole collection is cleared
+    def discard(self, kind):
+        with self.lock:
+            for key in [key for key in self.pending if key[0] == kind]:
+                del self.pending[key]
+                if kind == MEMBER:
+                    self.memberWrites -= 1
+
+    # writes every pending write to the storage, returns the number of writes
+    def flush(self):
+        with self.flushLock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+                self.inflight = batch
+            if not batch:
+                return 0
+            members = sum(1 for kind, _ in batch if kind == MEMBER)
+            start = time.perf_counter()
+            try:
+                self.storage.apply_batch([(method, arguments) for method, arguments, _ in batch.values()])
+            except Exception as e:
+                self.failed += len(batch)
+                statsLog.error("Write-behind flush of %d writes failed: %s", len(batch), e)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    self.inflight = {}
+                    self.memberWrites -= members
+                    self.flushes += 1
+                    self.flushed += len(batch)
+                    self.flushTime += elapsed
+                    self.lastFlushTime = elapsed
+                    self.maxFlushTime = max(self.maxFlushTime, elapsed)
+            return len(batch)
+
+    # room a user is removed from by a write that is not in the storage yet, or None
+    def removed_from(self, username):
+        if not self.memberWrites:
+            return None
+        key = (MEMBER, username)
+        write = self.pending.get(key) or self.inflight.get(key)
+        return write[1][1] if write is not None else None
+
+    # members of a room without the ones whose removal is not in the storage yet
+    def visible_members(self, room_name, members):
+        if not self.memberWrites or not isinstance(members, list):
+            return members
+        return [member for member in members if self.removed_from(member["username"]) != room_name]
+
+    def run(self):
+        while True:
+            with self.lock:
+                if len(self.pending) < self.flushSize:
+                    self.wakeup.wait(self.flushInterval)
+            self.flush()
+            self.report()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "depth": len(self.pending),
+                "max_depth": self.maxDepth,
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "cancelled": self.cancelled,
+                "flushes": self.flushes,
+                "flushed": self.flushed,
+                "failed": self.failed,
+                "flush_ms_last": self.lastFlushTime * 1000,
+                "flush_ms_max": self.maxFlushTime * 1000,
+                "flush_ms_mean": self.flushTime * 1000 / self.flushes if self.flushes else 0.0,
+            }
+
+    def report(self):
+        if time.monotonic() - self.lastReport >= self.reportInterval:
+            self.lastReport = time.monotonic()
+            statsLog.info("Write-behind: %s", self.stats())
+
+
+# storage seen by the registry when the writes are deferred
+# presence and room removals go to the queue, the reads of the rooms leave out the members whose
+# removal is still queued so the registry always reads its own writes, everything else is
+# passed to the storage unchanged
+class WriteBehindStorage:
+
+    def __init__(self, storage, queue):
+        self.storage = storage
+        self.queue = queue
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def user_login(self, username, ip, port):
+        self.queue.login(username, ip, port)
+
+    def user_logout(self, username):
+        self.queue.logout(username)
+
+    def remove_member(self, username, room_name):
+        self.queue.remove_member(username, room_name)
+        return f"Member '{username}' removed from the chatroom '{room_name}' successfully."
+
+    def leave_room(self, username, room_name):
+        return self.remove_member(username, room_name)
+
+    # writes of a batch are queued in order like the single writes
+    def apply_batch(self, writes):
+        for method, arguments in writes:
+            getattr(self, method)(*arguments)
+
+    def is_account_online(self, username):
+        self.queue.flush()
+        return self.storage.is_account_online(username)
+
+    def get_peer_ip_port(self, username):
+        self.queue.flush()
+        return self.storage.get_peer_ip_port(username)
+
+    def delete_all_online_peers(self):
+        self.queue.discard(ONLINE)
+        return self.storage.delete_all_online_peers()
+
+    def add_member(self, room_name, username, ip_address, tcp_port_number, udp_port_number):
+        # a user that rejoins right after leaving waits for the removal to be written
+        if self.queue.removed_from(username) is not None:
+            self.queue.flush()
+        return self.storage.add_member(room_name, username, ip_address, tcp_port_number, udp_port_number)
+
+    def is_member_inroom(self, username):
+        member, room_name = self.storage.is_member_inroom(username)
+        if member and self.queue.removed_from(username) == room_name:
+            return False, None
+        return member, room_name
+
+    def get_chatroom_members(self, room_name):
+        members = self.queue.visible_members(room_name, self.storage.get_chatroom_members(room_name))
+        return members if members else "Member not found."
+
+    # pages are filled up again when queued removals leave members out of them
+    def get_chatroom_members_page(self, room_name, after=None, limit=100):
+        members = []
+        while True:
+            page, after = self.storage.get_chatroom_members_page(room_name, after, limit - len(members))
+            members += self.queue.visible_members(room_name, page)
+            if after is None or len(members) >= limit:
+                return members, after
+
+    def iter_chatroom_members(self, room_name, page_size=500):
+        for member in self.storage.iter_chatroom_members(room_name, page_size):
+            if self.queue.removed_from(member["username"]) != room_name:
+                yield member
+
+    def delete_all_members(self):
+        self.queue.discard(MEMBER)
+        return self.storage.delete_all_members()
+
+    def close(self):
+        self.queue.flush()
+        self.storage.close()